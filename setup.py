@@ -28,6 +28,7 @@ requirements = [
     'jsonfield2',
     'nltk',
     'progressbar2',
+    'publicsuffix2',
     'redis',
     'scrapy',
     'shortuuid',
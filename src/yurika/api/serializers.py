@@ -1,4 +1,7 @@
+import json
+
 from django.utils.translation import gettext_lazy as _
+from elasticsearch_dsl import Search, exceptions
 from rest_framework import serializers
 
 from yurika.accounts import models as accounts
@@ -20,10 +23,23 @@ class AccountSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
+class CrawlerStatsSerializer(serializers.ModelSerializer):
+    eta = serializers.DurationField(read_only=True, help_text=_("Estimated time to download the pending requests."))
+
+    class Meta:
+        model = mortar.CrawlerStats
+        fields = [
+            'timestamp', 'pages', 'bytes', 'items', 'indexed', 'pending', 'blocked', 'max_distance',
+            'page_rate', 'byte_rate', 'item_rate', 'flush_latency', 'eta',
+        ]
+
+
 class NestedCrawlerTaskSerializer(serializers.ModelSerializer):
+    stats = CrawlerStatsSerializer(source='latest_stats', read_only=True)
+
     class Meta:
         model = mortar.CrawlerTask
-        fields = ['message_id', 'status', 'started_at', 'finished_at', 'revoked']
+        fields = ['message_id', 'status', 'started_at', 'finished_at', 'revoked', 'stats']
 
 
 class CrawlerSerializer(serializers.HyperlinkedModelSerializer):
@@ -40,3 +56,47 @@ class CrawlerSerializer(serializers.HyperlinkedModelSerializer):
         extra_kwargs = {
             'url': {'lookup_field': 'uuid'},
         }
+
+
+class NestedAnnotationTaskSerializer(serializers.ModelSerializer):
+    eta = serializers.DurationField(read_only=True, help_text=_("Estimated time to process the remaining sentences."))
+
+    class Meta:
+        model = mortar.AnnotationTask
+        fields = [
+            'message_id', 'status', 'started_at', 'finished_at', 'revoked',
+            'total', 'processed', 'rate', 'eta',
+        ]
+
+
+class AnnotationSerializer(serializers.HyperlinkedModelSerializer):
+    crawler = serializers.HyperlinkedRelatedField(
+        view_name='crawler-detail', lookup_field='uuid', queryset=mortar.Crawler.objects.all(),
+    )
+
+    task = NestedAnnotationTaskSerializer(read_only=True)
+
+    class Meta:
+        model = mortar.Annotation
+        fields = ['url', 'crawler', 'query', 'slices', 'auto_refresh', 'refreshed_at', 'task']
+
+    def validate_crawler(self, value):
+        account = self.context['request'].user.account
+        if not mortar.CrawlerAccount.objects.filter(crawler=value, account=account).exists():
+            raise serializers.ValidationError(_("Invalid crawler."))
+        return value
+
+    def validate_query(self, value):
+        try:
+            query = json.loads(value)
+        except json.JSONDecodeError:
+            raise serializers.ValidationError(_("Invalid JSON."))
+
+        if not isinstance(query, dict):
+            raise serializers.ValidationError(_("Query must be a JSON object."))
+
+        try:
+            Search.from_dict(query)
+        except exceptions.ElasticsearchDslException as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
@@ -6,5 +6,6 @@ from . import views
 router = routers.DefaultRouter()
 router.register(r'accounts', views.AccountViewSet)
 router.register(r'crawlers', views.CrawlerViewSet)
+router.register(r'annotations', views.AnnotationViewSet)
 
 urlpatterns = router.urls
@@ -1,4 +1,6 @@
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
 from yurika.accounts import models as accounts
 from yurika.mortar import models as mortar
@@ -13,7 +15,8 @@ class AccountViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class CrawlerViewSet(viewsets.ModelViewSet):
-    queryset = mortar.Crawler.objects.all()
+    queryset = mortar.Crawler.objects.select_related('task') \
+        .prefetch_related(mortar.CrawlerTask.prefetch_latest_stats('task__stats'))
     serializer_class = serializers.CrawlerSerializer
     lookup_field = 'uuid'
 
@@ -30,3 +33,35 @@ class CrawlerViewSet(viewsets.ModelViewSet):
             crawler=crawler,
             account=account,
         )
+
+
+class AnnotationViewSet(viewsets.ModelViewSet):
+    queryset = mortar.Annotation.objects.select_related('task')
+    serializer_class = serializers.AnnotationSerializer
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        return super().get_queryset() \
+            .filter(crawler__crawleraccount__account=self.request.user.account)
+
+    def perform_create(self, serializer):
+        # the annotation is executed by a worker, and its progress is reported by its task
+        annotation = serializer.save()
+        annotation.start()
+
+        # the task's status is updated by the broker middleware
+        annotation.task.refresh_from_db()
+
+    @action(detail=True, methods=['post'])
+    def refresh(self, request, pk=None):
+        """
+        Add the matching sentences that were tokenized since the annotation
+        was last executed.
+        """
+        annotation = self.get_object()
+        try:
+            annotation.refresh()
+        except RuntimeError as exc:
+            raise ValidationError(str(exc))
+
+        return self.retrieve(request, pk=pk)
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zlib
+
+
+__all__ = ['BlobStore']
+
+
+class BlobStore:
+    """
+    Content-addressed storage for text on the local filesystem.
+
+    Blobs are zlib-compressed, and stored by the SHA-1 digest of their content,
+    so storing the same content multiple times is a no-op. Writes are atomic,
+    and the store may be written to from multiple threads or processes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        # shard by prefix, to avoid overly large directories
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, text):
+        """
+        Store the text, returning its digest.
+        """
+        data = text.encode()
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(zlib.compress(data))
+                os.replace(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+        return digest
+
+    def get(self, digest):
+        """
+        Return the text stored under the digest.
+        """
+        with open(self.path(digest), 'rb') as file:
+            return zlib.decompress(file.read()).decode()
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def clear(self):
+        """
+        Remove the store and all of its blobs.
+        """
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
@@ -0,0 +1,159 @@
+"""
+Bloom filters for tracking seen keys in a bounded amount of memory.
+"""
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+
+
+__all__ = ['BloomFilter', 'ScalableBloomFilter']
+
+
+class BloomFilter:
+    """
+    A Bloom filter sized for `capacity` keys at the given false positive rate.
+
+    If a `path` is provided, the filter is backed by a memory-mapped file, so
+    that it is persisted as it's updated. An existing file is reopened with
+    its original size, regardless of `capacity` and `error_rate`.
+    """
+    # magic, size (in bits), number of hashes, capacity, count
+    HEADER = struct.Struct('<4sQQQQ')
+    COUNT = struct.Struct('<Q')
+    COUNT_OFFSET = 28
+    MAGIC = b'BLM2'
+
+    def __init__(self, capacity, error_rate=1e-6, path=None):
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+
+        self.path = path
+        self.file = None
+
+        if path is None:
+            self.size, self.hashes, self.capacity, self.count = size, hashes, capacity, 0
+            self.bits = bytearray(math.ceil(size / 8))
+        else:
+            self.bits = self._open(path, size, hashes, capacity)
+
+    def _open(self, path, size, hashes, capacity):
+        if os.path.exists(path):
+            self.file = open(path, 'r+b')
+            magic, size, hashes, capacity, count = self.HEADER.unpack(self.file.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                self.file.close()
+                raise ValueError(f"'{path}' is not a bloom filter.")
+        else:
+            count = 0
+            self.file = open(path, 'w+b')
+            self.file.write(self.HEADER.pack(self.MAGIC, size, hashes, capacity, count))
+            self.file.truncate(self.HEADER.size + math.ceil(size / 8))
+
+        self.size, self.hashes, self.capacity, self.count = size, hashes, capacity, count
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        return memoryview(self.mmap)[self.HEADER.size:]
+
+    def _indexes(self, key):
+        # enhanced double hashing, which avoids the poor accuracy of plain
+        # double hashing in small filters - see Dillinger & Manolios (2004)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(h1 + i * h2 + (i ** 3 - i) // 6) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(key))
+
+    def add(self, key):
+        """
+        Add the key, returning whether it was (probably) already present.
+        """
+        bits, present = self.bits, True
+        for i in self._indexes(key):
+            mask = 1 << (i & 7)
+            if not bits[i >> 3] & mask:
+                bits[i >> 3] |= mask
+                present = False
+
+        if not present:
+            self.count += 1
+            if self.file is not None:
+                self.COUNT.pack_into(self.mmap, self.COUNT_OFFSET, self.count)
+        return present
+
+    def close(self):
+        if self.file is not None:
+            self.bits.release()
+            self.mmap.close()
+            self.file.close()
+            self.file = None
+
+
+class ScalableBloomFilter:
+    """
+    A Bloom filter that grows as keys are added, while bounding the overall
+    false positive rate to `error_rate`.
+
+    Keys are added to a series of filters, where each filter is `growth` times
+    larger than the last, and has a tighter error rate (by `tightening`). See:
+    http://gsd.di.uminho.pt/members/cbm/ps/dbloom.pdf
+
+    If a `path` is provided, the filters are persisted as files in the given
+    directory (see `BloomFilter`).
+    """
+    FILENAME = re.compile(r'^(\d+)\.bloom$')
+
+    def __init__(self, initial_capacity, error_rate=1e-6, path=None, growth=2, tightening=0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            numbers = sorted(
+                int(match.group(1)) for match in map(self.FILENAME.match, os.listdir(path)) if match
+            )
+            # existing filters are reopened with their original parameters
+            for n in numbers:
+                self.filters.append(BloomFilter(1, path=self._filename(n)))
+
+        if not self.filters:
+            self._grow()
+
+    def _filename(self, n):
+        return os.path.join(self.path, f'{n}.bloom')
+
+    def _grow(self):
+        n = len(self.filters)
+        capacity = self.initial_capacity * self.growth ** n
+        error_rate = self.error_rate * (1 - self.tightening) * self.tightening ** n
+        path = self._filename(n) if self.path is not None else None
+
+        self.filters.append(BloomFilter(capacity, error_rate, path))
+
+    def __contains__(self, key):
+        return any(key in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, key):
+        """
+        Add the key, returning whether it was (probably) already present.
+        """
+        if key in self:
+            return True
+
+        if self.filters[-1].count >= self.filters[-1].capacity:
+            self._grow()
+        return self.filters[-1].add(key)
+
+    def close(self):
+        for bloom in self.filters:
+            bloom.close()
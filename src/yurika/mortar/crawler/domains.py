@@ -0,0 +1,75 @@
+import functools
+
+
+__all__ = ['DomainMatcher', 'registered_domain']
+
+
+@functools.lru_cache()
+def public_suffix_list():
+    """
+    Load the public suffix list bundled with `publicsuffix2`, which is
+    compiled into a trie once per process.
+    """
+    from publicsuffix2 import PublicSuffixList
+    return PublicSuffixList()
+
+
+def registered_domain(host):
+    """
+    Return the registrable domain (eTLD+1) of a hostname. For example, both
+    'a.example.co.uk' and 'b.example.co.uk' are registered as 'example.co.uk'.
+
+    IP addresses are returned as-is.
+    """
+    # public suffixes never end with a digit, and IPv6 addresses contain colons
+    if not host or host[-1].isdigit() or ':' in host:
+        return host
+    return public_suffix_list().get_sld(host) or host
+
+
+class DomainMatcher:
+    """
+    Match hostnames against a list of domains.
+
+    - 'domain.org' matches the domain and all of its subdomains.
+    - '.domain.org' only matches the subdomains of the domain.
+
+    Rather than scanning the list of domains (e.g., as a regex alternation),
+    each suffix of the hostname's labels is looked up in a set, so a match is
+    O(labels) regardless of the number of domains.
+
+    `search()` mirrors the regex interface, so a matcher may be used in place
+    of a compiled host regex.
+    """
+
+    def __init__(self, domains):
+        self.domains = set()
+        self.subdomains = set()
+
+        for domain in domains:
+            domain = domain.lower()
+            if domain.startswith('.'):
+                self.subdomains.add(domain[1:])
+            else:
+                self.domains.add(domain)
+
+    def __len__(self):
+        return len(self.domains) + len(self.subdomains)
+
+    def search(self, host):
+        """
+        Return the domain that matches the hostname, or None.
+        """
+        if host in self.domains:
+            return host
+
+        index = host.find('.')
+        while index != -1:
+            suffix = host[index + 1:]
+            if suffix in self.domains:
+                return suffix
+            if suffix in self.subdomains:
+                return '.' + suffix
+            index = host.find('.', index + 1)
+
+        return None
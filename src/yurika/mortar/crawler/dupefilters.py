@@ -0,0 +1,58 @@
+import logging
+import os
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+from .bloom import ScalableBloomFilter
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """
+    Request fingerprint duplicates filter, backed by a scalable bloom filter.
+
+    Unlike `RFPDupeFilter`, which keeps every fingerprint in memory and in the
+    `JOBDIR/requests.seen` file, memory use is bounded by the filter's size,
+    and resuming a crawl only maps the filter files in `JOBDIR/requests.bloom`.
+
+    The filter's initial size is set by `DUPEFILTER_CAPACITY`, and its overall
+    false positive rate by `DUPEFILTER_ERROR_RATE`. False positives cause
+    unseen requests to be filtered.
+    """
+    dirname = 'requests.bloom'
+
+    def __init__(self, path=None, debug=False, capacity=1000000, error_rate=1e-6):
+        self.file = None
+        self.logdupes = True
+        self.debug = debug
+        self.logger = logging.getLogger(__name__)
+
+        if not path:
+            self.fingerprints = ScalableBloomFilter(capacity, error_rate)
+            return
+
+        bloom_path = os.path.join(path, self.dirname)
+        created = not os.path.exists(bloom_path)
+        self.fingerprints = ScalableBloomFilter(capacity, error_rate, bloom_path)
+
+        # import the fingerprints of jobs started with the default dupefilter
+        seen_path = os.path.join(path, 'requests.seen')
+        if created and os.path.exists(seen_path):
+            with open(seen_path) as file:
+                for line in file:
+                    self.fingerprints.add(line.rstrip())
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            job_dir(settings),
+            debug=settings.getbool('DUPEFILTER_DEBUG'),
+            capacity=settings.getint('DUPEFILTER_CAPACITY', 1000000),
+            error_rate=settings.getfloat('DUPEFILTER_ERROR_RATE', 1e-6),
+        )
+
+    def request_seen(self, request):
+        return self.fingerprints.add(self.request_fingerprint(request))
+
+    def close(self, reason):
+        self.fingerprints.close()
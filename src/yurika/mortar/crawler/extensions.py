@@ -0,0 +1,101 @@
+import logging
+from time import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import threads
+from twisted.internet.task import LoopingCall
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStats(object):
+    """
+    Save a snapshot of the crawl stats for the spider's `task` every
+    `TASK_STATS_INTERVAL` seconds, and when the spider is closed (see
+    `models.CrawlerStats`). This allows the crawl's progress to be reported
+    without querying the crawl process or its index.
+
+    Rates are averaged over the interval since the previous snapshot. The
+    stats are collected on the reactor thread, but saved from a thread.
+    """
+    COUNTS = {
+        'pages': 'response_received_count',
+        'bytes': 'downloader/response_bytes',
+        'items': 'item_scraped_count',
+        'indexed': 'documents/flushed',
+        'blocked': 'block/filtered',
+        'max_distance': 'request_distance_max',
+    }
+
+    RATES = {
+        'page_rate': 'pages',
+        'byte_rate': 'bytes',
+        'item_rate': 'items',
+    }
+
+    def __init__(self, crawler, interval):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+
+        self.task = None
+        self.loop = None
+        self.previous = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('TASK_STATS_INTERVAL', 10)
+        if not interval:
+            raise NotConfigured
+
+        o = cls(crawler, interval)
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider):
+        self.task = getattr(spider, 'task', None)
+        if self.task is None:
+            return
+
+        self.previous = time(), {name: 0 for name in self.RATES.values()}
+        self.loop = LoopingCall(self.snapshot, spider)
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+
+        if self.task is not None:
+            return self.snapshot(spider)
+
+    def pending(self):
+        slot = self.crawler.engine.slot
+        return len(slot.scheduler) if slot is not None else 0
+
+    def values(self, spider):
+        values = {
+            name: self.stats.get_value(key, 0, spider=spider)
+            for name, key in self.COUNTS.items()
+        }
+        values['pending'] = self.pending()
+        values['flush_latency'] = self.stats.get_value('documents/flush_latency', spider=spider)
+
+        now = time()
+        timestamp, previous = self.previous
+        elapsed = now - timestamp
+        for rate, name in self.RATES.items():
+            values[rate] = (values[name] - previous[name]) / elapsed if elapsed > 0 else 0
+        self.previous = now, values
+
+        return values
+
+    def snapshot(self, spider):
+        def failed(failure):
+            # don't propagate, as this would stop the snapshot loop
+            logger.error('Failed to save crawl stats: %s', failure.value, extra={'spider': spider})
+
+        d = threads.deferToThread(self.task.save_stats, **self.values(spider))
+        return d.addErrback(failed)
@@ -0,0 +1,81 @@
+"""
+Content fingerprints for detecting duplicate documents.
+
+`content_hash` identifies exact duplicates of a document's text, while
+`simhash` is a locality sensitive hash, where similar texts have hashes that
+differ by a small number of bits (see `distance`).
+"""
+import hashlib
+import re
+from collections import Counter
+
+
+__all__ = ['content_hash', 'simhash', 'distance']
+
+
+TOKENS = re.compile(r'\w+')
+
+SIMHASH_BITS = 64
+LANE_BITS = 32
+LANE_MASK = (1 << LANE_BITS) - 1
+
+
+def _spread(byte):
+    # spread each bit of the byte into its own lane
+    return sum(1 << (bit * LANE_BITS) for bit in range(8) if byte & (1 << bit))
+
+
+# `SPREAD[n][byte]` spreads the nth byte of a hash into lanes `8n` to `8n + 7`
+SPREAD = [
+    [_spread(byte) << (n * 8 * LANE_BITS) for byte in range(256)]
+    for n in range(SIMHASH_BITS // 8)
+]
+
+
+def content_hash(text):
+    """
+    SHA-1 hex digest of the text, ignoring differences in whitespace.
+    """
+    return hashlib.sha1(' '.join(text.split()).encode()).hexdigest()
+
+
+def shingles(text, size=3):
+    """
+    Overlapping word n-grams of the lowercased text.
+    """
+    words = TOKENS.findall(text.lower())
+    if len(words) < size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text):
+    """
+    64-bit SimHash of the text's shingles, as a 16 character hex string.
+    """
+    features = Counter(shingles(text))
+
+    # Rather than keeping 64 separate counters, the per-bit counts are packed
+    # into lanes of a single integer, so each feature is summed with 8 lookups.
+    counts, total = 0, 0
+    for feature, weight in features.items():
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        spread = 0
+        for n, byte in enumerate(digest):
+            spread += SPREAD[n][byte]
+        counts += spread * weight
+        total += weight
+
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if ((counts >> (bit * LANE_BITS)) & LANE_MASK) * 2 > total:
+            value |= 1 << bit
+
+    return '%016x' % value
+
+
+def distance(a, b):
+    """
+    Hamming distance between two simhashes.
+    """
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
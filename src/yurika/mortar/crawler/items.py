@@ -0,0 +1,9 @@
+from scrapy.item import Field, Item
+
+
+class DocumentItem(Item):
+    """
+    Wraps a crawled `documents.Document`, as Scrapy only accepts dicts and
+    items as spider output.
+    """
+    document = Field()
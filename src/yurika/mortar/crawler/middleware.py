@@ -1,13 +1,23 @@
 import functools
 import logging
 import re
+import warnings
+from collections import Counter
 
+from scrapy import signals
 from scrapy.http import Request
+from scrapy.spidermiddlewares import offsite
 from scrapy.utils.httpobj import urlparse_cached
 
+from . import domains
+from .domains import DomainMatcher
+from .scheduler import request_domain
+
 
 logger = logging.getLogger(__name__)
 
+URL_PATTERN = re.compile(r'^https?://.*$')
+
 
 class LogExceptionMiddleware(object):
 
@@ -29,15 +39,23 @@ class BlockedDomainMiddleware(object):
     """
     Similar to OffsiteMiddleware, but blocks instead of allows domains.
 
-    The spider should accept a list of `blocked_domains`.
+    The spider should accept a list of `blocked_domains`. These are validated
+    when the middleware is created, so that invalid domains fail the crawl.
     """
 
-    def __init__(self, stats):
+    def __init__(self, stats, spider=None):
         self.stats = stats
+        self.host_regex = self.get_host_regex(spider) if spider is not None else None
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.stats)
+        # the spider is created before the engine and its middleware
+        o = cls(crawler.stats, crawler.spider)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_closed(self, spider):
+        self.host_regex = None
 
     def process_spider_output(self, response, result, spider):
         for item in result:
@@ -47,55 +65,115 @@ class BlockedDomainMiddleware(object):
                 yield item
 
     def should_block(self, request, spider):
-        block_re = self.get_host_regex(spider)
+        block_re = self.host_regex
         if block_re is None or request.dont_filter:
             return False
 
         host = urlparse_cached(request).hostname or ''
         return bool(block_re.search(host))
 
-    @functools.lru_cache()
     def get_host_regex(self, spider):
         blocked_domains = getattr(spider, 'blocked_domains', None)
         if not blocked_domains:
             return None
 
         for domain in blocked_domains:
-            assert domain, "blocked_domains only accepts domains, not empty values."
+            if not domain:
+                raise ValueError("blocked_domains only accepts domains, not empty values.")
 
             # domains should not contain a scheme (//) or a path (/)
-            assert '/' not in domain, "blocked_domains only accepts domains, not URLs."
+            if '/' in domain:
+                raise ValueError("blocked_domains only accepts domains, not URLs.")
+
+        return DomainMatcher(blocked_domains)
+
+
+class OffsiteMiddleware(offsite.OffsiteMiddleware):
+    """
+    OffsiteMiddleware that matches the `allowed_domains` with a `DomainMatcher`
+    instead of a regex.
+    """
+
+    def get_host_regex(self, spider):
+        allowed_domains = getattr(spider, 'allowed_domains', None)
+        if not allowed_domains:
+            return super().get_host_regex(spider)
+
+        domains = []
+        for domain in allowed_domains:
+            if domain is None:
+                continue
+
+            if URL_PATTERN.match(domain):
+                warnings.warn("allowed_domains accepts only domains, not URLs. "
+                              "Ignoring URL entry %s in allowed_domains." % domain, offsite.URLWarning)
+            else:
+                domains.append(domain)
 
-        return re.compile(r'^(.*)(%s)' % '|'.join(re.escape(d) for d in blocked_domains))
+        return DomainMatcher(domains)
 
 
 class DistanceMiddleware(object):
     """
     Similar to DepthMiddleware, but the distance/depth only increases
     when traversing to a different domain.
+
+    By default, domains are compared by their full hostname. Setting
+    `DISTANCE_REGISTERED_DOMAIN` compares their registrable domain instead,
+    so that traversing between subdomains of the same site (e.g., from
+    'a.example.com' to 'b.example.com') doesn't increase the distance.
+
+    With `DISTANCE_STATS_VERBOSE`, the request counts per distance are
+    aggregated in memory, and added to the stats when the spider is closed.
+
+    Like `DEPTH_PRIORITY`, `DISTANCE_PRIORITY` adjusts the request priority
+    by its distance. A positive value prioritizes nearby requests, and a
+    value larger than the maximum depth orders requests by their distance,
+    then by their depth.
     """
 
-    def __init__(self, stats, maxdist, verbose):
+    def __init__(self, stats, maxdist, verbose, registered_domain=False, prio=0):
         self.stats = stats
         self.maxdist = maxdist
         self.verbose = verbose
+        self.prio = prio
+        self.counts = Counter()
+
+        if registered_domain:
+            self.domain = functools.lru_cache(maxsize=4096)(domains.registered_domain)
+        else:
+            self.domain = lambda host: host
 
     @classmethod
     def from_crawler(cls, crawler):
         settings = crawler.settings
         distance = settings.getint('DISTANCE_LIMIT')
         verbose = settings.getbool('DISTANCE_STATS_VERBOSE')
-        return cls(crawler.stats, distance, verbose)
+        registered_domain = settings.getbool('DISTANCE_REGISTERED_DOMAIN')
+        prio = settings.getint('DISTANCE_PRIORITY')
+        o = cls(crawler.stats, distance, verbose, registered_domain, prio)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_closed(self, spider):
+        for distance, count in sorted(self.counts.items()):
+            self.stats.inc_value(f'request_distance_count/{distance}', count, spider=spider)
+        self.counts.clear()
 
     def process_spider_output(self, response, result, spider):
+        # the response domain is only resolved once for all of its requests
+        response_domain = self.get_domain(response)
+        response_distance = response.meta.get('distance', 0)
+        max_distance = None
+
         for item in result:
             if not isinstance(item, Request):
                 yield item
                 continue
 
             # only increase with domain change
-            distance = response.meta.get('distance', 0)
-            if self.different_domains(response, item):
+            distance = response_distance
+            if self.get_domain(item) != response_domain:
                 distance += 1
 
             if self.maxdist and distance > self.maxdist:
@@ -105,13 +183,142 @@ class DistanceMiddleware(object):
                 )
             else:
                 if self.verbose:
-                    self.stats.inc_value(f'request_distance_count/{distance}', spider=spider)
-                self.stats.max_value('request_distance_max', distance, spider=spider)
+                    self.counts[distance] += 1
+                if max_distance is None or distance > max_distance:
+                    max_distance = distance
                 item.meta['distance'] = distance
+                if self.prio:
+                    item.priority -= distance * self.prio
 
                 yield item
 
+        if max_distance is not None:
+            self.stats.max_value('request_distance_max', max_distance, spider=spider)
+
+    def get_domain(self, request_or_response):
+        return self.domain(urlparse_cached(request_or_response).hostname or '')
+
     def different_domains(self, response, request):
-        a = urlparse_cached(response).hostname or ''
-        b = urlparse_cached(request).hostname or ''
-        return a != b
+        return self.get_domain(response) != self.get_domain(request)
+
+
+class DomainConcurrencyMiddleware(object):
+    """
+    Downloader middleware that assigns each request to a download slot for its
+    registrable domain, records per-domain throughput, and adapts the
+    concurrency of each slot to its observed latency and errors.
+
+    Concurrency starts at `CONCURRENT_REQUESTS_PER_DOMAIN`, and is adjusted
+    within `ADAPTIVE_CONCURRENCY_MIN` and `ADAPTIVE_CONCURRENCY_MAX`:
+
+    - Errors (download exceptions, and 429/5xx responses) halve it.
+    - Responses increase it by one while the domain's average latency is
+      within `ADAPTIVE_CONCURRENCY_TARGET_LATENCY`, and decrease it by one
+      while the average is over twice the target.
+
+    Set `ADAPTIVE_CONCURRENCY_ENABLED` to False to only assign slots and record
+    stats. The middleware should be ordered after the `RetryMiddleware`, so
+    that it sees responses and exceptions before they're retried.
+
+    Per-domain throughput is aggregated in memory, as a broad crawl may visit
+    any number of domains. When the spider is closed, the number of domains
+    and the stats of the `DOMAIN_STATS_TOP` busiest domains are added to the
+    crawl stats.
+    """
+    ERROR_STATUSES = {429, 500, 502, 503, 504}
+    LATENCY_WEIGHT = 0.3
+
+    def __init__(self, crawler, enabled=True, start=8, minimum=1, maximum=32, target_latency=1.0, top=10):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.enabled = enabled
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.top = top
+
+        self.concurrency = {}
+        self.latency = {}
+        self.responses = Counter()
+        self.bytes = Counter()
+        self.errors = Counter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        o = cls(
+            crawler,
+            enabled=settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED', True),
+            start=settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'),
+            minimum=settings.getint('ADAPTIVE_CONCURRENCY_MIN', 1),
+            maximum=settings.getint('ADAPTIVE_CONCURRENCY_MAX', 32),
+            target_latency=settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_LATENCY', 1.0),
+            top=settings.getint('DOMAIN_STATS_TOP', 10),
+        )
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_closed(self, spider):
+        self.stats.set_value('domain/count', len(self.responses | self.errors), spider=spider)
+
+        for domain, _ in (self.responses + self.errors).most_common(self.top):
+            self.stats.set_value(f'domain/{domain}/response_count', self.responses[domain], spider=spider)
+            self.stats.set_value(f'domain/{domain}/response_bytes', self.bytes[domain], spider=spider)
+            self.stats.set_value(f'domain/{domain}/error_count', self.errors[domain], spider=spider)
+
+            if domain in self.concurrency:
+                self.stats.set_value(f'domain/{domain}/concurrency', self.concurrency[domain], spider=spider)
+            if domain in self.latency:
+                self.stats.set_value(f'domain/{domain}/latency', self.latency[domain], spider=spider)
+
+    def process_request(self, request, spider):
+        domain = request_domain(request)
+
+        # slots are garbage collected when idle, and recreated with the default concurrency
+        if domain in self.concurrency:
+            self.update_slot(domain)
+
+    def process_response(self, request, response, spider):
+        domain = request_domain(request)
+        self.responses[domain] += 1
+        self.bytes[domain] += len(response.body)
+
+        error = response.status in self.ERROR_STATUSES
+        if error:
+            self.errors[domain] += 1
+
+        self.adjust(domain, request.meta.get('download_latency'), error)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        domain = request_domain(request)
+        self.errors[domain] += 1
+        self.adjust(domain, None, True)
+
+    def adjust(self, domain, latency, error):
+        if not self.enabled:
+            return
+
+        average = self.latency.get(domain)
+        if latency is not None:
+            average = latency if average is None else \
+                average + (latency - average) * self.LATENCY_WEIGHT
+            self.latency[domain] = average
+
+        concurrency = self.concurrency.get(domain, self.start)
+        if error:
+            concurrency //= 2
+        elif average is not None and average <= self.target_latency:
+            concurrency += 1
+        elif average is not None and average > self.target_latency * 2:
+            concurrency -= 1
+
+        concurrency = max(self.minimum, min(self.maximum, concurrency))
+        self.concurrency[domain] = concurrency
+        self.update_slot(domain)
+
+    def update_slot(self, domain):
+        slot = self.crawler.engine.downloader.slots.get(domain)
+        if slot is not None:
+            slot.concurrency = self.concurrency[domain]
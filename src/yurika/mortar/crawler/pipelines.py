@@ -0,0 +1,302 @@
+import logging
+import os
+from multiprocessing import get_context
+from time import time
+
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.job import job_dir
+from scrapy.utils.misc import load_object
+from twisted.internet import defer, reactor, threads
+from twisted.internet.task import LoopingCall
+from twisted.python.threadpool import ThreadPool
+
+from . import fingerprints
+from .bloom import ScalableBloomFilter
+from .items import DocumentItem
+
+
+logger = logging.getLogger(__name__)
+
+spawn = get_context('spawn')
+
+
+class TextExtractionPipeline(object):
+    """
+    Extract the title and text of crawled documents from their HTML, using
+    the `TEXT_EXTRACTOR` (see `extractors`).
+
+    By default, extraction blocks the reactor thread. Setting
+    `TEXT_EXTRACTOR_PROCESSES` sends the HTML to a pool of extractor processes
+    instead, and the item is held (as a deferred) until its text is returned.
+    The downloader keeps running in the meantime, and Scrapy backs off once the
+    held responses exceed `SCRAPER_SLOT_MAX_ACTIVE_SIZE`.
+    """
+
+    def __init__(self, extractor, processes=0):
+        self.extractor = extractor
+        self.processes = processes
+        self.pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        extractor = settings.get('TEXT_EXTRACTOR', 'yurika.mortar.crawler.extractors.lxml_extractor')
+        return cls(load_object(extractor), settings.getint('TEXT_EXTRACTOR_PROCESSES', 0))
+
+    def open_spider(self, spider):
+        if self.processes:
+            self.pool = spawn.Pool(self.processes)
+
+    def close_spider(self, spider):
+        # items are processed before the pipeline is closed, so no work is pending
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def process_item(self, item, spider):
+        if not isinstance(item, DocumentItem):
+            return item
+
+        html = item['document'].html
+        if self.pool is None:
+            return self.extracted(self.extractor(html), item)
+
+        # pool callbacks are run from the pool's result handler thread
+        dfd = defer.Deferred()
+        self.pool.apply_async(
+            self.extractor, (html, ),
+            callback=lambda result: reactor.callFromThread(dfd.callback, result),
+            error_callback=lambda exc: reactor.callFromThread(dfd.errback, exc),
+        )
+        return dfd.addCallback(self.extracted, item)
+
+    def extracted(self, result, item):
+        doc = item['document']
+        doc.title, doc.text = result
+        return item
+
+
+class DedupePipeline(object):
+    """
+    Fingerprint crawled documents, and drop documents whose text is an exact
+    duplicate of a previously crawled document (e.g., mirrors, or URLs that
+    only differ by their query parameters).
+
+    Content hashes are tracked by a bloom filter, which is persisted in the
+    `JOBDIR`, so that resumed crawls skip previously crawled content. The
+    filter's initial size is set by `DEDUPE_CAPACITY`, and its false positive
+    rate by `DEDUPE_ERROR_RATE` - note that false positives cause unique
+    documents to be dropped. Near-duplicates are
+    not dropped, but their `simhash` is stored for later comparison.
+    """
+    filename = 'documents.bloom'
+
+    def __init__(self, stats, capacity, error_rate, path=None):
+        self.stats = stats
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.seen = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DEDUPE_ENABLED', True):
+            raise NotConfigured
+
+        path = job_dir(settings)
+        return cls(
+            crawler.stats,
+            capacity=settings.getint('DEDUPE_CAPACITY', 1000000),
+            error_rate=settings.getfloat('DEDUPE_ERROR_RATE', 1e-6),
+            path=os.path.join(path, cls.filename) if path else None,
+        )
+
+    def open_spider(self, spider):
+        self.seen = ScalableBloomFilter(self.capacity, self.error_rate, self.path)
+
+    def close_spider(self, spider):
+        self.seen.close()
+
+    def process_item(self, item, spider):
+        if not isinstance(item, DocumentItem):
+            return item
+
+        doc = item['document']
+        if not doc.text:
+            return item
+
+        doc.content_hash = fingerprints.content_hash(doc.text)
+        doc.simhash = fingerprints.simhash(doc.text)
+
+        if self.seen.add(doc.content_hash):
+            self.stats.inc_value('documents/duplicates', spider=spider)
+            raise DropItem(f'Duplicate content: {doc.url}')
+
+        return item
+
+
+class DocumentPipeline(object):
+    """
+    Buffer crawled documents and index them in bulk.
+
+    The buffer is flushed once it contains `DOCUMENT_BUFFER_SIZE` documents,
+    every `DOCUMENT_FLUSH_INTERVAL` seconds, and when the spider is closed.
+    The spider should provide the `task` whose crawler owns the index.
+
+    `DOCUMENT_WRITER` determines how flushes are written:
+
+    - 'thread': Writes are performed by a pool of `DOCUMENT_WRITER_THREADS`
+      threads, off of the reactor thread. Once `DOCUMENT_WRITER_MAX_PENDING`
+      writes are in progress, items are held until a write completes, which
+      backs off the downloader instead of growing the buffer indefinitely.
+    - 'sync': Writes block the reactor thread.
+    """
+    WRITERS = ('thread', 'sync')
+
+    def __init__(self, stats, size, interval, writer='thread', threads=2, max_pending=4):
+        if writer not in self.WRITERS:
+            raise ValueError(f"Unknown document writer '{writer}'.")
+
+        self.stats = stats
+        self.size = size
+        self.interval = interval
+        self.writer = writer
+        self.threads = threads
+        self.max_pending = max_pending
+
+        # set from the spider's task (see `open_spider`)
+        self.documents = None
+        self.store_html = None
+        self.tokenizer = None
+
+        self.buffer = []
+        self.loop = None
+        self.threadpool = None
+        self.pending = []
+        self.waiting = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler.stats,
+            size=settings.getint('DOCUMENT_BUFFER_SIZE', 100),
+            interval=settings.getfloat('DOCUMENT_FLUSH_INTERVAL', 5),
+            writer=settings.get('DOCUMENT_WRITER', 'thread'),
+            threads=settings.getint('DOCUMENT_WRITER_THREADS', 2),
+            max_pending=settings.getint('DOCUMENT_WRITER_MAX_PENDING', 4),
+        )
+
+    def open_spider(self, spider):
+        task = getattr(spider, 'task', None)
+        if task is not None:
+            # resolve related objects upfront, so that writers don't query the DB
+            self.documents = task.crawler.documents
+            self.store_html = task.crawler.store_html
+            self.tokenizer = getattr(task.crawler, 'sentencetokenizer', None)
+
+        if self.writer == 'thread':
+            self.threadpool = ThreadPool(minthreads=1, maxthreads=self.threads, name='DocumentPipeline')
+            self.threadpool.start()
+
+        if self.interval:
+            self.loop = LoopingCall(self.flush, spider)
+            self.loop.start(self.interval, now=False)
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+
+        self.flush(spider)
+
+        # wait for any in-progress writes
+        yield defer.DeferredList(list(self.pending))
+
+        if self.threadpool is not None:
+            self.threadpool.stop()
+
+    def process_item(self, item, spider):
+        if not isinstance(item, DocumentItem):
+            return item
+
+        self.buffer.append(item['document'])
+        if len(self.buffer) < self.size:
+            return item
+
+        return self.flush(spider).addCallback(lambda _: item)
+
+    def flush(self, spider):
+        """
+        Write the buffered documents. The returned deferred fires once there
+        is capacity for another write.
+        """
+        if not self.buffer:
+            return defer.succeed(None)
+
+        docs, self.buffer = self.buffer, []
+
+        if self.threadpool is None:
+            try:
+                latency = self.write(docs, spider)
+            except Exception as exc:
+                self.write_failed(exc, docs, spider)
+            else:
+                self.written(latency, docs, spider)
+            return defer.succeed(None)
+
+        dfd = self.dispatch(docs, spider)
+        self.pending.append(dfd)
+        dfd.addCallbacks(
+            self.written, lambda failure: self.write_failed(failure.value, docs, spider),
+            callbackArgs=(docs, spider),
+        )
+        dfd.addBoth(self.release, dfd)
+
+        if len(self.pending) <= self.max_pending:
+            return defer.succeed(None)
+
+        waiter = defer.Deferred()
+        self.waiting.append(waiter)
+        return waiter
+
+    def dispatch(self, docs, spider):
+        return threads.deferToThreadPool(reactor, self.threadpool, self.write, docs, spider)
+
+    def release(self, result, dfd):
+        self.pending.remove(dfd)
+        if self.waiting:
+            self.waiting.pop(0).callback(None)
+
+    def write(self, docs, spider):
+        start = time()
+        self.index(docs, spider)
+        return time() - start
+
+    def written(self, latency, docs, spider):
+        self.stats.inc_value('documents/flushed', len(docs), spider=spider)
+        self.stats.inc_value('documents/flush_count', spider=spider)
+        self.stats.set_value('documents/flush_latency', latency, spider=spider)
+        self.stats.max_value('documents/flush_latency_max', latency, spider=spider)
+
+    def write_failed(self, exc, docs, spider):
+        # don't propagate, as this would stop the flush loop
+        logger.error('Failed to index %d documents: %s', len(docs), exc, extra={'spider': spider})
+        self.stats.inc_value('documents/flush_errors', spider=spider)
+
+        exception_logger = getattr(spider, 'exception_logger', None)
+        if exception_logger is not None:
+            exception_logger(exc)
+
+    def index(self, docs, spider):
+        if self.documents is None:
+            raise RuntimeError('Spider has no task to index documents for.')
+
+        for doc in docs:
+            self.store_html(doc)
+        self.documents.bulk_create(docs)
+
+        # parse sentences from documents
+        if self.tokenizer is not None:
+            self.tokenizer.tokenize_many(docs)
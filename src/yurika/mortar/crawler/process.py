@@ -1,44 +1,26 @@
-import os
-import sys
+from threading import Thread
 
-import django
-from scrapy.crawler import CrawlerProcess
+from scrapy.crawler import Crawler, CrawlerProcess
 from scrapy.utils import log
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
 
+from .. import workers
 from .spiders import WebCrawler
 
-__all__ = ['crawl']
 
+__all__ = ['crawl', 'host']
 
-def crawl(task_id):
-    """
-    Scrapy process.
-    """
-    sys.path.insert(0, os.environ['YURIKA_CONF'])
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
-    django.setup()
-
-    from ..models import CrawlerTask
-    task = CrawlerTask.objects.get(pk=task_id)
-
-    # prevent scrapy from mucking with our logging configuration
-    log.dictConfig = lambda _: _
 
-    def twisted_exc(failure):
-        # it's necessary to manually log the exception, as twisted loses the
-        # real traceback object, but retains the frames to semi-rebuild it.
-        task.errors.create(
-            message=str(failure.value),
-            traceback=failure.getTraceback(),
-        )
-
-    process = CrawlerProcess({**task.crawler.config, **{
+def crawler_settings(task):
+    return {**task.crawler.config, **{
         # enables state persistence, allowing crawler to be paused/unpaused
         'JOBDIR': task.crawler.state_dir,
-    }}, install_root_handler=False)
+    }}
+
 
-    deferred = process.crawl(
-        WebCrawler,
+def spider_kwargs(task):
+    return dict(
         start_urls=task.crawler.start_urls.splitlines(),
         task=task,
 
@@ -49,5 +31,133 @@ def crawl(task_id):
         # mortar.middleware.LogExceptionMiddleware
         exception_logger=task.log_exception,
     )
-    deferred.addErrback(twisted_exc)
+
+
+def exception_logger(task):
+    def twisted_exc(failure):
+        # it's necessary to manually log the exception, as twisted loses the
+        # real traceback object, but retains the frames to semi-rebuild it.
+        task.errors.create(
+            message=str(failure.value),
+            traceback=failure.getTraceback(),
+        )
+    return twisted_exc
+
+
+def crawl(task_id, stop=None):
+    """
+    Scrapy process.
+
+    Setting the `stop` event gracefully stops the crawl. In-flight requests
+    are finished, buffered documents are indexed, and the scheduler's queues
+    are persisted, so that the crawl may be resumed.
+    """
+    workers.setup()
+
+    from ..models import CrawlerTask
+    task = CrawlerTask.objects.get(pk=task_id)
+
+    # prevent scrapy from mucking with our logging configuration
+    log.dictConfig = lambda _: _
+
+    process = CrawlerProcess(crawler_settings(task), install_root_handler=False)
+
+    deferred = process.crawl(WebCrawler, **spider_kwargs(task))
+    deferred.addErrback(exception_logger(task))
+
+    if stop is not None:
+        def wait():
+            stop.wait()
+            reactor.callFromThread(process.stop)
+
+        Thread(target=wait, daemon=True).start()
+
     process.start()
+
+
+def host(conn, max_jobs=0):
+    """
+    Warm Scrapy process, which runs the crawls sent over the `conn` pipe.
+    Django, Scrapy, and the reactor are only set up once, so that crawls skip
+    the startup cost of a new `crawl` process.
+
+    Crawls run concurrently, each with its own crawler, so several crawls may
+    share the process and its reactor. The host accepts the following messages:
+
+    - `('crawl', task_id)`: Start a crawl. `('done', task_id, error)` is sent
+      once it finishes, where `error` is the message of an error starting the
+      crawl.
+    - `('stop', task_id)`: Gracefully stop the crawl (see `crawl`).
+
+    The host exits after running `max_jobs` crawls (if set), which releases
+    any memory leaked by the crawls, or once the pipe is closed.
+    """
+    workers.setup()
+
+    # prevent scrapy from mucking with our logging configuration
+    log.dictConfig = lambda _: _
+
+    Host(conn, max_jobs).start()
+
+
+class Host(object):
+
+    def __init__(self, conn, max_jobs=0):
+        self.conn = conn
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.crawlers = {}
+        self.process = CrawlerProcess(install_root_handler=False)
+
+    def start(self):
+        Thread(target=self.listen, daemon=True).start()
+        self.process.start(stop_after_crawl=False)
+
+    def listen(self):
+        while True:
+            try:
+                command, *args = self.conn.recv()
+            except EOFError:
+                reactor.callFromThread(self.shutdown)
+                return
+
+            if command == 'crawl':
+                reactor.callFromThread(self.run, *args)
+            elif command == 'stop':
+                reactor.callFromThread(self.stop, *args)
+
+    def run(self, task_id):
+        deferred = defer.maybeDeferred(self.crawl, task_id)
+        deferred.addBoth(self.finished, task_id)
+
+    def stop(self, task_id):
+        crawler = self.crawlers.get(task_id)
+        if crawler is not None:
+            crawler.stop()
+
+    def crawl(self, task_id):
+        from django.db import close_old_connections
+        from ..models import CrawlerTask
+
+        # connections may have been closed by the database between crawls
+        close_old_connections()
+        task = CrawlerTask.objects.get(pk=task_id)
+
+        crawler = self.crawlers[task_id] = Crawler(WebCrawler, crawler_settings(task))
+        deferred = self.process.crawl(crawler, **spider_kwargs(task))
+        deferred.addErrback(exception_logger(task))
+        return deferred
+
+    def finished(self, result, task_id):
+        # crawl errors are logged to the task, so only errors starting the crawl are sent
+        error = result.getErrorMessage() if isinstance(result, Failure) else None
+        self.crawlers.pop(task_id, None)
+        self.jobs += 1
+        self.conn.send(('done', task_id, error))
+
+        if self.max_jobs and self.jobs >= self.max_jobs and not self.crawlers:
+            reactor.stop()
+
+    def shutdown(self):
+        # stop the current crawls (if any) before the reactor
+        self.process.stop().addBoth(lambda _: reactor.stop())
@@ -0,0 +1,245 @@
+import marshal
+import os
+import struct
+from collections import OrderedDict
+from os.path import join
+from urllib.parse import quote
+
+from scrapy.core.scheduler import Scheduler
+from scrapy.squeues import PickleLifoDiskQueue
+from scrapy.utils.httpobj import urlparse_cached
+
+from .domains import registered_domain
+
+
+def request_domain(request):
+    """
+    Return the download slot of a request, which defaults to its registrable
+    domain (see `domains.registered_domain`).
+    """
+    if 'download_slot' not in request.meta:
+        request.meta['download_slot'] = registered_domain(urlparse_cached(request).hostname or '')
+    return request.meta['download_slot']
+
+
+class FifoFileQueue(object):
+    """
+    A FIFO disk queue of marshalled objects, stored in a single append-only
+    file. The file starts with a header of the read offset and object count,
+    which are updated in place, and is truncated once the queue is drained.
+
+    Unlike queuelib's disk queues, the file isn't kept open between operations,
+    so the number of queues (one per domain and priority) isn't limited by the
+    number of open files, and each queue only holds a few integers in memory.
+    """
+    HEADER = struct.Struct('<QQ')
+    RECORD = struct.Struct('<I')
+
+    def __init__(self, path):
+        self.path = path
+
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                self.offset, self.count = self.HEADER.unpack(file.read(self.HEADER.size))
+            self.end = os.path.getsize(path)
+        else:
+            self.offset, self.count, self.end = self.HEADER.size, 0, self.HEADER.size
+
+    def push(self, obj):
+        # raises ValueError for unserializable objects, as expected by the scheduler
+        data = marshal.dumps(obj)
+        record = self.RECORD.pack(len(data)) + data
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            os.pwrite(fd, record, self.end)
+            self.end += len(record)
+            self.count += 1
+            os.pwrite(fd, self.HEADER.pack(self.offset, self.count), 0)
+        finally:
+            os.close(fd)
+
+    def pop(self):
+        if not self.count:
+            return None
+
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            size, = self.RECORD.unpack(os.pread(fd, self.RECORD.size, self.offset))
+            data = os.pread(fd, size, self.offset + self.RECORD.size)
+
+            self.count -= 1
+            if self.count:
+                self.offset += self.RECORD.size + size
+            else:
+                self.offset = self.end = self.HEADER.size
+                os.ftruncate(fd, self.end)
+            os.pwrite(fd, self.HEADER.pack(self.offset, self.count), 0)
+        finally:
+            os.close(fd)
+
+        return marshal.loads(data)
+
+    def close(self):
+        if not self.count and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return self.count
+
+
+class DomainPriorityQueue(object):
+    """
+    A priority queue that keeps a separate `pqclass` queue per domain. Objects
+    are popped from the domains with the highest priority object, and domains
+    with equal priority are popped in a round-robin fashion. Domains that are
+    not `ready` are skipped, so that a few slow domains can't monopolize the
+    dequeued requests.
+
+    Objects are keyed by their `download_slot`, and the `qfactory` receives a
+    `(domain, priority)` key. `close()` returns the active `[domain, priorities]`
+    pairs, which should be passed as `startprios` to resume the queue.
+    """
+
+    def __init__(self, pqclass, qfactory, startprios=(), ready=None):
+        self.pqclass = pqclass
+        self.qfactory = qfactory
+        self.ready = ready
+        self.queues = {}
+
+        # the domains whose highest priority objects have the given priority
+        self.buckets = {}
+
+        # a plain list of priorities was saved by scrapy's default scheduler
+        if startprios and not isinstance(startprios[0], list):
+            startprios = [['', startprios]]
+
+        for domain, prios in startprios:
+            queue = self.queues[domain] = self._newpq(domain, prios)
+            self._bucket(domain, queue, None)
+
+    def _newpq(self, domain, startprios=()):
+        return self.pqclass(lambda priority: self.qfactory((domain, priority)), startprios)
+
+    def _domain(self, obj):
+        meta = obj['meta'] if isinstance(obj, dict) else obj.meta
+        return meta['download_slot']
+
+    def _bucket(self, domain, queue, priority):
+        # move the domain from its `priority` bucket to its queue's current one
+        if priority is not None:
+            bucket = self.buckets[priority]
+            del bucket[domain]
+            if not bucket:
+                del self.buckets[priority]
+
+        if len(queue):
+            self.buckets.setdefault(queue.curprio, OrderedDict())[domain] = None
+        else:
+            del self.queues[domain]
+            queue.close()
+
+    def push(self, obj, priority=0):
+        domain = self._domain(obj)
+        queue = self.queues.get(domain)
+        if queue is None:
+            queue = self.queues[domain] = self._newpq(domain)
+
+        current = queue.curprio if len(queue) else None
+        queue.push(obj, priority)
+        if queue.curprio != current:
+            self._bucket(domain, queue, current)
+
+    def pop(self):
+        for priority in sorted(self.buckets):
+            bucket = self.buckets[priority]
+
+            for _ in range(len(bucket)):
+                domain = next(iter(bucket))
+                bucket.move_to_end(domain)
+
+                if self.ready is not None and not self.ready(domain):
+                    continue
+
+                queue = self.queues[domain]
+                obj = queue.pop()
+                if queue.curprio != priority or not len(queue):
+                    self._bucket(domain, queue, priority)
+                return obj
+
+    def close(self):
+        active = []
+        for domain, queue in self.queues.items():
+            prios = queue.close()
+            if prios:
+                active.append([domain, prios])
+        return active
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+
+class DomainScheduler(Scheduler):
+    """
+    Scheduler that queues requests per registrable domain, and only dequeues
+    requests for domains whose download slot has free capacity.
+
+    Requests for slow domains wait in the scheduler (or on disk, with a
+    `JOBDIR`) instead of filling the downloader's `CONCURRENT_REQUESTS`,
+    which leaves room for requests to faster domains. Each domain is a
+    separate download slot, whose concurrency may be adjusted by the
+    `middleware.DomainConcurrencyMiddleware`.
+
+    Disk queues are stored per domain in `JOBDIR/requests.queue`. When using
+    the `FifoFileQueue`, queues written by scrapy's default `PickleLifoDiskQueue`
+    are still read, so that jobs started with the default scheduler may be
+    resumed.
+    """
+
+    def open(self, spider):
+        downloader = spider.crawler.engine.downloader
+        pqclass = self.pqclass
+
+        def ready(domain):
+            slot = downloader.slots.get(domain)
+            return slot is None or len(slot.active) < slot.concurrency
+
+        self.pqclass = lambda qfactory, startprios=(): DomainPriorityQueue(pqclass, qfactory, startprios, ready)
+        return super().open(spider)
+
+    def close(self, reason):
+        result = super().close(reason)
+
+        # remove the directories of drained domains
+        if self.dqdir:
+            for entry in os.scandir(self.dqdir):
+                if entry.is_dir() and not os.listdir(entry.path):
+                    os.rmdir(entry.path)
+
+        return result
+
+    def _dqpush(self, request):
+        request_domain(request)
+        return super()._dqpush(request)
+
+    def _mqpush(self, request):
+        request_domain(request)
+        return super()._mqpush(request)
+
+    def _newmq(self, key):
+        return self.mqclass()
+
+    def _newdq(self, key):
+        # requests without a domain are kept in scrapy's default location
+        domain, priority = key
+        path = join(self.dqdir, quote(domain, safe='')) if domain else self.dqdir
+        os.makedirs(path, exist_ok=True)
+
+        path = join(path, 'p%s' % priority)
+        if self.dqclass is not FifoFileQueue:
+            return self.dqclass(path)
+
+        # queues written by scrapy's default disk queue are still read
+        if os.path.exists(path):
+            return PickleLifoDiskQueue(path)
+        return FifoFileQueue(path + '.fifo')
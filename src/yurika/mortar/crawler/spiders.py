@@ -1,12 +1,11 @@
+import hashlib
 from datetime import datetime
 
-from bs4 import BeautifulSoup
-from bs4.element import CData, NavigableString
 from django.utils import timezone
 from scrapy.linkextractors import LinkExtractor
 from scrapy.spiders import CrawlSpider, Rule
-import hashlib
-from .. import documents
+
+from .items import DocumentItem
 
 
 class WebCrawler(CrawlSpider):
@@ -26,78 +25,91 @@ class WebCrawler(CrawlSpider):
         'SPIDER_MIDDLEWARES_BASE': {
             # default scrapy middleware
             'scrapy.spidermiddlewares.httperror.HttpErrorMiddleware': 50,
-            'scrapy.spidermiddlewares.offsite.OffsiteMiddleware': 500,
             'scrapy.spidermiddlewares.referer.RefererMiddleware': 700,
             'scrapy.spidermiddlewares.urllength.UrlLengthMiddleware': 800,
             'scrapy.spidermiddlewares.depth.DepthMiddleware': 900,
 
             # default mortar middleware
             'yurika.mortar.crawler.middleware.LogExceptionMiddleware': 100,
+            'yurika.mortar.crawler.middleware.OffsiteMiddleware': 500,
             'yurika.mortar.crawler.middleware.BlockedDomainMiddleware': 500,
             'yurika.mortar.crawler.middleware.DistanceMiddleware': 900,
         },
+        'DOWNLOADER_MIDDLEWARES_BASE': {
+            # default scrapy middleware
+            'scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware': 100,
+            'scrapy.downloadermiddlewares.httpauth.HttpAuthMiddleware': 300,
+            'scrapy.downloadermiddlewares.downloadtimeout.DownloadTimeoutMiddleware': 350,
+            'scrapy.downloadermiddlewares.defaultheaders.DefaultHeadersMiddleware': 400,
+            'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': 500,
+            'scrapy.downloadermiddlewares.retry.RetryMiddleware': 550,
+            'scrapy.downloadermiddlewares.ajaxcrawl.AjaxCrawlMiddleware': 560,
+            'scrapy.downloadermiddlewares.redirect.MetaRefreshMiddleware': 580,
+            'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 590,
+            'scrapy.downloadermiddlewares.redirect.RedirectMiddleware': 600,
+            'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': 700,
+            'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 750,
+            'scrapy.downloadermiddlewares.stats.DownloaderStats': 850,
+            'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': 900,
+
+            # default mortar middleware
+            'yurika.mortar.crawler.middleware.DomainConcurrencyMiddleware': 800,
+        },
+        'EXTENSIONS_BASE': {
+            # default scrapy extensions
+            'scrapy.extensions.corestats.CoreStats': 0,
+            'scrapy.extensions.telnet.TelnetConsole': 0,
+            'scrapy.extensions.memusage.MemoryUsage': 0,
+            'scrapy.extensions.memdebug.MemoryDebugger': 0,
+            'scrapy.extensions.closespider.CloseSpider': 0,
+            'scrapy.extensions.feedexport.FeedExporter': 0,
+            'scrapy.extensions.logstats.LogStats': 0,
+            'scrapy.extensions.spiderstate.SpiderState': 0,
+            'scrapy.extensions.throttle.AutoThrottle': 0,
+
+            # default mortar extensions
+            'yurika.mortar.crawler.extensions.TaskStats': 0,
+        },
+        'ITEM_PIPELINES_BASE': {
+            'yurika.mortar.crawler.pipelines.TextExtractionPipeline': 100,
+            'yurika.mortar.crawler.pipelines.DedupePipeline': 300,
+            'yurika.mortar.crawler.pipelines.DocumentPipeline': 500,
+        },
     }
 
+    # defaults that, unlike `custom_settings`, may be overridden by the crawler config
+    default_settings = {
+        'DUPEFILTER_CLASS': 'yurika.mortar.crawler.dupefilters.BloomDupeFilter',
+        'SCHEDULER': 'yurika.mortar.crawler.scheduler.DomainScheduler',
+
+        # crawl breadth-first, ordered by (distance, depth)
+        'SCHEDULER_DISK_QUEUE': 'yurika.mortar.crawler.scheduler.FifoFileQueue',
+        'SCHEDULER_MEMORY_QUEUE': 'scrapy.squeues.FifoMemoryQueue',
+        'DEPTH_PRIORITY': 1,
+        'DISTANCE_PRIORITY': 1000,
+    }
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        settings.setdict(cls.default_settings, priority='default')
+
     def __init__(self, *args, task, **kwargs):
         super().__init__(*args, **kwargs)
         self.task = task
 
     def parse_item(self, response):
-        crawler = self.task.crawler
-        tokenizer = getattr(crawler, 'sentencetokenizer', None)
-
-        soup = BeautifulSoup(response.text, 'lxml')
-
-        for element in soup(['script', 'style']):
-            element.decompose()
-
-        text = get_text(soup)
-        text = [line.strip() for line in text.splitlines()]
-        text = [line for line in text if line]
-        text = '\n'.join(text)
-
-        doc = documents.Document(
+        doc = self.task.crawler.document_class(
             url=response.url,
             url_text=response.url,
             referer=str(response.request.headers.get('Referer', None)),
-            title=soup.title.string if soup.title else "",
             html=response.text,
-            text=text,
             timestamp=datetime.strftime(timezone.now(), "%Y-%m-%dT%H:%M:%S.%f"),
         )
 
         doc.meta.id = str(hashlib.md5(response.url.encode()).hexdigest())
 
-        # save doc to crawler's document index
-        crawler.documents.create(doc)
-
-        # parse sentences from document
-        if tokenizer is not None:
-            tokenizer.tokenize(doc)
-
-def _all_strings(soup, strip=False, types=(NavigableString, CData)):
-    '''
-    Like `bs4.element.Tag._get_strings()`, except `<br>` tags are turned into
-    newlines.
-    '''
-    for descendant in soup.descendants:
-        if descendant.name == 'br':
-            yield '\n'
-        if (
-            (types is None and not isinstance(descendant, NavigableString))
-            or
-            (types is not None and type(descendant) not in types)):
-            continue
-        if strip:
-            descendant = descendant.strip()
-            if len(descendant) == 0:
-                continue
-        yield descendant
-
-def get_text(soup, separator="", strip=False,
-                types=(NavigableString, CData)):
-    """
-    Like `bs4.element.Tag.get_text()`, except `<br>` tags are turned into
-    newlines.
-    """
-    return separator.join(_all_strings(soup, strip, types=types))
+        # the title and text are extracted by `pipelines.TextExtractionPipeline`,
+        # duplicates are dropped by `pipelines.DedupePipeline`, and the doc is
+        # then indexed by `pipelines.DocumentPipeline`
+        yield DocumentItem(document=doc)
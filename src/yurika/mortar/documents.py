@@ -1,3 +1,6 @@
+import base64
+import zlib
+
 from django.conf import settings
 from elasticsearch.helpers import bulk
 from elasticsearch_dsl import Document, connections, field
@@ -15,13 +18,18 @@ class BaseDocument(Document):
 
     @classmethod
     def bulk_create(cls, docs, using=None, index=None, handler=bulk, **kwargs):
-        if index is not None:
+        """
+        Index the documents with a bulk `handler`. `docs` may be any iterable,
+        and is consumed lazily (the default handler indexes in chunks).
+        """
+        def actions():
             for doc in docs:
-                doc._index = doc._index.clone(name=index)
+                if index is not None:
+                    doc.meta.index = index
+                yield doc.to_dict(include_meta=True)
 
         client = connections.get_connection(using or cls._index._using)
-        docs = [doc.to_dict(include_meta=True) for doc in docs]
-        return handler(client, docs, **kwargs)
+        return handler(client, actions(), **kwargs)
 
 
 class DocumentContext:
@@ -56,6 +64,20 @@ class DocumentContext:
         return self.document_cls.bulk_create(docs, using, index, **kwargs)
 
 
+class CompressedText(field.Binary):
+    """
+    Text that is zlib-compressed (and base64-encoded) in the document source.
+    """
+
+    def _deserialize(self, data):
+        return zlib.decompress(base64.b64decode(data)).decode()
+
+    def _serialize(self, data):
+        if data is None:
+            return None
+        return base64.b64encode(zlib.compress(data.encode())).decode()
+
+
 class Document(BaseDocument):
     url = field.Keyword()
     url_text = field.Text()
@@ -65,10 +87,49 @@ class Document(BaseDocument):
     text = field.Text()
     timestamp = field.Date(default_timezone=settings.TIME_ZONE)
 
+    # see `crawler.fingerprints`
+    content_hash = field.Keyword()
+    simhash = field.Keyword()
+
+
+# Documents for the crawler `HTML_STORAGE` modes. Each declares an `Index`, so
+# that its `html` mapping isn't merged into the default index's mappings.
+
+class UnindexedHTMLDocument(Document):
+    html = field.Text(index=False)
+
+    class Index:
+        pass
+
+
+class CompressedHTMLDocument(Document):
+    html = CompressedText()
+
+    class Index:
+        pass
+
+
+class BlobHTMLDocument(Document):
+    # digest of the html in the crawler's `blobs.BlobStore`
+    html = field.Keyword(index=False)
+
+    class Index:
+        pass
+
+
+HTML_DOCUMENTS = {
+    'text': Document,
+    'unindexed': UnindexedHTMLDocument,
+    'compressed': CompressedHTMLDocument,
+    'blob': BlobHTMLDocument,
+}
+
 
 class Sentence(BaseDocument):
     document_id = field.Keyword()
     text = field.Text()
+    # when the sentence was tokenized, which allows annotations to be refreshed
+    timestamp = field.Date(default_timezone=settings.TIME_ZONE)
 
 
 class Dictionary(BaseDocument):
@@ -3,12 +3,15 @@ import uuid
 from argparse import ArgumentTypeError
 
 from django.core.management.base import BaseCommand, CommandError
+from django.utils.formats import localize
 from django.utils.termcolors import colorize
 from elasticsearch_dsl import Search, exceptions
 from terminaltables import SingleTable
 
 from yurika.mortar import models
 
+from .crawler import positive_int
+
 
 def crawler(value):
     try:
@@ -43,15 +46,27 @@ def query(filename):
     contents = file_contents(filename)
 
     try:
-        Search.from_dict(json.loads(contents))
+        query = json.loads(contents)
     except json.JSONDecodeError:
         raise ArgumentTypeError(f"invalid JSON in '{filename}'")
+
+    if not isinstance(query, dict):
+        raise ArgumentTypeError(f"query in '{filename}' must be a JSON object")
+
+    try:
+        Search.from_dict(query)
     except exceptions.ElasticsearchDslException as e:
         raise ArgumentTypeError(str(e))
 
     return contents
 
 
+REFRESH_HELP = """
+Add the matching sentences that were tokenized since the annotation was last
+executed. This also resumes an annotation whose execution was interrupted.
+"""
+
+
 class Command(BaseCommand):
     help = "Annotation management"
 
@@ -70,6 +85,26 @@ class Command(BaseCommand):
         parser.add_argument('-c', '--crawler', dest='crawler', type=crawler, help="Crawler ID or UUID.")
         parser.add_argument('-q', '--query', dest='query', type=query, required=True,
                             help="JSON file containing the Elasticsearch query.")
+        parser.add_argument('-w', '--workers', dest='slices', type=positive_int, default=1,
+                            help="Number of worker threads (each scans a slice of the sentences).")
+        parser.add_argument('--auto-refresh', action='store_true', dest='auto_refresh', default=False,
+                            help="Refresh the annotation whenever its crawler's crawl finishes.")
+        parser.add_argument('--time-limit', dest='time_limit', type=int,
+                            help="Time limit (in seconds) for how long the "
+                                 "annotation should run before it is terminated.")
+
+        # #################################################################### #
+        # #### STOP ########################################################## #
+        parser = subparsers.add_parser('stop', cmd=self)
+        parser.add_argument('annotation', type=annotation, help="Annotation ID.")
+
+        # #################################################################### #
+        # #### REFRESH ####################################################### #
+        parser = subparsers.add_parser('refresh', cmd=self, help=REFRESH_HELP)
+        parser.add_argument('annotation', type=annotation, help="Annotation ID.")
+        parser.add_argument('--time-limit', dest='time_limit', type=int,
+                            help="Time limit (in seconds) for how long the "
+                                 "annotation should run before it is terminated.")
 
         # #################################################################### #
         # #### DELETE ######################################################## #
@@ -84,30 +119,58 @@ class Command(BaseCommand):
         except RuntimeError as exc:
             raise CommandError(str(exc)) from exc
 
+    def task_options(self, options):
+        task_options = {}
+        if options.get('time_limit') is not None:
+            # convert to milliseconds
+            task_options['time_limit'] = options['time_limit'] * 1000
+
+        return task_options
+
+    def progress(self, annotation):
+        task = getattr(annotation, 'task', None)
+        if task is None:
+            return '', ''
+
+        progress = f'{task.processed}/{task.total}' if task.total is not None else str(task.processed)
+        if task.rate:
+            progress += f' ({task.rate:.0f}/s)'
+        return task.get_status_display(), progress
+
     def info(self, **options):
-        annotations = models.Annotation.objects.all()
+        annotations = models.Annotation.objects.select_related('task')
 
         data = [[
             colorize(annotation.pk, fg='cyan'),
+            *self.progress(annotation),
             annotation.document_set.count(),
-            annotation.sentence_set.count()
+            annotation.sentence_set.count(),
+            localize(annotation.refreshed_at) or '-',
         ] for annotation in annotations]
-        data.insert(0, ['ID', 'Documents', 'Sentences'])
+        data.insert(0, ['ID', 'Status', 'Progress', 'Documents', 'Sentences', 'Refreshed'])
 
         table = SingleTable(data, title='Annotations: ' + str(annotations.count()))
         table.justify_columns[0] = 'right'
 
         self.stdout.write(table.table)
 
-    def create(self, crawler, query, **options):
+    def create(self, crawler, query, slices, auto_refresh, **options):
         self.stdout.write('Creating ... ', ending='')
 
         models.Annotation.objects \
-            .create(crawler=crawler, query=query) \
-            .execute()
+            .create(crawler=crawler, query=query, slices=slices, auto_refresh=auto_refresh) \
+            .start(**self.task_options(options))
 
         self.stdout.write(self.style.SUCCESS('Done!'))
 
+    def stop(self, annotation, **options):
+        self.stdout.write('Stopping ...')
+        annotation.stop()
+
+    def refresh(self, annotation, **options):
+        self.stdout.write('Refreshing ...')
+        annotation.refresh(**self.task_options(options))
+
     def delete(self, annotation, **options):
         self.stdout.write('Deleting ... ', ending='')
         annotation.delete()
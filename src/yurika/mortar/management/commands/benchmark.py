@@ -0,0 +1,167 @@
+import random
+import re
+import statistics
+import string
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from terminaltables import SingleTable
+
+from yurika.mortar import models
+from yurika.mortar.crawler import extractors
+from yurika.mortar.crawler.domains import DomainMatcher
+
+from .crawler import LANGUAGES, crawler, positive_int
+
+
+def timed(func, values):
+    """
+    Call `func` for each value, returning the per-call latencies (in seconds).
+    """
+    latencies = []
+    for value in values:
+        start = perf_counter()
+        func(value)
+        latencies.append(perf_counter() - start)
+    return latencies
+
+
+def random_domains(rand, count):
+    """
+    Generate random domain names.
+    """
+    def label():
+        return ''.join(rand.choice(string.ascii_lowercase) for _ in range(rand.randint(3, 12)))
+
+    tlds = ['com', 'net', 'org', 'io', 'co.uk']
+    return [f'{label()}.{rand.choice(tlds)}' for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmarks against stored crawler data"
+
+    def add_arguments(self, parser):
+        # https://github.com/python/cpython/pull/3027
+        subparsers = parser.add_subparsers(dest='command')
+        subparsers.required = True
+
+        # #################################################################### #
+        # #### TOKENIZER ##################################################### #
+        parser = subparsers.add_parser('tokenizer', cmd=self)
+        parser.add_argument('crawler', type=crawler, help="Crawler ID or UUID.")
+        parser.add_argument('-n', '--sample', dest='sample', type=positive_int, default=1000,
+                            help="Number of stored documents to tokenize.")
+        parser.add_argument('--language', dest='language', choices=LANGUAGES,
+                            default=models.SentenceTokenizer.LANGUAGES.english, help="Punkt model language.")
+
+        # #################################################################### #
+        # #### EXTRACTOR ##################################################### #
+        parser = subparsers.add_parser('extractor', cmd=self)
+        parser.add_argument('crawler', type=crawler, help="Crawler ID or UUID.")
+        parser.add_argument('-n', '--sample', dest='sample', type=positive_int, default=1000,
+                            help="Number of stored documents to extract text from.")
+
+        # #################################################################### #
+        # #### BLOCKLIST ##################################################### #
+        parser = subparsers.add_parser('blocklist', cmd=self)
+        parser.add_argument('-d', '--domains', dest='domains', type=positive_int, default=100000,
+                            help="Number of random domains to block.")
+        parser.add_argument('-n', '--hosts', dest='hosts', type=positive_int, default=10000,
+                            help="Number of hostnames to match (half of which are blocked).")
+        parser.add_argument('--seed', dest='seed', type=int, default=0, help="Random seed.")
+
+    def handle(self, command, **options):
+        handler = getattr(self, command)
+
+        try:
+            return handler(**options)
+        except RuntimeError as exc:
+            raise CommandError(str(exc)) from exc
+
+    def sample(self, crawler, size, field):
+        """
+        Load the `field` values of a sample of the crawler's documents.
+        """
+        search = crawler.documents.search().source([field])[:size]
+        if field == 'html':
+            values = [crawler.get_html(hit) or '' for hit in search]
+        else:
+            values = [getattr(hit, field, None) or '' for hit in search]
+
+        if not values:
+            raise RuntimeError('Crawler has no documents.')
+        return values
+
+    def report(self, title, results):
+        data = [['', 'Total (s)', 'Mean (ms)', 'Median (ms)', 'Max (ms)']]
+        data.extend([
+            name,
+            '%.3f' % sum(latencies),
+            '%.3f' % (statistics.mean(latencies) * 1000),
+            '%.3f' % (statistics.median(latencies) * 1000),
+            '%.3f' % (max(latencies) * 1000),
+        ] for name, latencies in results)
+
+        table = SingleTable(data, title=title)
+        for column in range(1, 5):
+            table.justify_columns[column] = 'right'
+
+        self.stdout.write(table.table)
+
+    def tokenizer(self, crawler, sample, language, **options):
+        from nltk.tokenize import sent_tokenize
+
+        texts = self.sample(crawler, sample, 'text')
+        models.punkt_tokenizer.cache_clear()
+
+        self.report(f' Sentence tokenization: {len(texts)} documents ', [
+            ('sent_tokenize', timed(lambda text: sent_tokenize(text, language), texts)),
+            ('punkt_tokenizer', timed(lambda text: models.punkt_tokenizer(language).tokenize(text), texts)),
+        ])
+
+    def extractor(self, crawler, sample, **options):
+        pages = self.sample(crawler, sample, 'html')
+
+        self.report(f' Text extraction: {len(pages)} documents ', [
+            ('soup_extractor', timed(extractors.soup_extractor, pages)),
+            ('lxml_extractor', timed(extractors.lxml_extractor, pages)),
+        ])
+
+        mismatches = sum(
+            extractors.soup_extractor(html) != extractors.lxml_extractor(html)
+            for html in pages
+        )
+        style = self.style.NOTICE if mismatches else self.style.SUCCESS
+        self.stdout.write(style(f'Mismatched output: {mismatches} of {len(pages)} documents'))
+
+    def blocklist(self, domains, hosts, seed, **options):
+        rand = random.Random(seed)
+        blocked = random_domains(rand, domains)
+        hostnames = [
+            f'www.{rand.choice(blocked)}' if n % 2 else f'www.{domain}'
+            for n, domain in enumerate(random_domains(rand, hosts))
+        ]
+
+        # the regex previously used by `BlockedDomainMiddleware`
+        def compile_regex(domains):
+            return re.compile(r'^(.*)(%s)' % '|'.join(re.escape(d) for d in domains))
+
+        self.stdout.write('Building matchers ...')
+        re.purge()
+        self.report(f' Blocklist: {domains} domains ', [
+            ('regex compile', timed(compile_regex, [blocked])),
+            ('matcher build', timed(DomainMatcher, [blocked])),
+        ])
+
+        # the compiled regex is cached by `re`
+        regex, matcher = compile_regex(blocked), DomainMatcher(blocked)
+        self.report(f' Blocklist: {hosts} hostnames ', [
+            ('regex search', timed(regex.search, hostnames)),
+            ('matcher search', timed(matcher.search, hostnames)),
+        ])
+
+        mismatches = sum(bool(regex.search(host)) != bool(matcher.search(host)) for host in hostnames)
+        style = self.style.NOTICE if mismatches else self.style.SUCCESS
+        self.stdout.write(style(f'Mismatched output: {mismatches} of {len(hostnames)} hostnames'))
+        if mismatches:
+            self.stdout.write("(the regex also matches substrings, e.g. 'xdomain.org' for 'domain.org')")
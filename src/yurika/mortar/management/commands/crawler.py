@@ -1,18 +1,21 @@
 import json
+import queue
 import uuid
 import tqdm
 from argparse import ArgumentTypeError
+from multiprocessing import get_context
 
 import elasticsearch
 import progressbar
 from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand, CommandError
 from django.core.validators import URLValidator
+from django.template.defaultfilters import filesizeformat
 from django.utils.formats import localize
 from django.utils.termcolors import colorize
 from terminaltables import SingleTable
 
-from yurika.mortar import models
+from yurika.mortar import models, workers
 from yurika.utils import utils
 
 from ..utils import side_by_side, style_by_line, truncate_message
@@ -31,6 +34,17 @@ Resume a crawler from where it left off.
 
 validate_url = URLValidator(schemes=['http', 'https'])
 
+spawn = get_context('spawn')
+
+LANGUAGES = [language for language, _ in models.SentenceTokenizer.LANGUAGES]
+
+HTML_STORAGE = [storage for storage, _ in models.Crawler.HTML_STORAGE]
+
+
+def filesize(value):
+    # `filesizeformat` separates the unit with a non-breaking space
+    return filesizeformat(value).replace('\xa0', ' ')
+
 
 def crawler(value):
     try:
@@ -55,6 +69,15 @@ def nth_error(value):
     raise ArgumentTypeError(f"errors are 1-indexed")
 
 
+def positive_int(value):
+    value = int(value)
+
+    if value > 0:
+        return value
+
+    raise ArgumentTypeError("must be a positive integer")
+
+
 def file_contents(filename):
     try:
         with open(filename, 'r') as file:
@@ -130,6 +153,12 @@ class Command(BaseCommand):
                             help="File path for a Scrapy JSON config.")
         parser.add_argument('--no-tokenize', action='store_false', dest='tokenize', default=True,
                             help="Don't tokenize crawled documents into sentences.")
+        parser.add_argument('--language', dest='language', choices=LANGUAGES,
+                            default=models.SentenceTokenizer.LANGUAGES.english,
+                            help="Language of the sentence tokenizer.")
+        parser.add_argument('--html-storage', dest='html_storage', choices=HTML_STORAGE,
+                            default=models.Crawler.HTML_STORAGE.text,
+                            help="How the raw HTML of crawled pages is stored.")
 
         group = parser.add_mutually_exclusive_group(required=False)
         group.add_argument('-a', '--allowed-domains', dest='allow', type=domains,
@@ -157,7 +186,9 @@ class Command(BaseCommand):
         # #################################################################### #
         # #### START ######################################################### #
         parser = subparsers.add_parser('start', cmd=self)
-        parser.add_argument('crawler', type=crawler, help="Crawler ID or UUID.")
+        parser.add_argument('crawler', type=crawler, nargs='+',
+                            help="Crawler ID or UUID. Multiple crawlers are "
+                                 "run together, in a single crawl process.")
         parser.add_argument('--time-limit', dest='time_limit', type=int,
                             help="Time limit (in seconds) for how long the "
                                  "crawler should run before it is terminated.")
@@ -195,6 +226,15 @@ class Command(BaseCommand):
         parser.add_argument('crawler', type=crawler, help="Crawler ID or UUID.")
         parser.add_argument('--stats', action='store_true', dest='stats', default=False,
                             help="Display the tokenized sentence statistics.")
+        parser.add_argument('-w', '--workers', dest='workers', type=positive_int, default=1,
+                            help="Number of worker processes (each scans a slice of the documents).")
+
+        # #################################################################### #
+        # #### STORAGE ####################################################### #
+        parser = subparsers.add_parser('storage', cmd=self)
+        parser.add_argument('crawler', type=crawler, help="Crawler ID or UUID.")
+        parser.add_argument('html_storage', choices=HTML_STORAGE, nargs='?',
+                            help="Migrate the crawler's documents to this HTML storage mode.")
 
         # #################################################################### #
         # #### STATS ######################################################### #
@@ -234,7 +274,9 @@ class Command(BaseCommand):
             'Elasticsearch index',
             'Status',
             'Resumable',
-            'docs',
+            'run docs',
+            'pages/s',
+            'ETA',
             'errs',
             'Crawler started',
             'Crawler stopped',
@@ -242,18 +284,53 @@ class Command(BaseCommand):
         ]
 
     def row(self, crawler):
+        # progress is reported from the latest stats snapshot, instead of querying the index,
+        # so the documents are those indexed by the current (or last) run, not the total
+        stats = crawler.task.latest_stats
         return [
             crawler.pk,
             colorize(crawler.index_name, fg='cyan'),
             self.style_status(crawler.task.status, crawler.task.get_status_display()),
             'Yes' if crawler.resumable else 'No',
-            self.document_count(crawler),
+            stats.indexed if stats else '-',
+            f'{stats.page_rate:.1f}' if stats else '-',
+            self.eta(crawler.task, stats),
             crawler.task.errors.count(),
             localize(crawler.task.started_at) or '-',
             localize(crawler.task.finished_at) or '-',
             utils.humanize_timedelta(crawler.task.runtime) or '-',
         ]
 
+    def eta(self, task, stats):
+        if stats is None or task.status != task.STATUS.running:
+            return '-'
+        if stats.eta is None:
+            return '?'
+        return utils.humanize_timedelta(stats.eta) or 'now'
+
+    def stats_table(self, crawler):
+        stats = crawler.task.latest_stats
+        data = [
+            ('Indexed docs', self.document_count(crawler)),
+        ]
+
+        if stats is not None:
+            data += [
+                ('Pages', f'{stats.pages} ({stats.page_rate:.1f}/s)'),
+                ('Downloaded', f'{filesize(stats.bytes)} ({filesize(stats.byte_rate)}/s)'),
+                ('Scraped', f'{stats.items} ({stats.item_rate:.1f}/s)'),
+                ('Pending', stats.pending),
+                ('ETA', self.eta(crawler.task, stats)),
+                ('Blocked', stats.blocked),
+                ('Max distance', stats.max_distance),
+                ('Flush latency', f'{stats.flush_latency:.2f}s' if stats.flush_latency is not None else '-'),
+                ('Updated', localize(stats.timestamp)),
+            ]
+
+        table = SingleTable(data, title=' Stats ')
+        table.inner_heading_row_border = False
+        return table
+
     def task_options(self, options):
         task_options = {}
         if options.get('time_limit') is not None:
@@ -266,7 +343,8 @@ class Command(BaseCommand):
         if crawler is not None:
             return self.instance_info(crawler, **options)
 
-        crawlers = models.Crawler.objects.all()
+        crawlers = models.Crawler.objects.select_related('task') \
+            .prefetch_related(models.CrawlerTask.prefetch_latest_stats('task__stats'))
 
         data = [self.row(crawler) for crawler in crawlers]
         data.insert(0, self.header())
@@ -287,6 +365,8 @@ class Command(BaseCommand):
 
         self.stdout.write(instance.table)
         self.stdout.write('')
+        self.stdout.write(self.stats_table(crawler).table)
+        self.stdout.write('')
         output = start.table
         if crawler.allowed_domains:
             output = side_by_side(output, allow.table)
@@ -306,7 +386,7 @@ class Command(BaseCommand):
 
         self.stdout.write(SingleTable(data, title='Crawlers').table)
 
-    def create(self, start, allow, block, config, tokenize, **options):
+    def create(self, start, allow, block, config, tokenize, language, html_storage, **options):
         self.stdout.write('Creating ...')
 
         start = '\n'.join(start)
@@ -319,12 +399,13 @@ class Command(BaseCommand):
             allowed_domains=allow,
             blocked_domains=block,
             config=config,
+            html_storage=html_storage,
         )
         c.full_clean()
         c.save()
 
         if tokenize:
-            models.SentenceTokenizer.objects.create(crawler=c)
+            models.SentenceTokenizer.objects.create(crawler=c, language=language)
         self.stdout.write(self.style.SUCCESS(f'ID: {c.uuid}'))
 
     def config(self, crawler, **options):
@@ -375,7 +456,10 @@ class Command(BaseCommand):
 
     def start(self, crawler, **options):
         self.stdout.write('Starting ...')
-        crawler.start(**self.task_options(options))
+        if len(crawler) == 1:
+            crawler[0].start(**self.task_options(options))
+        else:
+            models.Crawler.start_together(crawler, **self.task_options(options))
 
     def stop(self, crawler, **options):
         self.stdout.write('Stopping ...')
@@ -438,7 +522,16 @@ class Command(BaseCommand):
 
         self.stdout.write(table.table)
 
-    def tokenize(self, crawler, stats, **options):
+    def storage(self, crawler, html_storage=None, **options):
+        if html_storage is None:
+            self.stdout.write(f'HTML storage: {crawler.get_html_storage_display()}')
+            return
+
+        self.stdout.write('Migrating documents ...')
+        crawler.migrate_html_storage(html_storage)
+        self.stdout.write(self.style.SUCCESS(f'HTML storage: {crawler.get_html_storage_display()}'))
+
+    def tokenize(self, crawler, stats, workers, **options):
         tokenizer = getattr(crawler, 'sentencetokenizer', None)
         if tokenizer is None:
             tokenizer = models.SentenceTokenizer.objects.create(crawler=crawler)
@@ -448,8 +541,34 @@ class Command(BaseCommand):
 
         self.stdout.write('Tokenizing documents into sentences ...')
         documents = crawler.documents.search()
-        for doc in progressbar.progressbar(documents.scan(), max_value=documents.count()):
-            tokenizer.tokenize(doc)
+        if workers == 1:
+            tokenizer.tokenize_many(progressbar.progressbar(documents.scan(), max_value=documents.count()))
+        else:
+            self.parallel_tokenize(tokenizer, workers, max_value=documents.count())
+
+    def parallel_tokenize(self, tokenizer, slices, max_value):
+        progress = spawn.Queue()
+        procs = [
+            spawn.Process(target=workers.tokenize, args=(tokenizer.pk, slice_id, slices, progress))
+            for slice_id in range(slices)
+        ]
+
+        for proc in procs:
+            proc.start()
+
+        bar = progressbar.ProgressBar(max_value=max_value).start()
+        value = 0
+        while any(proc.is_alive() for proc in procs) or not progress.empty():
+            try:
+                value += progress.get(timeout=.5)
+            except queue.Empty:
+                continue
+            bar.update(min(value, max_value))
+        bar.finish()
+
+        failed = [proc for proc in procs if proc.exitcode != 0]
+        if failed:
+            raise RuntimeError(f'{len(failed)} of {slices} tokenizer workers failed.')
 
     def tokenizer_stats(self, tokenizer):
         def chunk(iterable, n):
@@ -19,38 +19,38 @@ class SentryMiddleware(middleware.Middleware):
 class TaskStatusMiddleware(middleware.Middleware):
     """
     Track the status of a task's execution.
+
+    Messages that run several tasks (e.g., `tasks.crawl_many`) pass their
+    `task_ids`, and any of the tasks that are still running once the message
+    is processed are completed with the message's result.
     """
 
-    def before_enqueue(self, broker, message, delay):
-        try:
-            task = Task.downcast.get(pk=message.kwargs.get('task_id'))
-        except Task.DoesNotExist:
-            return
+    def tasks(self, message):
+        task_ids = message.kwargs.get('task_ids', [message.kwargs.get('task_id')])
+        return Task.downcast.filter(pk__in=task_ids)
 
-        task._enqueue(message.message_id)
-        task.save()
+    def before_enqueue(self, broker, message, delay):
+        for task in self.tasks(message):
+            task._enqueue(message.message_id)
+            task.save()
 
     def before_process_message(self, broker, message):
-        try:
-            task = Task.downcast.get(pk=message.kwargs.get('task_id'))
-        except Task.DoesNotExist:
-            return
-
-        task._start()
-        task.save()
+        for task in self.tasks(message):
+            task._start()
+            task.save()
 
     def after_process_message(self, broker, message, *, result=None, exception=None):
-        try:
-            task = Task.downcast.get(pk=message.kwargs.get('task_id'))
-        except Task.DoesNotExist:
-            return
-
-        if exception is None:
-            task._finish()
-        elif isinstance(exception, task.Abort):
-            task._abort()
-        else:
-            task.log_exception(exception)
-            task._fail()
-
-        task.save()
+        for task in self.tasks(message):
+            # the task may have already been completed by the actor
+            if task.status != task.STATUS.running:
+                continue
+
+            if exception is None:
+                task._finish()
+            elif isinstance(exception, task.Abort):
+                task._abort()
+            else:
+                task.log_exception(exception)
+                task._fail()
+
+            task.save()
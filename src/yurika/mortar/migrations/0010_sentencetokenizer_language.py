@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 18:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0009_auto_20180523_2059'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentencetokenizer',
+            name='language',
+            field=models.CharField(choices=[('czech', 'czech'), ('danish', 'danish'), ('dutch', 'dutch'), ('english', 'english'), ('estonian', 'estonian'), ('finnish', 'finnish'), ('french', 'french'), ('german', 'german'), ('greek', 'greek'), ('italian', 'italian'), ('norwegian', 'norwegian'), ('polish', 'polish'), ('portuguese', 'portuguese'), ('slovene', 'slovene'), ('spanish', 'spanish'), ('swedish', 'swedish'), ('turkish', 'turkish')], default='english', help_text='Language of the Punkt sentence tokenizer model.', max_length=16),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 18:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0010_sentencetokenizer_language'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawler',
+            name='html_storage',
+            field=models.CharField(choices=[('text', 'Indexed text'), ('unindexed', 'Unindexed text'), ('compressed', 'Compressed'), ('blob', 'Blob store')], default='text', help_text='How the raw HTML of crawled pages is stored.', max_length=16),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 18:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0011_crawler_html_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlerStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('pages', models.PositiveIntegerField(default=0, help_text='Responses downloaded.')),
+                ('bytes', models.BigIntegerField(default=0, help_text='Response bytes downloaded.')),
+                ('items', models.PositiveIntegerField(default=0, help_text='Documents scraped.')),
+                ('indexed', models.PositiveIntegerField(default=0, help_text='Documents written to the index.')),
+                ('pending', models.PositiveIntegerField(default=0, help_text='Requests waiting in the scheduler.')),
+                ('blocked', models.PositiveIntegerField(default=0, help_text='Requests to blocked domains.')),
+                ('max_distance', models.PositiveIntegerField(default=0)),
+                ('page_rate', models.FloatField(default=0)),
+                ('byte_rate', models.FloatField(default=0)),
+                ('item_rate', models.FloatField(default=0)),
+                ('flush_latency', models.FloatField(help_text='Duration of the last index write, in seconds.', null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='mortar.CrawlerTask')),
+            ],
+            options={
+                'ordering': ('-timestamp',),
+            },
+        ),
+    ]
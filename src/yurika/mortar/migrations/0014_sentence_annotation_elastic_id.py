@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 19:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0013_document_annotation_elastic_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sentence',
+            index=models.Index(fields=['annotation', 'elastic_id'], name='mortar_sent_annotat_eef944_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 19:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0014_sentence_annotation_elastic_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationTask',
+            fields=[
+                ('task_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='mortar.Task')),
+                ('revoked', models.BooleanField(default=False, editable=False, help_text='Task has been marked for revocation.')),
+                ('total', models.PositiveIntegerField(editable=False, help_text='Sentences matching the query.', null=True)),
+                ('processed', models.PositiveIntegerField(default=0, editable=False, help_text='Sentences processed.')),
+                ('rate', models.FloatField(editable=False, help_text='Sentences processed per second.', null=True)),
+                ('annotation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='task', to='mortar.Annotation')),
+            ],
+            bases=('mortar.task',),
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('downcast', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
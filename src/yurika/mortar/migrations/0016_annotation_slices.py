@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 19:04
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0015_annotationtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='slices',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Number of slices of the query that are scrolled in parallel.', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 19:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0016_annotation_slices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='auto_refresh',
+            field=models.BooleanField(default=False, help_text="Refresh the annotation when its crawler's crawl finishes."),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='refreshed_at',
+            field=models.DateTimeField(editable=False, help_text='Sentences tokenized before this time have been processed.', null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-17 19:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mortar', '0017_annotation_refresh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentencetokenizer',
+            name='tokenized_at',
+            field=models.DateTimeField(editable=False, help_text='Documents crawled before this time have been tokenized.', null=True),
+        ),
+    ]
@@ -1,32 +1,50 @@
+import functools
 import json
 import os
 import shutil
+import threading
 import uuid
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import timedelta
 from traceback import format_exception
 
+import dramatiq
 import jsonfield
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import connection, models, transaction
+from django.db.models import OuterRef, Prefetch, Subquery
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 from django_fsm import FSMField, transition
+from django_fsm.signals import post_transition
 from elasticsearch import TransportError
-from elasticsearch_dsl import Index
+from elasticsearch_dsl import Index, connections
 from model_utils import Choices, managers
+from redis import RedisError
 from shortuuid import ShortUUID
 
 from yurika.utils import utils, validators
 
 from . import documents
+from .blobs import BlobStore
 
 
 # Elasticsearch-friendly identifiers (no uppercase characters)
 b36_uuid = ShortUUID(alphabet='0123456789abcdefghijklmnopqrstuvwxyz')
 
 
+def broker_client():
+    """
+    Return the Redis client of the Dramatiq broker, or None if the broker is
+    not backed by Redis (e.g., the stub broker).
+    """
+    return getattr(dramatiq.get_broker(), 'client', None)
+
+
 def validate_domains(text):
     for domain in text.splitlines():
         msg = "Invalid domain name: '%(domain)s'." % {'domain': domain}
@@ -209,6 +227,15 @@ class Crawler(models.Model):
     config = jsonfield.JSONField(blank=True, default=dict, validators=[validate_dict],
                                  help_text="Override settings for Scrapy.")
 
+    HTML_STORAGE = Choices(
+        ('text', 'Indexed text'),
+        ('unindexed', 'Unindexed text'),
+        ('compressed', 'Compressed'),
+        ('blob', 'Blob store'),
+    )
+    html_storage = models.CharField(max_length=16, choices=HTML_STORAGE, default=HTML_STORAGE.text,
+                                    help_text="How the raw HTML of crawled pages is stored.")
+
     class Meta:
         ordering = ['pk']
 
@@ -221,6 +248,17 @@ class Crawler(models.Model):
 
         self.task.send(**options)
 
+    @classmethod
+    def start_together(cls, crawlers, **options):
+        """
+        Start several crawlers in a single crawl process (see `tasks.crawl_many`).
+        """
+        for crawler in crawlers:
+            if crawler.task.status != crawler.task.STATUS.not_queued:
+                raise RuntimeError(f'{crawler} has already been started.')
+
+        CrawlerTask.send_many([crawler.task for crawler in crawlers], **options)
+
     def stop(self):
         if self.task.status != self.task.STATUS.running:
             raise RuntimeError('Crawler is not currently running.')
@@ -275,14 +313,92 @@ class Crawler(models.Model):
     def index(self):
         return Index(self.index_name)
 
+    @property
+    def document_class(self):
+        return documents.HTML_DOCUMENTS[self.html_storage]
+
     @property
     def documents(self):
-        return documents.Document.context(index=self.index_name)
+        return self.document_class.context(index=self.index_name)
+
+    @property
+    def blobs(self):
+        """
+        Blob store for the HTML of crawled pages (see `HTML_STORAGE.blob`).
+        """
+        return BlobStore(utils.path(f'.crawlers/blobs/{self.uuid}'))
+
+    def store_html(self, doc):
+        """
+        Prepare the document's HTML for indexing. In blob mode, the HTML is
+        moved to the blob store, and replaced by its digest.
+        """
+        if self.html_storage == self.HTML_STORAGE.blob:
+            doc.html = self.blobs.put(doc.html)
+
+    def get_html(self, doc):
+        """
+        Return the HTML of an indexed document.
+        """
+        html = getattr(doc, 'html', None)
+        if self.html_storage == self.HTML_STORAGE.blob and html:
+            return self.blobs.get(html)
+        return html
+
+    def migrate_html_storage(self, html_storage):
+        """
+        Change how the HTML of crawled pages is stored, and migrate the existing
+        documents. Documents are converted into a temporary index, which is
+        then reindexed into the recreated crawler index.
+        """
+        if self.task.status == self.task.STATUS.running:
+            raise RuntimeError('Crawler is currently running.')
+
+        if html_storage == self.html_storage:
+            raise RuntimeError(f"Crawler HTML is already stored as '{html_storage}'.")
+
+        source = Crawler(pk=self.pk, uuid=self.uuid, html_storage=self.html_storage)
+        target = Crawler(pk=self.pk, uuid=self.uuid, html_storage=html_storage)
+        temp_name = f'{self.index_name}-migrate'
+
+        def converted():
+            for doc in source.documents.search().scan():
+                data = doc.to_dict()
+                data['html'] = source.get_html(doc)
+
+                new = target.document_class(meta={'id': doc.meta.id}, **data)
+                target.store_html(new)
+                yield new
+
+        target.document_class.init(temp_name)
+        try:
+            target.documents.bulk_create(converted(), index=temp_name)
+            Index(temp_name).refresh()
+        except BaseException:
+            Index(temp_name).delete(ignore=404)
+            if target.html_storage == self.HTML_STORAGE.blob:
+                target.blobs.clear()
+            raise
+
+        # if reindexing fails, the converted documents are left in the temporary index
+        self.index.delete()
+        target.document_class.init(self.index_name)
+        connections.get_connection().reindex(body={
+            'source': {'index': temp_name},
+            'dest': {'index': self.index_name},
+        }, refresh=True)
+        Index(temp_name).delete()
+
+        self.html_storage = html_storage
+        self.save(update_fields=['html_storage'])
+
+        if source.html_storage == self.HTML_STORAGE.blob:
+            source.blobs.clear()
 
     @staticmethod
     def _create_index(sender, instance, created, **kwargs):
         if created:
-            documents.Document.init(instance.index_name)
+            instance.document_class.init(instance.index_name)
 
     @staticmethod
     def _delete_index(sender, instance, **kwargs):
@@ -291,6 +407,8 @@ class Crawler(models.Model):
         except TransportError:
             pass
 
+        instance.blobs.clear()
+
 
 post_save.connect(Crawler._create_index, sender=Crawler)
 post_delete.connect(Crawler._delete_index, sender=Crawler)
@@ -305,10 +423,102 @@ class CrawlerTask(Task):
     def task_path(self):
         return 'yurika.mortar.tasks.crawl'
 
+    @classmethod
+    def send_many(cls, tasks, **options):
+        """
+        Send a single message, which runs the crawls of all of the tasks.
+        """
+        if any(task.message_id for task in tasks):
+            raise RuntimeError('Task already queued.')
+
+        return import_string('yurika.mortar.tasks.crawl_many').send_with_options(
+            kwargs={'task_ids': [task.pk for task in tasks]},
+            **options
+        )
+
+    @property
+    def revoke_channel(self):
+        return f'mortar:crawlertask:{self.pk}:revoke'
+
     def revoke(self):
         self.revoked = True
         self.save(update_fields=['revoked'])
 
+        # notify the crawl, which otherwise only polls the DB as a fallback
+        client = broker_client()
+        if client is not None:
+            try:
+                client.publish(self.revoke_channel, self.pk)
+            except RedisError:
+                pass
+
+    # snapshots kept per task - an hour of history at the default interval
+    STATS_HISTORY = 360
+
+    @property
+    def latest_stats(self):
+        # avoid a query per task when listed (see `prefetch_latest_stats`)
+        if hasattr(self, 'prefetched_stats'):
+            return self.prefetched_stats[0] if self.prefetched_stats else None
+        return self.stats.first()
+
+    @staticmethod
+    def prefetch_latest_stats(lookup='stats'):
+        """
+        Prefetch the latest stats snapshot of each task, given the `lookup`
+        from the queried model to the task's stats (e.g., 'task__stats').
+        """
+        latest = CrawlerStats.objects.filter(task=OuterRef('task')).order_by('-timestamp', '-pk')
+        queryset = CrawlerStats.objects.filter(pk=Subquery(latest.values('pk')[:1]))
+        return Prefetch(lookup, queryset=queryset, to_attr='prefetched_stats')
+
+    def save_stats(self, **values):
+        """
+        Save a stats snapshot, dropping all but the latest `STATS_HISTORY`
+        snapshots, so that the table doesn't grow with the crawl.
+        """
+        self.stats.create(**values)
+
+        stale = self.stats.values_list('pk', flat=True)[self.STATS_HISTORY:]
+        CrawlerStats.objects.filter(pk__in=list(stale)).delete()
+
+
+class CrawlerStats(models.Model):
+    """
+    Periodic snapshot of a crawl's stats, saved by the crawl process (see
+    `crawler.extensions.TaskStats`). Counts are totals for the task's crawl,
+    while rates are per second since the previous snapshot.
+    """
+    task = models.ForeignKey(CrawlerTask, on_delete=models.CASCADE, related_name='stats')
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    pages = models.PositiveIntegerField(default=0, help_text="Responses downloaded.")
+    bytes = models.BigIntegerField(default=0, help_text="Response bytes downloaded.")
+    items = models.PositiveIntegerField(default=0, help_text="Documents scraped.")
+    indexed = models.PositiveIntegerField(default=0, help_text="Documents written to the index.")
+    pending = models.PositiveIntegerField(default=0, help_text="Requests waiting in the scheduler.")
+    blocked = models.PositiveIntegerField(default=0, help_text="Requests to blocked domains.")
+    max_distance = models.PositiveIntegerField(default=0)
+
+    page_rate = models.FloatField(default=0)
+    byte_rate = models.FloatField(default=0)
+    item_rate = models.FloatField(default=0)
+    flush_latency = models.FloatField(null=True, help_text="Duration of the last index write, in seconds.")
+
+    class Meta:
+        ordering = ('-timestamp', )
+
+    @property
+    def eta(self):
+        """
+        Estimated time to download the pending requests at the current rate.
+        """
+        if not self.pending:
+            return timedelta(0)
+        if self.page_rate:
+            return timedelta(seconds=self.pending / self.page_rate)
+        return None
+
 
 @receiver(post_save, sender=Crawler)
 def crawler_task(sender, instance, created, **kwargs):
@@ -321,32 +531,94 @@ class CrawlerAccount(models.Model):
     account = models.ForeignKey('accounts.Account', on_delete=models.CASCADE)
 
 
+@functools.lru_cache()
+def punkt_tokenizer(language):
+    """
+    Load the Punkt sentence tokenizer for a language. The model is cached, as
+    `nltk.sent_tokenize` resolves and loads it through NLTK's loader per call.
+    """
+    # see: https://github.com/nltk/nltk/issues/947
+    from nltk import data
+
+    return data.load(f'tokenizers/punkt/{language}.pickle')
+
+
 class SentenceTokenizer(models.Model):
+    LANGUAGES = Choices(
+        'czech', 'danish', 'dutch', 'english', 'estonian', 'finnish',
+        'french', 'german', 'greek', 'italian', 'norwegian', 'polish',
+        'portuguese', 'slovene', 'spanish', 'swedish', 'turkish',
+    )
+
     uuid = models.UUIDField(unique=True, editable=False, default=uuid.uuid4)
     crawler = models.OneToOneField(Crawler, on_delete=models.CASCADE)
+    language = models.CharField(max_length=16, choices=LANGUAGES, default=LANGUAGES.english,
+                                help_text="Language of the Punkt sentence tokenizer model.")
+    tokenized_at = models.DateTimeField(null=True, editable=False,
+                                        help_text="Documents crawled before this time have been tokenized.")
 
-    @classmethod
-    def to_sentences(cls, document):
-        # see: https://github.com/nltk/nltk/issues/947
-        from nltk.tokenize import sent_tokenize
+    # documents may be indexed some time after they're crawled
+    TOKENIZE_OVERLAP = timedelta(minutes=5)
 
-        sentences = sent_tokenize(document.text)
+    def to_sentences(self, document):
+        sentences = punkt_tokenizer(self.language).tokenize(document.text)
+        timestamp = timezone.now()
         sentences = [
             documents.Sentence(
                 document_id=document.meta.id,
                 text=sentence,
+                timestamp=timestamp,
             ) for sentence in sentences
         ]
         return sentences
 
     def tokenize(self, document):
-        if self.sentences.search() \
-                         .filter('term', document_id=document.meta.id) \
-                         .count() > 0:
-            return  # noop - already tokenized
+        return self.tokenize_many([document])
 
-        sentences = self.to_sentences(document)
-        self.sentences.bulk_create(sentences)
+    def tokenize_many(self, documents, batch_size=500):
+        """
+        Tokenize an iterable of documents, skipping those that have already
+        been tokenized. Documents are checked in batches, and the sentences
+        are streamed to a single bulk request.
+        """
+        def sentences():
+            for batch in utils.chunked(documents, batch_size):
+                tokenized = self.tokenized([doc.meta.id for doc in batch])
+
+                for document in batch:
+                    if document.meta.id not in tokenized:
+                        yield from self.to_sentences(document)
+
+        return self.sentences.bulk_create(sentences())
+
+    def refresh(self):
+        """
+        Tokenize the documents that were crawled since the last refresh.
+        """
+        tokenized_at = timezone.now()
+        search = self.documents.search()
+        if self.tokenized_at is not None:
+            search = search.filter('range', timestamp={'gte': self.tokenized_at - self.TOKENIZE_OVERLAP})
+
+        self.tokenize_many(search.scan())
+
+        self.tokenized_at = tokenized_at
+        self.save(update_fields=['tokenized_at'])
+
+    def tokenized(self, document_ids):
+        """
+        Return the subset of `document_ids` that have already been tokenized.
+        """
+        if not document_ids:
+            return set()
+
+        search = self.sentences.search() \
+                     .filter('terms', document_id=document_ids) \
+                     .extra(size=0)
+        search.aggs.bucket('documents', 'terms', field='document_id', size=len(document_ids))
+
+        response = search.execute()
+        return {bucket.key for bucket in response.aggregations.documents.buckets}
 
     @property
     def index_name(self):
@@ -384,37 +656,247 @@ post_delete.connect(SentenceTokenizer._delete_index, sender=SentenceTokenizer)
 class Annotation(models.Model):
     crawler = models.ForeignKey(Crawler, on_delete=models.CASCADE)
     query = models.TextField(help_text="Elasticsearch query JSON.")
+    slices = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)],
+                                              help_text="Number of slices of the query that are scrolled in parallel.")
+    auto_refresh = models.BooleanField(default=False,
+                                       help_text="Refresh the annotation when its crawler's crawl finishes.")
+    refreshed_at = models.DateTimeField(null=True, editable=False,
+                                        help_text="Sentences tokenized before this time have been processed.")
+
+    # sentences may be indexed some time after they're tokenized
+    REFRESH_OVERLAP = timedelta(minutes=5)
 
-    def execute(self):
-        if self.document_set.exists() or self.sentence_set.exists():
-            return  # noop - already executed
+    def start(self, **options):
+        if self.task.status != self.task.STATUS.not_queued:
+            raise RuntimeError('Annotation has already been started.')
 
+        self.task.send(**options)
+
+    def stop(self):
+        if self.task.status != self.task.STATUS.running:
+            raise RuntimeError('Annotation is not currently running.')
+        self.task.revoke()
+
+    def refresh(self, **options):
+        """
+        Execute the annotation again, which adds the matching sentences that
+        were tokenized since it was last executed (see `execute`). This also
+        resumes an interrupted execution.
+        """
+        errors = []
+        with transaction.atomic():
+            # lock the task, so that concurrent refreshes can't both replace it
+            task = AnnotationTask.objects.select_for_update().filter(annotation=self).first()
+            if task is not None:
+                if task.status in (task.STATUS.enqueued, task.STATUS.running):
+                    raise RuntimeError('Annotation is already running.')
+
+                # the error log is carried over to the new task
+                errors = list(task.errors.all())
+                task.delete()
+
+            self.task = AnnotationTask.objects.create(annotation=self)
+            for error in errors:
+                error.pk, error.task = None, self.task
+            TaskError.objects.bulk_create(errors)
+
+            # publish after the commit, so that the worker can find the new task
+            transaction.on_commit(lambda: self.task.send(**options))
+
+    def search(self):
+        """
+        Search for the sentences that match the query, and that were tokenized
+        since the annotation was last executed.
+        """
         query = json.loads(self.query)
+        search = self.crawler.sentencetokenizer.sentences.search().update_from_dict(query)
+
+        if self.refreshed_at is not None:
+            search = search.filter('range', timestamp={'gte': self.refreshed_at - self.REFRESH_OVERLAP})
+        return search
+
+    def execute(self, chunk_size=1000, batch_size=100, progress=None):
+        """
+        Store the sentences that match the query, along with their documents.
+
+        Sentences are scanned and stored in chunks of `chunk_size`, and each
+        chunk is committed in its own transaction, so memory use is bounded
+        by the chunk size. Sentences that were already stored are skipped, so
+        an interrupted execution may be resumed by executing it again.
+
+        Once completed, only the sentences that are tokenized afterwards are
+        searched by the next execution, so that the annotation is refreshed
+        incrementally.
+
+        With multiple `slices`, the query is split into a sliced scroll, and
+        each slice is scanned by its own thread. Documents are fetched
+        concurrently, while the chunks are committed one at a time, so that
+        documents shared by the slices are only stored once.
+
+        The `progress` callback receives the number of sentences processed in
+        each chunk, once the chunk has been committed. An exception raised by
+        the callback stops the execution.
+        """
+        # the high-water mark only advances once every slice has completed
+        refreshed_at = timezone.now()
+        self._execute(chunk_size, batch_size, progress)
+
+        self.refreshed_at = refreshed_at
+        self.save(update_fields=['refreshed_at'])
+
+    def _execute(self, chunk_size, batch_size, progress):
+        lock, stop = threading.Lock(), threading.Event()
+
+        def execute_slice(search):
+            sentences = search.params(size=chunk_size).scan()
+            for chunk in utils.chunked(sentences, chunk_size):
+                if stop.is_set():
+                    return
+                self._store(chunk, batch_size, lock, progress)
+
+        if self.slices <= 1:
+            return execute_slice(self.search())
+
+        def execute_thread(search):
+            try:
+                execute_slice(search)
+            finally:
+                # connections are per thread, and are otherwise left open
+                connection.close()
+
+        searches = [
+            self.search().extra(slice={'id': slice_id, 'max': self.slices})
+            for slice_id in range(self.slices)
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.slices) as executor:
+            pending = [executor.submit(execute_thread, search) for search in searches]
+            try:
+                # poll, as exceptions raised asynchronously in this thread (e.g.,
+                # Dramatiq's `Shutdown`) aren't delivered during a blocking wait
+                while pending:
+                    done, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+                    for future in done:
+                        future.result()
+            finally:
+                # the remaining slices stop after their current chunk
+                stop.set()
+
+    def _store(self, sentences, batch_size, lock, progress=None):
         tokenizer = self.crawler.sentencetokenizer
-        sentences = [s for s in tokenizer.sentences.search().update_from_dict(query).scan()]
-        documents = tokenizer.documents.mget({s.document_id for s in sentences}, missing='skip')
 
+        # documents are fetched outside of the lock, so the slices download them concurrently
+        missing = {s.document_id for s in sentences}
+        missing -= self._document_ids(missing).keys()
+        fetched = tokenizer.documents.mget(list(missing), missing='skip') if missing else []
+
+        with lock:
+            with transaction.atomic():
+                self._store_chunk(sentences, fetched, batch_size)
+
+            if progress is not None:
+                progress(len(sentences))
+
+    def _store_chunk(self, sentences, fetched, batch_size):
+        stored = set(self.sentence_set
+                         .filter(elastic_id__in=[s.meta.id for s in sentences])
+                         .values_list('elastic_id', flat=True))
+        sentences = [s for s in sentences if s.meta.id not in stored]
+
+        # another slice may have stored the fetched documents in the meantime
+        document_ids = self._document_ids({s.document_id for s in sentences})
         documents = [Document(
             elastic_id=doc.meta.id,
             annotation=self,
             url=doc.url,
             timestamp=doc.timestamp,
             text=doc.text,
-        ) for doc in documents]
-        Document.objects.bulk_create(documents)
+        ) for doc in fetched if doc.meta.id not in document_ids]
+
+        if documents:
+            documents = Document.objects.bulk_create(documents, batch_size=batch_size)
+
+            # primary keys are only set by backends that return them from a bulk insert
+            if all(doc.pk is not None for doc in documents):
+                document_ids.update((doc.elastic_id, doc.pk) for doc in documents)
+            else:
+                document_ids.update(self._document_ids({doc.elastic_id for doc in documents}))
 
         sentences = [Sentence(
             elastic_id=sentence.meta.id,
             annotation=self,
-            document=Document.objects.get(elastic_id=sentence.document_id),
+            document_id=document_ids[sentence.document_id],
             text=sentence.text,
-        ) for sentence in sentences]
-        Sentence.objects.bulk_create(sentences)
+        ) for sentence in sentences if sentence.document_id in document_ids]
+        Sentence.objects.bulk_create(sentences, batch_size=batch_size)
+
+    def _document_ids(self, elastic_ids):
+        documents = self.document_set.filter(elastic_id__in=elastic_ids)
+        return dict(documents.values_list('elastic_id', 'pk'))
 
     class Meta:
         ordering = ['pk']
 
 
+class AnnotationTask(Task):
+    annotation = models.OneToOneField(Annotation, on_delete=models.CASCADE, related_name='task')
+    revoked = models.BooleanField(default=False, editable=False,
+                                  help_text="Task has been marked for revocation.")
+
+    total = models.PositiveIntegerField(null=True, editable=False, help_text="Sentences matching the query.")
+    processed = models.PositiveIntegerField(default=0, editable=False, help_text="Sentences processed.")
+    rate = models.FloatField(null=True, editable=False, help_text="Sentences processed per second.")
+
+    @property
+    def task_path(self):
+        return 'yurika.mortar.tasks.annotate'
+
+    def revoke(self):
+        # the annotation checks for revocation after each chunk (see `progress`)
+        self.revoked = True
+        self.save(update_fields=['revoked'])
+
+    def progress(self, processed):
+        """
+        Record the number of sentences processed since the last report, and
+        abort the task if it has been revoked.
+        """
+        self.processed += processed
+
+        elapsed = (timezone.now() - self.started_at).total_seconds() if self.started_at else 0
+        self.rate = self.processed / elapsed if elapsed > 0 else None
+        self.save(update_fields=['processed', 'rate'])
+
+        self.refresh_from_db(fields=['revoked'])
+        if self.revoked:
+            raise self.Abort
+
+    @property
+    def eta(self):
+        """
+        Estimated time to process the remaining sentences.
+        """
+        if self.total is None or not self.rate:
+            return None
+        return timedelta(seconds=max(self.total - self.processed, 0) / self.rate)
+
+
+@receiver(post_save, sender=Annotation)
+def annotation_task(sender, instance, created, **kwargs):
+    if created:
+        AnnotationTask.objects.create(annotation=instance)
+
+
+@receiver(post_transition, sender=CrawlerTask)
+def refresh_annotations(sender, instance, name, source, target, **kwargs):
+    # new pages may have been crawled, regardless of how the crawl finished
+    if target not in (Task.STATUS.done, Task.STATUS.failed, Task.STATUS.aborted):
+        return
+
+    if Annotation.objects.filter(crawler_id=instance.crawler_id, auto_refresh=True).exists():
+        import_string('yurika.mortar.tasks.refresh_annotations').send(instance.crawler_id)
+
+
 class Document(models.Model):
     annotation = models.ForeignKey(Annotation, on_delete=models.CASCADE)
     elastic_id = models.TextField()
@@ -422,9 +904,19 @@ class Document(models.Model):
     timestamp = models.DateTimeField()
     text = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['annotation', 'elastic_id']),
+        ]
+
 
 class Sentence(models.Model):
     annotation = models.ForeignKey(Annotation, on_delete=models.CASCADE)
     elastic_id = models.TextField()
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
     text = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['annotation', 'elastic_id']),
+        ]
@@ -1,7 +1,15 @@
+import atexit
+import os
+import queue
+import signal
+from contextlib import contextmanager
 from multiprocessing import get_context
+from time import monotonic, sleep
 
 import dramatiq
+from django.conf import settings
 from dramatiq.middleware import Shutdown, TimeLimitExceeded
+from redis import RedisError
 
 from . import models
 from .crawler import process
@@ -9,39 +17,465 @@ from .crawler import process
 
 spawn = get_context('spawn')
 
+# seconds to wait for a crawl to stop gracefully, before it's killed
+STOP_TIMEOUT = 60
+
+
+class RevocationListener(object):
+    """
+    Wait for crawler tasks to be revoked.
+
+    Revocations are pushed over the Dramatiq broker's Redis connection (see
+    `CrawlerTask.revoke`), and the DB is only polled every `poll_interval`
+    seconds as a fallback. Without a Redis broker, or once its connection
+    fails, the DB is polled every `fallback_interval` seconds instead.
+    """
+
+    def __init__(self, tasks, poll_interval=10, fallback_interval=.5):
+        self.tasks = {task.revoke_channel: task for task in tasks}
+        self.pubsub = None
+        self.polled = None
+        self.poll_interval = poll_interval
+        self.fallback_interval = fallback_interval
+
+        client = models.broker_client()
+        if client is None:
+            self.poll_interval = fallback_interval
+            return
+
+        # subscribe before the first poll, so that no revocations are missed
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            self.pubsub.subscribe(*self.tasks)
+        except RedisError:
+            self.fallback()
+
+    def fallback(self):
+        """
+        Stop listening for pushed revocations, and poll the DB instead.
+        """
+        try:
+            self.pubsub.close()
+        except RedisError:
+            pass
+
+        # revocations may have been missed, so the DB is polled immediately
+        self.pubsub, self.polled = None, None
+        self.poll_interval = self.fallback_interval
+
+    def poll(self):
+        now = monotonic()
+        if self.polled is None or now - self.polled >= self.poll_interval:
+            self.polled = now
+            for task in self.tasks.values():
+                task.refresh_from_db(fields=['revoked'])
+        return [task for task in self.tasks.values() if task.revoked]
+
+    def wait(self, timeout):
+        """
+        Return the revoked tasks, waiting up to `timeout` seconds for a
+        revocation to be pushed.
+        """
+        revoked = self.poll()
+        if revoked:
+            return revoked
+
+        if self.pubsub is None:
+            sleep(timeout)
+            return []
+
+        try:
+            message = self.pubsub.get_message(timeout=timeout)
+        except RedisError:
+            self.fallback()
+            return self.poll()
+
+        if message is None:
+            return []
+
+        channel = message['channel']
+        task = self.tasks.get(channel.decode() if isinstance(channel, bytes) else channel)
+        if task is None:
+            return []
+
+        task.revoked = True
+        return [task]
+
+    def discard(self, task):
+        """
+        Stop listening for the task's revocation.
+        """
+        self.tasks.pop(task.revoke_channel, None)
+        if self.pubsub is not None:
+            try:
+                self.pubsub.unsubscribe(task.revoke_channel)
+            except RedisError:
+                self.fallback()
+
+    def close(self):
+        if self.pubsub is not None:
+            self.pubsub.close()
+
+
+def stop_crawl(proc, stop, timeout):
+    """
+    Gracefully stop the crawl process (see `process.crawl`), and kill it if it
+    hasn't exited within `timeout` seconds. Return whether it was killed.
+    """
+    stop.set()
+    proc.join(timeout)
+    if proc.exitcode is not None:
+        return False
+
+    os.kill(proc.pid, signal.SIGKILL)
+    proc.join()
+    return True
+
+
+class SpawnedCrawl(object):
+    """
+    A crawl in a newly spawned process (see `process.crawl`).
+    """
+
+    def __init__(self):
+        self.proc = None
+        self.stop_event = spawn.Event()
+
+    def start(self, task_id):
+        self.proc = spawn.Process(target=process.crawl, args=(task_id, self.stop_event))
+        self.proc.start()
+
+    def running(self, task_id):
+        return self.proc.exitcode is None
+
+    def stop(self, task_id, timeout):
+        return stop_crawl(self.proc, self.stop_event, timeout)
+
+    def error(self, task_id):
+        if self.proc.exitcode != 0:
+            return f'Crawler returned a non-zero exit code: {self.proc.exitcode}'
+
+
+class CrawlHost(object):
+    """
+    Crawls in a warm process (see `process.host`), which is reused between
+    crawls. The host exits once it has run `max_jobs` crawls.
+    """
+
+    def __init__(self, max_jobs=0):
+        self.conn, conn = spawn.Pipe()
+        self.proc = spawn.Process(target=process.host, args=(conn, max_jobs))
+        self.proc.start()
+        conn.close()
+
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.active = set()
+        self.results = {}
+
+    @property
+    def busy(self):
+        return bool(self.active)
+
+    @property
+    def reusable(self):
+        if self.max_jobs and self.jobs >= self.max_jobs:
+            return False
+        return not self.busy and self.proc.exitcode is None
+
+    def start(self, task_id):
+        self.jobs += 1
+        self.active.add(task_id)
+        self.results.pop(task_id, None)
+        self.conn.send(('crawl', task_id))
+
+    def receive(self, timeout=0):
+        while self.busy and self.conn.poll(timeout):
+            try:
+                _, task_id, error = self.conn.recv()
+                self.active.discard(task_id)
+                self.results[task_id] = error
+            except EOFError:
+                # the host exited, and its exit code is reported
+                self.proc.join()
+                return
+
+            # only wait for the first message
+            timeout = 0
+
+    def running(self, task_id):
+        self.receive()
+        return task_id in self.active and self.proc.exitcode is None
+
+    def stop(self, task_id, timeout):
+        """
+        Gracefully stop the crawl, and kill the host (along with any other
+        crawls it's running) if the crawl hasn't finished within `timeout`
+        seconds. Return whether it was killed.
+        """
+        self.request_stop(task_id)
+
+        deadline = monotonic() + timeout
+        while self.running(task_id) and monotonic() < deadline:
+            self.receive(deadline - monotonic())
+
+        if not self.running(task_id):
+            return False
+
+        self.kill()
+        return True
+
+    def request_stop(self, task_id):
+        try:
+            self.conn.send(('stop', task_id))
+        except OSError:
+            pass
+
+    def kill(self):
+        os.kill(self.proc.pid, signal.SIGKILL)
+        self.proc.join()
+
+    def error(self, task_id):
+        if self.results.get(task_id) is not None:
+            return f'Crawler failed to start: {self.results[task_id]}'
+        if task_id in self.active and self.proc.exitcode != 0:
+            return f'Crawler host returned a non-zero exit code: {self.proc.exitcode}'
+
+    def close(self):
+        # the host stops once its pipe is closed
+        self.conn.close()
+        self.proc.join()
+
+
+class CrawlHostPool(object):
+    """
+    Pool of idle crawl hosts, shared by the worker's threads. Hosts that have
+    run their `max_jobs` crawls are replaced by a new host, which is warmed up
+    in the background for the next crawl.
+    """
+
+    def __init__(self):
+        self.idle = queue.LifoQueue()
+
+    @contextmanager
+    def acquire(self, max_jobs=0):
+        while True:
+            try:
+                host = self.idle.get_nowait()
+            except queue.Empty:
+                host = CrawlHost(max_jobs)
+                break
+
+            # idle hosts may have exited since (e.g., killed by the OOM killer)
+            if host.proc.exitcode is None:
+                break
+            host.close()
+
+        try:
+            yield host
+        finally:
+            if host.reusable:
+                self.idle.put(host)
+            else:
+                host.close()
+                if not host.busy:
+                    self.idle.put(CrawlHost(max_jobs))
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+hosts = CrawlHostPool()
+
+# idle hosts must be stopped, as the interpreter waits for its child processes to exit
+atexit.register(hosts.close)
+
+
+@contextmanager
+def crawl_process():
+    if settings.CRAWLER_WARM_HOSTS:
+        with hosts.acquire(settings.CRAWLER_HOST_MAX_JOBS) as host:
+            yield host
+    else:
+        yield SpawnedCrawl()
+
+
+def stop_timeout(task):
+    return task.crawler.config.get('CRAWLER_STOP_TIMEOUT', STOP_TIMEOUT)
+
 
 @dramatiq.actor(max_retries=0, time_limit=float('inf'), notify_shutdown=True)
 def crawl(task_id):
     # NOTE: wrapping the crawler in a task enables pipelining and offloading to
     #       a remote worker. Otherwise this would be unnecessary indirection.
     task = models.CrawlerTask.objects.get(pk=task_id)
+    timeout = stop_timeout(task)
+    revocations = RevocationListener([task])
+
+    with crawl_process() as proc:
+        proc.start(task_id)
+
+        try:
+            while proc.running(task_id):
+                if revocations.wait(.05):
+                    raise task.Abort
 
-    proc = spawn.Process(target=process.crawl, args=(task_id, ))
-    proc.start()
+        except (Shutdown, TimeLimitExceeded) as exc:
+            # Shutdown/TimeLimitExceeded are interrupts, not errors.
+            task.log_error('Dramatiq process terminated.')
+            raise task.Abort from exc
+
+        except Exception as exc:
+            task.log_exception(exc)
+            raise
+
+        finally:
+            revocations.close()
+
+            if proc.running(task_id) and proc.stop(task_id, timeout):
+                task.log_error(f'Crawler did not stop within {timeout} seconds, and was killed.')
+
+            elif proc.error(task_id):
+                task.log_error(proc.error(task_id))
+
+
+def finish_crawl(task, proc):
+    error = proc.error(task.pk)
+
+    if task.revoked:
+        task._abort()
+    elif error:
+        task.log_error(error)
+        task._fail()
+    else:
+        task._finish()
+    task.save()
+
+
+def kill_crawls(host, tasks, expired):
+    """
+    Kill the host, whose `expired` crawls did not stop in time. The host's
+    other crawls are killed along with it.
+    """
+    host.kill()
+
+    for task in tasks:
+        if task.pk in expired:
+            task.log_error(f'Crawler did not stop within {stop_timeout(task)} seconds, and was killed.')
+        else:
+            task.log_error('Crawler was killed, as another crawl in its process did not stop.')
+
+
+@dramatiq.actor(max_retries=0, time_limit=float('inf'), notify_shutdown=True)
+def crawl_many(task_ids):
+    """
+    Run the crawls of several tasks in a single Scrapy process (see
+    `process.host`), so that the crawls share its memory and reactor.
+
+    Each crawl is stopped when its task is revoked, and its task is finished
+    as soon as the crawl is done. The status of any crawls that are still
+    running when the message is interrupted is set by the `TaskStatusMiddleware`.
+
+    A revoked crawl that hasn't stopped within its stop timeout is killed,
+    along with the host. The host's other crawls are lost, so their tasks are
+    aborted as well.
+    """
+    tasks = models.CrawlerTask.objects.select_related('crawler').filter(pk__in=task_ids)
+    pending = {task.pk: task for task in tasks}
+
+    timeout = max((stop_timeout(task) for task in pending.values()), default=STOP_TIMEOUT)
+
+    revocations = RevocationListener(pending.values())
+    host = CrawlHost(max_jobs=len(pending))
+
+    # the times by which the revoked crawls must have stopped
+    deadlines = {}
+
+    for task_id in pending:
+        host.start(task_id)
 
     try:
-        while proc.exitcode is None:
-            task.refresh_from_db()
+        while pending:
+            for task in revocations.wait(.05):
+                revocations.discard(task)
+                host.request_stop(task.pk)
+                deadlines[task.pk] = monotonic() + stop_timeout(task)
+
+            for task_id in [task_id for task_id in pending if not host.running(task_id)]:
+                task = pending.pop(task_id)
+                deadlines.pop(task_id, None)
+                revocations.discard(task)
+                finish_crawl(task, host)
 
-            if task.revoked:
-                proc.terminate()
-                proc.join()
-                raise task.Abort
+            expired = [task_id for task_id, deadline in deadlines.items() if deadline <= monotonic()]
+            if expired:
+                kill_crawls(host, pending.values(), expired)
 
-            proc.join(.5)
+                # the remaining tasks are aborted by the `TaskStatusMiddleware`
+                pending.clear()
+                raise models.CrawlerTask.Abort
 
     except (Shutdown, TimeLimitExceeded) as exc:
         # Shutdown/TimeLimitExceeded are interrupts, not errors.
+        for task in pending.values():
+            task.log_error('Dramatiq process terminated.')
+        raise models.CrawlerTask.Abort from exc
+
+    finally:
+        revocations.close()
+
+        # the crawls are stopped together, so that they share the timeout
+        for task_id in pending:
+            host.request_stop(task_id)
+
+        for task_id, task in pending.items():
+            if host.running(task_id) and host.stop(task_id, timeout):
+                task.log_error(f'Crawler did not stop within {timeout} seconds, and was killed.')
+
+            elif host.error(task_id):
+                task.log_error(host.error(task_id))
+
+        host.close()
+
+
+@dramatiq.actor(max_retries=0, time_limit=float('inf'), notify_shutdown=True)
+def annotate(task_id):
+    task = models.AnnotationTask.objects.select_related('annotation').get(pk=task_id)
+    annotation = task.annotation
+
+    try:
+        task.total = annotation.search().count()
+        task.save(update_fields=['total'])
+
+        annotation.execute(progress=task.progress)
+
+    except (Shutdown, TimeLimitExceeded) as exc:
+        # Shutdown/TimeLimitExceeded are interrupts, not errors. Committed
+        # chunks are kept, so the annotation may be resumed.
         task.log_error('Dramatiq process terminated.')
         raise task.Abort from exc
 
-    except Exception as exc:
-        task.log_exception(exc)
-        raise
 
-    finally:
-        proc.terminate()
-        proc.join()
+@dramatiq.actor(max_retries=0, time_limit=float('inf'))
+def refresh_annotations(crawler_id):
+    """
+    Tokenize the crawler's new documents, and refresh its `auto_refresh`
+    annotations (see `Annotation.refresh`).
+    """
+    crawler = models.Crawler.objects.get(pk=crawler_id)
+    tokenizer = getattr(crawler, 'sentencetokenizer', None)
+    if tokenizer is None:
+        return
+
+    tokenizer.refresh()
 
-        if proc.exitcode != 0:
-            task.log_error(f'Crawler returned a non-zero exit code: {proc.exitcode}')
+    for annotation in crawler.annotation_set.filter(auto_refresh=True).select_related('task'):
+        try:
+            annotation.refresh()
+        except RuntimeError:
+            # sentences tokenized after a running annotation started are added by its next refresh
+            pass
@@ -0,0 +1,45 @@
+"""
+Entry points for processes that are spawned outside of the Django process.
+
+Spawned processes start with a fresh interpreter, so each entry point must
+`setup()` Django before importing any models.
+"""
+import os
+import sys
+
+import django
+
+
+def setup():
+    """
+    Configure Django in a newly spawned process.
+    """
+    sys.path.insert(0, os.environ['YURIKA_CONF'])
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+    django.setup()
+
+
+def tokenize(tokenizer_id, slice_id, slices, progress, report_every=100):
+    """
+    Tokenize one slice of a sliced scroll over the crawler's documents. The
+    number of scanned documents is periodically put on the `progress` queue.
+    """
+    setup()
+
+    from .models import SentenceTokenizer
+    tokenizer = SentenceTokenizer.objects.get(pk=tokenizer_id)
+
+    search = tokenizer.documents.search()
+    if slices > 1:
+        search = search.extra(slice={'id': slice_id, 'max': slices})
+
+    def documents():
+        count = 0
+        for count, document in enumerate(search.scan(), start=1):
+            yield document
+
+            if count % report_every == 0:
+                progress.put(report_every)
+        progress.put(count % report_every)
+
+    tokenizer.tokenize_many(documents())
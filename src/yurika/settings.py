@@ -42,6 +42,8 @@ env = environ.Env(
     DRAMATIQ_BROKER_URL=str,
     ELASTICSEARCH_URL=list,
     SENTRY_DSN=(str, ''),
+    CRAWLER_WARM_HOSTS=(bool, False),
+    CRAWLER_HOST_MAX_JOBS=(int, 20),
     STATIC_ROOT=(str, 'static-root'),
     MEDIA_ROOT=(str, 'media-root'),
 )
@@ -242,6 +244,15 @@ DRAMATIQ_BROKER = {
 }
 
 
+# Crawlers
+# Run crawls in warm processes that are reused between crawls, instead of
+# spawning a new process per crawl. A process is replaced after running
+# CRAWLER_HOST_MAX_JOBS crawls (0 for no limit).
+
+CRAWLER_WARM_HOSTS = env('CRAWLER_WARM_HOSTS')
+CRAWLER_HOST_MAX_JOBS = env('CRAWLER_HOST_MAX_JOBS')
+
+
 # Sentry/Raven
 # To support sentry logging, set the DSN in your .env file. You will need an
 # account on a sentry server and create a project to get a DSN.
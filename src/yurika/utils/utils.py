@@ -2,13 +2,14 @@ import os
 import sys
 from contextlib import contextmanager
 from io import StringIO
+from itertools import islice
 from logging import getLogger
 
 from django.conf import settings
 
 
 __all__ = [
-    'path', 'capture_output', 'log_level', 'humanize_timedelta',
+    'path', 'capture_output', 'log_level', 'humanize_timedelta', 'chunked',
 ]
 
 
@@ -75,3 +76,20 @@ def humanize_timedelta(td):
         for name, value in parts.items()
         if value > 0
     ])
+
+
+def chunked(iterable, size):
+    """
+    Lazily split an iterable into lists of (at most) `size` items.
+
+    ex::
+
+        >>> list(chunked(range(5), 2))
+        [[0, 1], [2, 3], [4]]
+
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
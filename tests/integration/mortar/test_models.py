@@ -1,13 +1,15 @@
 import logging
 from contextlib import contextmanager
+from unittest import mock
 
 from django.test import TestCase
 from django_dramatiq.test import DramatiqTestCase
 
-from yurika.mortar.models import Task
+from yurika.mortar import documents
+from yurika.mortar.models import Annotation, Crawler, Task
 from yurika.utils import log_level
 
-from .testapp import models
+from .testapp import models, tasks
 
 
 STATUS = Task.STATUS
@@ -79,6 +81,21 @@ class TaskTransitionTests(DramatiqTestCase):
         self.assertEqual(task.status, STATUS.done)
         self.assertTrue(task.flag)
 
+    def test_many(self):
+        first, second = models.Finish.objects.create(), models.Finish.objects.create()
+
+        message = tasks.finish_many.send(task_ids=[first.pk, second.pk])
+
+        self.broker.join(tasks.finish_many.queue_name)
+        self.worker.join()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(str(first.message_id), message.message_id)
+        self.assertEqual(str(second.message_id), message.message_id)
+        self.assertEqual(first.status, STATUS.aborted)
+        self.assertEqual(second.status, STATUS.done)
+
 
 class TaskChainTests(DramatiqTestCase):
 
@@ -161,3 +178,25 @@ class ErrorHandlingTests(TestCase):
         self.assertIn(", in test_log_exception\n", error.traceback)
         self.assertIn("    raise Exception('!!!')\n", error.traceback)
         self.assertIn("Exception: !!!\n", error.traceback)
+
+
+@mock.patch('yurika.mortar.tasks.refresh_annotations.send')
+class RefreshAnnotationsTests(TestCase):
+
+    def setUp(self):
+        with mock.patch.object(documents.Document, 'init'):
+            self.crawler = Crawler.objects.create(start_urls='http://localhost')
+        self.task = self.crawler.task
+        self.task.status = STATUS.running
+
+    def test_auto_refresh(self, send):
+        Annotation.objects.create(crawler=self.crawler, query='{}', auto_refresh=True)
+
+        self.task._abort()
+        send.assert_called_once_with(self.crawler.pk)
+
+    def test_no_auto_refresh(self, send):
+        Annotation.objects.create(crawler=self.crawler, query='{}')
+
+        self.task._finish()
+        send.assert_not_called()
@@ -16,3 +16,11 @@ def fail(task_id):
 @dramatiq.actor(max_retries=0)
 def abort(task_id):
     raise models.Task.Abort
+
+
+@dramatiq.actor(max_retries=0)
+def finish_many(task_ids):
+    # the first task is completed by the actor, and the rest by the middleware
+    task = models.Finish.objects.get(id=task_ids[0])
+    task._abort()
+    task.save()
@@ -1,8 +1,14 @@
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from yurika.accounts import models as accounts
+from yurika.mortar import documents
+from yurika.mortar import models as mortar
 
 
 class CrawlerViewSetTests(APITestCase):
@@ -31,3 +37,113 @@ class CrawlerViewSetTests(APITestCase):
         # There should be a single crawler visible to the user
         response = self.client.get(url)
         self.assertEqual(response.data['count'], 1)
+
+    def test_list_stats(self):
+        url = reverse('crawler-list')
+        self.client.login(username='test', password='test')
+
+        def create_crawler():
+            with mock.patch.object(documents.Document, 'init'):
+                crawler = mortar.Crawler.objects.create(start_urls='http://localhost')
+            mortar.CrawlerAccount.objects.create(crawler=crawler, account=self.user.account)
+            crawler.task.save_stats(pages=10)
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.data['results'][0]['task']['stats']['pages'], 10)
+            return len(queries)
+
+        create_crawler()
+        queries = list_queries()
+
+        # the stats are fetched along with the crawlers
+        create_crawler()
+        create_crawler()
+        self.assertEqual(list_queries(), queries)
+
+
+class AnnotationViewSetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = accounts.User.objects.create_user(
+            username='test',
+            password='test',
+        )
+        other = accounts.User.objects.create_user(
+            username='other',
+            password='other',
+        )
+
+        with mock.patch.object(documents.Document, 'init'):
+            cls.crawler = mortar.Crawler.objects.create(start_urls='http://localhost')
+            cls.other_crawler = mortar.Crawler.objects.create(start_urls='http://localhost')
+        mortar.CrawlerAccount.objects.create(crawler=cls.crawler, account=cls.user.account)
+        mortar.CrawlerAccount.objects.create(crawler=cls.other_crawler, account=other.account)
+
+    def setUp(self):
+        self.client.login(username='test', password='test')
+
+    def crawler_url(self, crawler):
+        return reverse('crawler-detail', kwargs={'uuid': crawler.uuid})
+
+    def test_create(self):
+        url = reverse('annotation-list')
+        data = {'crawler': self.crawler_url(self.crawler), 'query': '{"query": {"match": {"text": "test"}}}'}
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # The annotation is executed by a worker
+        annotation = mortar.Annotation.objects.get()
+        self.assertEqual(annotation.task.status, mortar.AnnotationTask.STATUS.enqueued)
+        self.assertEqual(response.data['task']['status'], mortar.AnnotationTask.STATUS.enqueued)
+
+    def test_create_invalid(self):
+        url = reverse('annotation-list')
+        data = {'crawler': self.crawler_url(self.other_crawler), 'query': '{"query": '}
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'crawler', 'query'})
+
+    def test_create_non_object(self):
+        url = reverse('annotation-list')
+
+        for query in ['[]', '1', '"query"']:
+            with self.subTest(query=query):
+                data = {'crawler': self.crawler_url(self.crawler), 'query': query}
+                response = self.client.post(url, data, format='json')
+
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(response.data['query'], ['Query must be a JSON object.'])
+
+
+class AnnotationRefreshTests(APITransactionTestCase):
+    # a transaction test case, as the task is only sent once it's committed
+
+    def setUp(self):
+        user = accounts.User.objects.create_user(
+            username='test',
+            password='test',
+        )
+        self.client.login(username='test', password='test')
+
+        with mock.patch.object(documents.Document, 'init'):
+            self.crawler = mortar.Crawler.objects.create(start_urls='http://localhost')
+        mortar.CrawlerAccount.objects.create(crawler=self.crawler, account=user.account)
+
+    def test_refresh(self):
+        annotation = mortar.Annotation.objects.create(crawler=self.crawler, query='{}')
+        annotation.start()
+        url = reverse('annotation-refresh', kwargs={'pk': annotation.pk})
+
+        # The annotation is still queued
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        mortar.AnnotationTask.objects.filter(annotation=annotation).update(status=mortar.Task.STATUS.done)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['task']['status'], mortar.AnnotationTask.STATUS.enqueued)
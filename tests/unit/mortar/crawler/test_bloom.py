@@ -0,0 +1,102 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from yurika.mortar.crawler.bloom import BloomFilter, ScalableBloomFilter
+
+
+class BloomFilterTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'test.bloom')
+
+    def test_add(self):
+        seen = BloomFilter(1000, 1e-3)
+
+        self.assertNotIn('a', seen)
+        self.assertFalse(seen.add('a'))
+        self.assertIn('a', seen)
+        self.assertTrue(seen.add('a'))
+
+    def test_no_false_negatives(self):
+        seen = BloomFilter(1000, 1e-3)
+        keys = [str(n) for n in range(1000)]
+        for key in keys:
+            seen.add(key)
+
+        self.assertTrue(all(key in seen for key in keys))
+
+    def test_error_rate(self):
+        seen = BloomFilter(1000, 1e-2)
+        for n in range(1000):
+            seen.add(str(n))
+
+        false_positives = sum(str(n) in seen for n in range(1000, 11000))
+        self.assertLess(false_positives, 200)
+
+    def test_persistence(self):
+        seen = BloomFilter(1000, 1e-3, path=self.path)
+        seen.add('a')
+        seen.close()
+
+        # parameters are read from the existing file
+        seen = BloomFilter(10, 1e-1, path=self.path)
+        self.addCleanup(seen.close)
+        self.assertIn('a', seen)
+        self.assertNotIn('b', seen)
+        self.assertEqual(seen.size, BloomFilter(1000, 1e-3).size)
+        self.assertEqual(seen.capacity, 1000)
+        self.assertEqual(seen.count, 1)
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'\0' * 64)
+
+        with self.assertRaises(ValueError):
+            BloomFilter(1000, path=self.path)
+
+
+class ScalableBloomFilterTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'test.bloom')
+
+    def test_growth(self):
+        seen = ScalableBloomFilter(10, 1e-6)
+        for n in range(150):
+            self.assertFalse(seen.add(str(n)))
+
+        # 10 + 20 + 40 + 80
+        self.assertEqual([bloom.capacity for bloom in seen.filters], [10, 20, 40, 80])
+        self.assertEqual(len(seen), 150)
+        self.assertTrue(all(str(n) in seen for n in range(150)))
+
+    def test_error_rate(self):
+        seen = ScalableBloomFilter(100, 1e-2)
+        for n in range(1000):
+            seen.add(str(n))
+
+        false_positives = sum(str(n) in seen for n in range(1000, 11000))
+        self.assertLess(false_positives, 200)
+
+    def test_persistence(self):
+        seen = ScalableBloomFilter(10, path=self.path)
+        for n in range(25):
+            seen.add(str(n))
+        seen.close()
+
+        seen = ScalableBloomFilter(10, path=self.path)
+        self.addCleanup(seen.close)
+        self.assertEqual(len(seen.filters), 2)
+        self.assertEqual(len(seen), 25)
+        self.assertIn('0', seen)
+        self.assertIn('24', seen)
+
+        # filling the last filter continues growth
+        for n in range(25, 40):
+            seen.add(str(n))
+        self.assertEqual(len(seen.filters), 3)
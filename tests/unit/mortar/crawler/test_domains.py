@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+from yurika.mortar.crawler.domains import DomainMatcher
+
+
+class DomainMatcherTestCase(TestCase):
+
+    def test_search(self):
+        matcher = DomainMatcher(['domain.org', '.sub.net', 'Upper.COM'])
+        test_cases = [
+            ('domain.org', 'domain.org'),
+            ('www.domain.org', 'domain.org'),
+            ('a.b.domain.org', 'domain.org'),
+            ('xdomain.org', None),
+            ('domain.org.net', None),
+            ('org', None),
+            ('sub.net', None),
+            ('www.sub.net', '.sub.net'),
+            ('upper.com', 'upper.com'),
+            ('', None),
+        ]
+
+        for host, expected in test_cases:
+            with self.subTest(host=host, expected=expected):
+                self.assertEqual(matcher.search(host), expected)
+
+    def test_len(self):
+        self.assertEqual(len(DomainMatcher(['a.org', '.b.org', 'a.org'])), 2)
+        self.assertEqual(len(DomainMatcher([])), 0)
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from scrapy.http import Request
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.test import get_crawler
+
+from yurika.mortar.crawler.dupefilters import BloomDupeFilter
+from yurika.mortar.crawler.spiders import WebCrawler
+
+
+class BloomDupeFilterTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+
+    def test_request_seen(self):
+        dupefilter = BloomDupeFilter()
+        self.addCleanup(dupefilter.close, 'finished')
+
+        self.assertFalse(dupefilter.request_seen(Request('http://domain.org/a')))
+        self.assertTrue(dupefilter.request_seen(Request('http://domain.org/a')))
+        self.assertFalse(dupefilter.request_seen(Request('http://domain.org/b')))
+
+    def test_growth(self):
+        dupefilter = BloomDupeFilter(capacity=10, error_rate=1e-6)
+        self.addCleanup(dupefilter.close, 'finished')
+
+        for n in range(100):
+            self.assertFalse(dupefilter.request_seen(Request(f'http://domain.org/{n}')))
+
+        self.assertGreater(len(dupefilter.fingerprints.filters), 1)
+        self.assertEqual(len(dupefilter.fingerprints), 100)
+        self.assertTrue(all(dupefilter.request_seen(Request(f'http://domain.org/{n}')) for n in range(100)))
+
+    def test_resume(self):
+        dupefilter = BloomDupeFilter(self.path, capacity=10)
+        for n in range(50):
+            dupefilter.request_seen(Request(f'http://domain.org/{n}'))
+        dupefilter.close('shutdown')
+
+        self.assertTrue(os.path.isdir(os.path.join(self.path, 'requests.bloom')))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'requests.seen')))
+
+        dupefilter = BloomDupeFilter(self.path, capacity=10)
+        self.addCleanup(dupefilter.close, 'finished')
+        self.assertEqual(len(dupefilter.fingerprints), 50)
+        self.assertTrue(dupefilter.request_seen(Request('http://domain.org/0')))
+        self.assertFalse(dupefilter.request_seen(Request('http://domain.org/50')))
+
+    def test_import_requests_seen(self):
+        with open(os.path.join(self.path, 'requests.seen'), 'w') as file:
+            file.write(request_fingerprint(Request('http://domain.org/a')) + os.linesep)
+
+        dupefilter = BloomDupeFilter(self.path)
+        self.addCleanup(dupefilter.close, 'finished')
+        self.assertTrue(dupefilter.request_seen(Request('http://domain.org/a')))
+        self.assertFalse(dupefilter.request_seen(Request('http://domain.org/b')))
+
+    def test_settings(self):
+        crawler = get_crawler(WebCrawler, {'DUPEFILTER_CAPACITY': 10, 'DUPEFILTER_ERROR_RATE': 0.01})
+        self.assertEqual(crawler.settings['DUPEFILTER_CLASS'], 'yurika.mortar.crawler.dupefilters.BloomDupeFilter')
+
+        dupefilter = BloomDupeFilter.from_settings(crawler.settings)
+        self.addCleanup(dupefilter.close, 'finished')
+        self.assertEqual(dupefilter.fingerprints.initial_capacity, 10)
+        self.assertEqual(dupefilter.fingerprints.error_rate, 0.01)
+
+        # the crawler config may override the default
+        crawler = get_crawler(WebCrawler, {'DUPEFILTER_CLASS': 'scrapy.dupefilters.RFPDupeFilter'})
+        self.assertEqual(crawler.settings['DUPEFILTER_CLASS'], 'scrapy.dupefilters.RFPDupeFilter')
@@ -0,0 +1,84 @@
+import logging
+from unittest import TestCase, mock
+
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from yurika.mortar.crawler import extensions
+from yurika.utils import log_level
+
+
+class TaskStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.crawler = get_crawler(settings_dict={'TASK_STATS_INTERVAL': 60})
+        self.crawler.engine = mock.Mock(**{'slot.scheduler': [None] * 5})
+        self.spider = self.crawler._create_spider(name='spider', task=mock.Mock())
+        self.stats = self.crawler.stats
+        self.stats.open_spider(self.spider)
+
+        # save synchronously, instead of from the reactor's threadpool
+        patcher = mock.patch.object(extensions.threads, 'deferToThread', defer.maybeDeferred)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.extension = extensions.TaskStats.from_crawler(self.crawler)
+        self.extension.spider_opened(self.spider)
+        self.addCleanup(self.extension.spider_closed, self.spider, 'finished')
+
+    def test_not_configured(self):
+        with self.assertRaises(NotConfigured):
+            extensions.TaskStats.from_crawler(get_crawler(settings_dict={'TASK_STATS_INTERVAL': 0}))
+
+    def test_snapshot(self):
+        self.stats.set_value('response_received_count', 20)
+        self.stats.set_value('downloader/response_bytes', 2000)
+        self.stats.set_value('item_scraped_count', 10)
+        self.stats.set_value('documents/flushed', 8)
+        self.stats.set_value('documents/flush_latency', .5)
+        self.stats.set_value('block/filtered', 3)
+        self.stats.set_value('request_distance_max', 2)
+
+        timestamp, previous = self.extension.previous
+        self.extension.previous = timestamp - 10, previous
+        self.extension.snapshot(self.spider)
+
+        snapshot = self.spider.task.save_stats.call_args[1]
+        rates = {name: snapshot.pop(name) for name in ['page_rate', 'byte_rate', 'item_rate']}
+        self.assertEqual(snapshot, {
+            'pages': 20, 'bytes': 2000, 'items': 10, 'indexed': 8, 'pending': 5,
+            'blocked': 3, 'max_distance': 2, 'flush_latency': .5,
+        })
+        self.assertAlmostEqual(rates['page_rate'], 2, places=2)
+        self.assertAlmostEqual(rates['byte_rate'], 200, places=0)
+        self.assertAlmostEqual(rates['item_rate'], 1, places=2)
+
+    def test_rates_since_previous_snapshot(self):
+        self.stats.set_value('response_received_count', 20)
+        self.extension.snapshot(self.spider)
+
+        timestamp, previous = self.extension.previous
+        self.extension.previous = timestamp - 10, previous
+        self.stats.set_value('response_received_count', 30)
+        self.extension.snapshot(self.spider)
+
+        snapshot = self.spider.task.save_stats.call_args[1]
+        self.assertEqual(snapshot['pages'], 30)
+        self.assertAlmostEqual(snapshot['page_rate'], 1, places=2)
+
+    def test_closed_snapshot(self):
+        self.extension.spider_closed(self.spider, 'finished')
+
+        self.assertFalse(self.extension.loop.running)
+        self.assertEqual(self.spider.task.save_stats.call_count, 1)
+
+    def test_failed_snapshot(self):
+        self.spider.task.save_stats.side_effect = Exception('!!!')
+
+        with log_level(extensions.logger, logging.CRITICAL):
+            d = self.extension.snapshot(self.spider)
+
+        # the failure is logged, and doesn't stop the snapshot loop
+        self.assertIsNone(d.result)
+        self.assertTrue(self.extension.loop.running)
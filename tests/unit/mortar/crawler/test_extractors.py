@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from yurika.mortar.crawler import extractors
+
+
+DOCUMENTS = {
+    'basic': """
+        <html>
+        <head><title>Title</title></head>
+        <body>
+            <h1>Heading</h1>
+            <p>Paragraph with <b>bold</b> and <i>italic</i> text.</p>
+        </body>
+        </html>
+    """,
+    'line breaks': "<p>one<br>two<br/>three<br></br>four</p><br>",
+    'scripts and styles': """
+        <head><style>body { color: red; }</style></head>
+        <body>
+            before<script>var a = '<p>not text</p>';</script>after
+            <style>p { margin: 0 }</style>tail
+            <noscript>no script</noscript>
+        </body>
+    """,
+    'comments': "<p>before<!-- comment -->after</p><!-- <p>hidden</p> -->end",
+    'inline whitespace': "<p><b>a</b>   <i>b</i>\t<i>c</i>  \n  <i>d</i></p>",
+    'preformatted': "<pre>  indented\n\n   <b>x</b>   <i>y</i></pre><textarea>   </textarea>",
+    'entities': "<p>caf&eacute; &amp; &lt;tag&gt; &#8212; &nbsp;&nbsp;nbsp&nbsp;</p>",
+    'unicode': "<title>日本語</title><p>Ünïcödé — 😀</p>",
+    'no title': "<p>text</p>",
+    'empty title': "<title></title><p>text</p>",
+    'multiple titles': "<title>first</title><title>second</title>",
+    'svg title': "<body><svg><title>svg</title></svg><p>text</p></body>",
+    'doctype': "<!DOCTYPE html><html><body>text</body></html>",
+    'processing instruction': "<p>before<?php echo 1; ?>after</p>",
+    'malformed': "<div><p>unclosed <b>bold <i>italic</div> trailing</b> text</p>",
+    'text outside html': "leading <html><body>inner</body></html> trailing",
+    'tables': "<table><tr><td>a</td><td>b</td></tr>\n<tr><td>c</td>\t<td>d</td></tr></table>",
+    'carriage returns': "<p>one\r\ntwo\rthree</p>\r\n<p>four</p>",
+    'whitespace only': "  \n\t ",
+    'empty': "",
+}
+
+
+class ExtractorParityTestCase(TestCase):
+
+    def test_parity(self):
+        for name, html in DOCUMENTS.items():
+            with self.subTest(document=name):
+                self.assertEqual(extractors.lxml_extractor(html), extractors.soup_extractor(html))
+
+    def test_parity_large_document(self):
+        paragraph = "<p>Some <a href='#'>linked</a> text.<br>More &amp; more<!-- c --> text</p>\n"
+        html = "<html><head><title>Large</title><script>x()</script></head><body>%s</body></html>" % (
+            ''.join('<div>\n%s<span> </span>%d</div>' % (paragraph, n) for n in range(1000))
+        )
+
+        self.assertEqual(extractors.lxml_extractor(html), extractors.soup_extractor(html))
+
+
+class LxmlExtractorTestCase(TestCase):
+
+    def test_output(self):
+        testcases = [
+            (DOCUMENTS['basic'], ('Title', 'Title\nHeading\nParagraph with bold and italic text.')),
+            (DOCUMENTS['line breaks'], ('', 'one\ntwo\nthree\nfour')),
+            (DOCUMENTS['scripts and styles'], ('', 'beforeafter\ntail\nno script')),
+            (DOCUMENTS['comments'], ('', 'beforeafterend')),
+            (DOCUMENTS['inline whitespace'], ('', 'a b c\nd')),
+            (DOCUMENTS['empty title'], (None, 'text')),
+            (DOCUMENTS['empty'], ('', '')),
+        ]
+
+        for html, expected in testcases:
+            with self.subTest(html=html, expected_output=expected):
+                self.assertEqual(extractors.lxml_extractor(html), expected)
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from yurika.mortar.crawler import fingerprints
+
+
+TEXT = """
+The quick brown fox jumps over the lazy dog. Pack my box with five dozen
+liquor jugs. How vexingly quick daft zebras jump. Sphinx of black quartz,
+judge my vow. The five boxing wizards jump quickly.
+"""
+
+
+def naive_simhash(text):
+    counts = [0] * 64
+    for feature in fingerprints.shingles(text):
+        value = int.from_bytes(fingerprints.hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+        for bit in range(64):
+            counts[bit] += 1 if value & (1 << bit) else -1
+    return '%016x' % sum(1 << bit for bit in range(64) if counts[bit] > 0)
+
+
+class ContentHashTestCase(TestCase):
+
+    def test_whitespace(self):
+        self.assertEqual(fingerprints.content_hash('a b\nc'), fingerprints.content_hash('  a\tb  c\n'))
+        self.assertNotEqual(fingerprints.content_hash('a b c'), fingerprints.content_hash('a b d'))
+
+
+class SimHashTestCase(TestCase):
+
+    def test_naive_equivalence(self):
+        for text in [TEXT, TEXT * 3, 'a b', 'one two three four', '']:
+            with self.subTest(text=text):
+                self.assertEqual(fingerprints.simhash(text), naive_simhash(text))
+
+    def test_near_duplicates(self):
+        similar = TEXT.replace('lazy dog', 'lazy cat')
+        different = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor."
+
+        self.assertEqual(fingerprints.distance(fingerprints.simhash(TEXT), fingerprints.simhash(TEXT)), 0)
+        self.assertLess(fingerprints.distance(fingerprints.simhash(TEXT), fingerprints.simhash(similar)), 16)
+        self.assertGreater(fingerprints.distance(fingerprints.simhash(TEXT), fingerprints.simhash(different)), 16)
+
+    def test_case_insensitive(self):
+        self.assertEqual(fingerprints.simhash(TEXT), fingerprints.simhash(TEXT.upper()))
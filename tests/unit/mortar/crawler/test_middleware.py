@@ -1,24 +1,30 @@
 from functools import partial, wraps
-from unittest import TestCase
+from unittest import TestCase, mock
 
+from scrapy import signals
+from scrapy.core.downloader import Slot
 from scrapy.http import Request, Response
 from scrapy.utils.test import get_crawler
 
 from yurika.mortar.crawler import middleware
 
 
-def spider_middleware(middleware_cls, settings=None, **spider_kwargs):
+def spider_middleware(middleware_cls, settings=None, open_spider=False, **spider_kwargs):
     """
     Create a spider and middleware and inject them into the test arguments.
+    If `open_spider`, the `spider_opened` signal is sent before the test.
     """
     spider_kwargs.setdefault('name', 'spider')
     crawler = get_crawler(settings_dict=settings)
-    spider = crawler._create_spider(**spider_kwargs)
+    # as in `Crawler.crawl`, the spider is created before the middleware
+    spider = crawler.spider = crawler._create_spider(**spider_kwargs)
     middleware = middleware_cls.from_crawler(crawler)
 
     def wrapper(test_method):
         @wraps(test_method)
         def wrapped(self):
+            if open_spider:
+                crawler.signals.send_catch_log(signal=signals.spider_opened, spider=spider)
             return test_method(self, spider=spider, middleware=middleware)
         return wrapped
     return wrapper
@@ -78,6 +84,27 @@ class BlockedDomainMiddlewareTestCase(TestCase):
             with self.subTest(request=request, should_block=should_block):
                 self.assertEqual(middleware.should_block(request, spider), should_block)
 
+    @spider_middleware(blocked_domains=['domain.org'])
+    def test_spider_closed(self, spider, middleware):
+        self.assertIsNotNone(middleware.host_regex)
+
+        spider.crawler.signals.send_catch_log(signal=signals.spider_closed, spider=spider, reason='finished')
+        self.assertIsNone(middleware.host_regex)
+        self.assertFalse(middleware.should_block(Request('http://domain.org/1'), spider))
+
+    @spider_middleware(blocked_domains=['domain.org'])
+    def test_block_suffix_not_substring(self, spider, middleware):
+        test_cases = [
+            (Request('http://xdomain.org/1'), False),
+            (Request('http://domain.org.other.net/2'), False),
+            (Request('http://DOMAIN.org/3'), True),
+            (Request('javascript:void(0)'), False),
+        ]
+
+        for request, should_block in test_cases:
+            with self.subTest(request=request, should_block=should_block):
+                self.assertEqual(middleware.should_block(request, spider), should_block)
+
     @spider_middleware()
     def test_no_blocked_domains(self, spider, middleware):
         test_cases = [
@@ -98,31 +125,57 @@ class BlockedDomainMiddlewareTestCase(TestCase):
             with self.subTest(request=request, should_block=should_block):
                 self.assertEqual(middleware.should_block(request, spider), should_block)
 
-    @spider_middleware(blocked_domains=['https://domain.org'])
-    def test_scheme_in_blocked_domains(self, spider, middleware):
-        with self.assertRaises(AssertionError) as exc_info:
-            middleware.get_host_regex(spider)
+    def create_middleware(self, blocked_domains):
+        crawler = get_crawler()
+        crawler.spider = crawler._create_spider(name='spider', blocked_domains=blocked_domains)
+        return middleware.BlockedDomainMiddleware.from_crawler(crawler)
+
+    def test_scheme_in_blocked_domains(self):
+        # invalid domains fail as the middleware is created, instead of in a signal handler
+        with self.assertRaises(ValueError) as exc_info:
+            self.create_middleware(['https://domain.org'])
 
         msg = "blocked_domains only accepts domains, not URLs."
         self.assertEqual(str(exc_info.exception), msg)
 
-    @spider_middleware(blocked_domains=['domain.org/path'])
-    def test_path_in_blocked_domains(self, spider, middleware):
-        with self.assertRaises(AssertionError) as exc_info:
-            middleware.get_host_regex(spider)
+    def test_path_in_blocked_domains(self):
+        with self.assertRaises(ValueError) as exc_info:
+            self.create_middleware(['domain.org/path'])
 
         msg = "blocked_domains only accepts domains, not URLs."
         self.assertEqual(str(exc_info.exception), msg)
 
-    @spider_middleware(blocked_domains=[None])
-    def test_empty_value_in_blocked_domains(self, spider, middleware):
-        with self.assertRaises(AssertionError) as exc_info:
-            middleware.get_host_regex(spider)
+    def test_empty_value_in_blocked_domains(self):
+        with self.assertRaises(ValueError) as exc_info:
+            self.create_middleware([None])
 
         msg = "blocked_domains only accepts domains, not empty values."
         self.assertEqual(str(exc_info.exception), msg)
 
 
+class OffsiteMiddlewareTestCase(TestCase):
+    spider_middleware = partial(spider_middleware, middleware.OffsiteMiddleware, open_spider=True)
+
+    @spider_middleware(allowed_domains=['domain.org', '.sub.net', 'http://url.com'])
+    def test_should_follow(self, spider, middleware):
+        test_cases = [
+            (Request('http://domain.org/1'), True),
+            (Request('http://www.domain.org/2'), True),
+            (Request('http://xdomain.org/3'), False),
+            (Request('http://sub.net/4'), False),
+            (Request('http://www.sub.net/5'), True),
+            (Request('http://url.com/6'), False),
+        ]
+
+        for request, should_follow in test_cases:
+            with self.subTest(request=request, should_follow=should_follow):
+                self.assertEqual(middleware.should_follow(request, spider), should_follow)
+
+    @spider_middleware()
+    def test_allow_all(self, spider, middleware):
+        self.assertTrue(middleware.should_follow(Request('http://domain.org/1'), spider))
+
+
 class DistanceMiddlewareTestCase(TestCase):
     spider_middleware = partial(spider_middleware, middleware.DistanceMiddleware)
 
@@ -207,11 +260,35 @@ class DistanceMiddlewareTestCase(TestCase):
         self.assertEqual(out[0].meta['distance'], 0)
         self.assertEqual(out[1].meta['distance'], 1)
 
+        out = list(middleware.process_spider_output(response, result[:1], spider))
+
+        # counts are aggregated until the spider is closed
         stats = spider.crawler.stats
-        self.assertEqual(stats.get_value('request_distance_count/0', spider=spider), 1)
+        self.assertIsNone(stats.get_value('request_distance_count/0', spider=spider))
+        self.assertEqual(stats.get_value('request_distance_max', spider=spider), 1)
+
+        spider.crawler.signals.send_catch_log(signal=signals.spider_closed, spider=spider, reason='finished')
+        self.assertEqual(stats.get_value('request_distance_count/0', spider=spider), 2)
         self.assertEqual(stats.get_value('request_distance_count/1', spider=spider), 1)
         self.assertEqual(stats.get_value('request_distance_max', spider=spider), 1)
 
+    @spider_middleware(settings={'DISTANCE_REGISTERED_DOMAIN': True})
+    def test_registered_domain(self, spider, middleware):
+        test_cases = [
+            ('http://a.domain.org', 'http://b.domain.org', False),
+            ('http://domain.org', 'http://www.domain.org', False),
+            ('http://a.domain.co.uk', 'http://b.domain.co.uk', False),
+            ('http://domain.co.uk', 'http://other.co.uk', True),
+            ('http://a.github.io', 'http://b.github.io', True),
+            ('http://127.0.0.1', 'http://127.0.0.2', True),
+            ('http://domain.org', 'http://domain.com', True),
+        ]
+
+        for response_url, request_url, different in test_cases:
+            with self.subTest(response=response_url, request=request_url):
+                response, request = Response(response_url), Request(request_url)
+                self.assertEqual(middleware.different_domains(response, request), different)
+
     @spider_middleware(settings={'DISTNACE_LIMIT': 5})
     def test_non_request_ignored(self, spider, middleware):
         request = Request('http://domain.org')
@@ -221,3 +298,106 @@ class DistanceMiddlewareTestCase(TestCase):
         out = list(middleware.process_spider_output(response, result, spider))
         self.assertEqual(out, result)
         self.assertEqual(out[1].meta['distance'], 0)
+
+    @spider_middleware(settings={'DISTANCE_PRIORITY': 1000})
+    def test_distance_priority(self, spider, middleware):
+        request = Request('http://domain.org')
+        response = Response('http://domain.org', request=request)
+        result = [Request('http://domain.org/a', priority=-1), Request('http://domain.com/b', priority=-1)]
+
+        out = list(middleware.process_spider_output(response, result, spider))
+        self.assertEqual([r.priority for r in out], [-1, -1001])
+
+
+class DomainConcurrencyMiddlewareTestCase(TestCase):
+    settings = {
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 4,
+        'ADAPTIVE_CONCURRENCY_MIN': 1,
+        'ADAPTIVE_CONCURRENCY_MAX': 6,
+        'ADAPTIVE_CONCURRENCY_TARGET_LATENCY': 1.0,
+    }
+    spider_middleware = partial(spider_middleware, middleware.DomainConcurrencyMiddleware, settings=settings)
+
+    def setUp(self):
+        self.slot = Slot(concurrency=4, delay=0, randomize_delay=False)
+
+    def download(self, middleware, spider, latency=0.1, status=200, url='http://a.domain.org/'):
+        middleware.crawler.engine = mock.Mock(**{'downloader.slots': {'domain.org': self.slot}})
+        request = Request(url)
+        middleware.process_request(request, spider)
+        request.meta['download_latency'] = latency
+        return middleware.process_response(request, Response(url, status=status, body=b'body'), spider)
+
+    @spider_middleware()
+    def test_download_slot(self, spider, middleware):
+        request = Request('http://a.domain.org/')
+        middleware.process_request(request, spider)
+        self.assertEqual(request.meta['download_slot'], 'domain.org')
+
+    @spider_middleware()
+    def test_additive_increase(self, spider, middleware):
+        for concurrency in [5, 6, 6]:
+            self.download(middleware, spider, latency=0.5)
+            self.assertEqual(self.slot.concurrency, concurrency)
+
+    @spider_middleware()
+    def test_slow_decrease(self, spider, middleware):
+        for concurrency in [3, 2, 1, 1]:
+            self.download(middleware, spider, latency=5)
+            self.assertEqual(self.slot.concurrency, concurrency)
+
+    @spider_middleware()
+    def test_error_halves(self, spider, middleware):
+        self.download(middleware, spider, status=503)
+        self.assertEqual(self.slot.concurrency, 2)
+
+        middleware.process_exception(Request('http://domain.org/'), Exception(), spider)
+        self.assertEqual(self.slot.concurrency, 1)
+
+    @spider_middleware()
+    def test_recreated_slot(self, spider, middleware):
+        self.download(middleware, spider)
+        self.assertEqual(self.slot.concurrency, 5)
+
+        # idle slots are recreated by the downloader with the default concurrency
+        self.slot = Slot(concurrency=4, delay=0, randomize_delay=False)
+        self.download(middleware, spider)
+        self.assertEqual(self.slot.concurrency, 6)
+
+    @spider_middleware(settings=dict(settings, ADAPTIVE_CONCURRENCY_ENABLED=False))
+    def test_disabled(self, spider, middleware):
+        self.download(middleware, spider, status=503)
+        self.assertEqual(self.slot.concurrency, 4)
+
+    @spider_middleware()
+    def test_stats(self, spider, middleware):
+        stats = middleware.stats
+        self.download(middleware, spider, latency=0.5)
+        self.download(middleware, spider, latency=1.5, status=500)
+
+        # the domain stats are only added once the spider is closed
+        self.assertIsNone(stats.get_value('domain/domain.org/response_count'))
+        middleware.spider_closed(spider)
+
+        self.assertEqual(stats.get_value('domain/count'), 1)
+        self.assertEqual(stats.get_value('domain/domain.org/response_count'), 2)
+        self.assertEqual(stats.get_value('domain/domain.org/response_bytes'), 8)
+        self.assertEqual(stats.get_value('domain/domain.org/error_count'), 1)
+        self.assertEqual(stats.get_value('domain/domain.org/concurrency'), 2)
+        self.assertAlmostEqual(stats.get_value('domain/domain.org/latency'), 0.8)
+
+    @spider_middleware(settings=dict(settings, DOMAIN_STATS_TOP=2))
+    def test_stats_top(self, spider, middleware):
+        stats = middleware.stats
+        for count, domain in enumerate(['a.org', 'b.org', 'c.org'], start=1):
+            for _ in range(count):
+                self.download(middleware, spider, url=f'http://{domain}/')
+        middleware.process_exception(Request('http://d.org/'), Exception(), spider)
+        middleware.spider_closed(spider)
+
+        # only the busiest domains are added to the stats
+        self.assertEqual(stats.get_value('domain/count'), 4)
+        self.assertEqual(stats.get_value('domain/c.org/response_count'), 3)
+        self.assertEqual(stats.get_value('domain/b.org/response_count'), 2)
+        self.assertIsNone(stats.get_value('domain/a.org/response_count'))
+        self.assertIsNone(stats.get_value('domain/d.org/error_count'))
@@ -0,0 +1,312 @@
+import logging
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from yurika.mortar import documents
+from yurika.mortar.crawler import extractors, fingerprints, pipelines
+from yurika.mortar.crawler.items import DocumentItem
+from yurika.utils import log_level
+
+
+class RecordingPipeline(pipelines.DocumentPipeline):
+    """
+    Records flushed batches instead of indexing them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    def index(self, docs, spider):
+        self.batches.append(docs)
+
+
+class FailingPipeline(pipelines.DocumentPipeline):
+
+    def index(self, docs, spider):
+        raise Exception('!!!')
+
+
+class DeferredPipeline(RecordingPipeline):
+    """
+    Dispatches writes to deferreds that are manually fired by the test.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatched = []
+
+    def dispatch(self, docs, spider):
+        dfd = defer.Deferred()
+        dfd.addCallback(lambda _: self.write(docs, spider))
+        self.dispatched.append(dfd)
+        return dfd
+
+
+def fired(dfd):
+    results = []
+    dfd.addBoth(results.append)
+    return bool(results)
+
+
+def item(url, html='', text=None):
+    return DocumentItem(document=documents.Document(url=url, html=html, text=text))
+
+
+def fail_extractor(html):
+    raise Exception('!!!')
+
+
+class DocumentPipelineTestCase(TestCase):
+
+    def pipeline(self, pipeline_cls=RecordingPipeline, **settings):
+        settings.setdefault('DOCUMENT_FLUSH_INTERVAL', 0)
+        settings.setdefault('DOCUMENT_WRITER', 'sync')
+        crawler = get_crawler(settings_dict=settings)
+        spider = crawler._create_spider(name='spider')
+        return pipeline_cls.from_crawler(crawler), spider
+
+    def test_buffer_until_size(self):
+        pipeline, spider = self.pipeline(DOCUMENT_BUFFER_SIZE=2)
+        pipeline.open_spider(spider)
+
+        pipeline.process_item(item('http://domain.org/1'), spider)
+        self.assertEqual(pipeline.batches, [])
+
+        pipeline.process_item(item('http://domain.org/2'), spider)
+        self.assertEqual(len(pipeline.batches), 1)
+        self.assertEqual([d.url for d in pipeline.batches[0]], ['http://domain.org/1', 'http://domain.org/2'])
+        self.assertEqual(pipeline.buffer, [])
+
+    def test_drain_on_close(self):
+        pipeline, spider = self.pipeline(DOCUMENT_BUFFER_SIZE=10)
+        pipeline.open_spider(spider)
+
+        pipeline.process_item(item('http://domain.org/1'), spider)
+        pipeline.close_spider(spider)
+
+        self.assertEqual(len(pipeline.batches), 1)
+        self.assertEqual(pipeline.buffer, [])
+
+    def test_empty_flush(self):
+        pipeline, spider = self.pipeline()
+        pipeline.open_spider(spider)
+        pipeline.close_spider(spider)
+
+        self.assertEqual(pipeline.batches, [])
+
+    def test_non_document_item_ignored(self):
+        pipeline, spider = self.pipeline(DOCUMENT_BUFFER_SIZE=1)
+
+        self.assertEqual(pipeline.process_item({'a': 1}, spider), {'a': 1})
+        self.assertEqual(pipeline.batches, [])
+
+    def test_flush_interval(self):
+        pipeline, spider = self.pipeline(DOCUMENT_FLUSH_INTERVAL=60)
+        pipeline.open_spider(spider)
+
+        self.assertTrue(pipeline.loop.running)
+        pipeline.close_spider(spider)
+        self.assertFalse(pipeline.loop.running)
+
+    def test_stats(self):
+        pipeline, spider = self.pipeline(DOCUMENT_BUFFER_SIZE=2)
+        stats = spider.crawler.stats
+
+        for n in range(5):
+            pipeline.process_item(item(f'http://domain.org/{n}'), spider)
+        pipeline.close_spider(spider)
+
+        self.assertEqual(stats.get_value('documents/flushed', spider=spider), 5)
+        self.assertEqual(stats.get_value('documents/flush_count', spider=spider), 3)
+        self.assertIsNotNone(stats.get_value('documents/flush_latency', spider=spider))
+        self.assertIsNotNone(stats.get_value('documents/flush_latency_max', spider=spider))
+
+    def test_flush_error(self):
+        pipeline, spider = self.pipeline(FailingPipeline, DOCUMENT_BUFFER_SIZE=1)
+        errors = []
+        spider.exception_logger = errors.append
+        stats = spider.crawler.stats
+
+        with log_level(pipelines.logger, logging.CRITICAL):
+            pipeline.process_item(item('http://domain.org/1'), spider)
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(str(errors[0]), '!!!')
+        self.assertEqual(stats.get_value('documents/flush_errors', spider=spider), 1)
+        self.assertIsNone(stats.get_value('documents/flushed', spider=spider))
+
+    def test_no_task(self):
+        pipeline, spider = self.pipeline(pipelines.DocumentPipeline, DOCUMENT_BUFFER_SIZE=1)
+        errors = []
+        spider.exception_logger = errors.append
+        pipeline.open_spider(spider)
+
+        with log_level(pipelines.logger, logging.CRITICAL):
+            pipeline.process_item(item('http://domain.org/1'), spider)
+        pipeline.close_spider(spider)
+
+        self.assertEqual(str(errors[0]), 'Spider has no task to index documents for.')
+
+    def test_unknown_writer(self):
+        with self.assertRaises(ValueError):
+            self.pipeline(DOCUMENT_WRITER='unknown')
+
+
+class ThreadedDocumentPipelineTestCase(TestCase):
+
+    def pipeline(self, **settings):
+        settings.setdefault('DOCUMENT_FLUSH_INTERVAL', 0)
+        settings.setdefault('DOCUMENT_WRITER', 'thread')
+        crawler = get_crawler(settings_dict=settings)
+        spider = crawler._create_spider(name='spider')
+        pipeline = DeferredPipeline.from_crawler(crawler)
+        pipeline.open_spider(spider)
+        self.addCleanup(lambda: pipeline.threadpool.joined or pipeline.threadpool.stop())
+        return pipeline, spider
+
+    def test_backpressure(self):
+        pipeline, spider = self.pipeline(DOCUMENT_BUFFER_SIZE=1, DOCUMENT_WRITER_MAX_PENDING=1)
+
+        # first write is within capacity
+        first = pipeline.process_item(item('http://domain.org/1'), spider)
+        self.assertTrue(fired(first))
+
+        # second write exceeds capacity, and the item is held
+        second = pipeline.process_item(item('http://domain.org/2'), spider)
+        self.assertFalse(fired(second))
+        self.assertEqual(len(pipeline.pending), 2)
+
+        # completing a write releases the held item
+        pipeline.dispatched[0].callback(None)
+        self.assertTrue(fired(second))
+        self.assertEqual(len(pipeline.pending), 1)
+        self.assertEqual(len(pipeline.batches), 1)
+
+    def test_close_waits_for_writes(self):
+        pipeline, spider = self.pipeline(DOCUMENT_BUFFER_SIZE=10)
+
+        pipeline.process_item(item('http://domain.org/1'), spider)
+        closed = pipeline.close_spider(spider)
+        self.assertFalse(fired(closed))
+
+        pipeline.dispatched[0].callback(None)
+        self.assertTrue(fired(closed))
+        self.assertEqual(len(pipeline.batches), 1)
+
+        stats = spider.crawler.stats
+        self.assertEqual(stats.get_value('documents/flushed', spider=spider), 1)
+
+
+class TextExtractionPipelineTestCase(TestCase):
+    html = '<title>Title</title><p>text</p>'
+
+    def pipeline(self, **settings):
+        crawler = get_crawler(settings_dict=settings)
+        spider = crawler._create_spider(name='spider')
+        pipeline = pipelines.TextExtractionPipeline.from_crawler(crawler)
+        pipeline.open_spider(spider)
+        self.addCleanup(pipeline.close_spider, spider)
+        return pipeline, spider
+
+    def wait(self, dfd):
+        # pool results are delivered from another thread
+        done = threading.Event()
+        results = []
+        dfd.addBoth(lambda result: results.append(result) or done.set())
+        self.assertTrue(done.wait(30))
+        return results[0]
+
+    def test_extract(self):
+        pipeline, spider = self.pipeline()
+        self.assertIsNone(pipeline.pool)
+
+        result = pipeline.process_item(item('http://domain.org/1', self.html), spider)
+        self.assertEqual(result['document'].title, 'Title')
+        self.assertEqual(result['document'].text, 'Titletext')
+
+    def test_extractor_setting(self):
+        pipeline, spider = self.pipeline(TEXT_EXTRACTOR='yurika.mortar.crawler.extractors.soup_extractor')
+        self.assertIs(pipeline.extractor, extractors.soup_extractor)
+
+    def test_non_document_item_ignored(self):
+        pipeline, spider = self.pipeline()
+        self.assertEqual(pipeline.process_item({'a': 1}, spider), {'a': 1})
+
+    @mock.patch.object(pipelines.reactor, 'callFromThread', lambda f, *args: f(*args))
+    def test_process_pool(self):
+        pipeline, spider = self.pipeline(TEXT_EXTRACTOR_PROCESSES=1)
+        self.assertIsNotNone(pipeline.pool)
+
+        result = self.wait(pipeline.process_item(item('http://domain.org/1', self.html), spider))
+        self.assertEqual(result['document'].title, 'Title')
+        self.assertEqual(result['document'].text, 'Titletext')
+
+    @mock.patch.object(pipelines.reactor, 'callFromThread', lambda f, *args: f(*args))
+    def test_process_pool_error(self):
+        pipeline, spider = self.pipeline(
+            TEXT_EXTRACTOR='tests.unit.mortar.crawler.test_pipelines.fail_extractor',
+            TEXT_EXTRACTOR_PROCESSES=1,
+        )
+
+        result = self.wait(pipeline.process_item(item('http://domain.org/1', self.html), spider))
+        self.assertIsInstance(result, Failure)
+        self.assertEqual(str(result.value), '!!!')
+
+
+class DedupePipelineTestCase(TestCase):
+
+    def pipeline(self, **settings):
+        crawler = get_crawler(settings_dict=settings)
+        spider = crawler._create_spider(name='spider')
+        pipeline = pipelines.DedupePipeline.from_crawler(crawler)
+        pipeline.open_spider(spider)
+        return pipeline, spider
+
+    def test_drop_duplicates(self):
+        pipeline, spider = self.pipeline()
+        self.addCleanup(pipeline.close_spider, spider)
+
+        first = pipeline.process_item(item('http://domain.org/', text='some text'), spider)
+        self.assertEqual(first['document'].content_hash, fingerprints.content_hash('some text'))
+        self.assertEqual(first['document'].simhash, fingerprints.simhash('some text'))
+
+        with self.assertRaises(DropItem):
+            pipeline.process_item(item('http://www.domain.org/?utm_source=x', text='some  text'), spider)
+
+        pipeline.process_item(item('http://domain.org/other', text='other text'), spider)
+        self.assertEqual(spider.crawler.stats.get_value('documents/duplicates', spider=spider), 1)
+
+    def test_empty_text(self):
+        pipeline, spider = self.pipeline()
+        self.addCleanup(pipeline.close_spider, spider)
+
+        pipeline.process_item(item('http://domain.org/1', text=''), spider)
+        result = pipeline.process_item(item('http://domain.org/2', text=''), spider)
+        self.assertNotIn('content_hash', result['document'])
+
+    def test_persistence(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        pipeline, spider = self.pipeline(JOBDIR=tmp.name)
+        pipeline.process_item(item('http://domain.org/1', text='some text'), spider)
+        pipeline.close_spider(spider)
+        self.assertTrue(os.path.exists(os.path.join(tmp.name, 'documents.bloom')))
+
+        # resumed crawl
+        pipeline, spider = self.pipeline(JOBDIR=tmp.name)
+        self.addCleanup(pipeline.close_spider, spider)
+        with self.assertRaises(DropItem):
+            pipeline.process_item(item('http://domain.org/2', text='some text'), spider)
+
+    def test_disabled(self):
+        with self.assertRaises(NotConfigured):
+            self.pipeline(DEDUPE_ENABLED=False)
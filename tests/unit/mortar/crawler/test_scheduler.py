@@ -0,0 +1,232 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from queuelib import PriorityQueue
+from queuelib.queue import FifoMemoryQueue
+from scrapy.core.downloader import Slot
+from scrapy.core.scheduler import Scheduler
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from yurika.mortar.crawler.scheduler import (
+    DomainPriorityQueue, DomainScheduler, FifoFileQueue, request_domain,
+)
+
+
+def request(url, priority=0):
+    request = Request(url, priority=priority)
+    request_domain(request)
+    return request
+
+
+class RequestDomainTestCase(TestCase):
+
+    def test_registered_domain(self):
+        test_cases = [
+            ('http://domain.org/', 'domain.org'),
+            ('http://a.b.domain.co.uk/', 'domain.co.uk'),
+            ('http://127.0.0.1:8000/', '127.0.0.1'),
+        ]
+
+        for url, expected in test_cases:
+            with self.subTest(url=url):
+                self.assertEqual(request_domain(Request(url)), expected)
+
+    def test_existing_slot(self):
+        self.assertEqual(request_domain(Request('http://domain.org', meta={'download_slot': 'slot'})), 'slot')
+
+
+class FifoFileQueueTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'p0')
+
+    def test_fifo(self):
+        queue = FifoFileQueue(self.path)
+        for obj in ['a', {'b': b'bytes'}, 3]:
+            queue.push(obj)
+
+        self.assertEqual(len(queue), 3)
+        self.assertEqual([queue.pop(), queue.pop(), queue.pop()], ['a', {'b': b'bytes'}, 3])
+        self.assertIsNone(queue.pop())
+        self.assertEqual(len(queue), 0)
+
+    def test_reopen(self):
+        queue = FifoFileQueue(self.path)
+        for obj in range(3):
+            queue.push(obj)
+        self.assertEqual(queue.pop(), 0)
+        queue.close()
+
+        queue = FifoFileQueue(self.path)
+        self.assertEqual(len(queue), 2)
+        queue.push(3)
+        self.assertEqual([queue.pop(), queue.pop(), queue.pop()], [1, 2, 3])
+
+    def test_drained(self):
+        queue = FifoFileQueue(self.path)
+        queue.push('a' * 1000)
+        queue.pop()
+
+        # the file is truncated to its header
+        self.assertEqual(os.path.getsize(self.path), FifoFileQueue.HEADER.size)
+
+        queue.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unserializable(self):
+        queue = FifoFileQueue(self.path)
+        with self.assertRaises(ValueError):
+            queue.push(object())
+        self.assertEqual(len(queue), 0)
+
+
+class DomainPriorityQueueTestCase(TestCase):
+
+    def queue(self, ready=None):
+        return DomainPriorityQueue(PriorityQueue, lambda key: FifoMemoryQueue(), ready=ready)
+
+    def test_round_robin(self):
+        queue = self.queue()
+        for url in ['http://a.org/1', 'http://a.org/2', 'http://a.org/3', 'http://b.org/1', 'http://c.org/1']:
+            queue.push(request(url))
+
+        self.assertEqual(len(queue), 5)
+        urls = [queue.pop().url for _ in range(5)]
+        self.assertEqual(urls, [
+            'http://a.org/1', 'http://b.org/1', 'http://c.org/1', 'http://a.org/2', 'http://a.org/3',
+        ])
+        self.assertIsNone(queue.pop())
+        self.assertEqual(len(queue), 0)
+
+    def test_priority_within_domain(self):
+        queue = self.queue()
+        queue.push(request('http://a.org/low'), 1)
+        queue.push(request('http://a.org/high'), -1)
+
+        self.assertEqual(queue.pop().url, 'http://a.org/high')
+        self.assertEqual(queue.pop().url, 'http://a.org/low')
+
+    def test_priority_across_domains(self):
+        queue = self.queue()
+        queue.push(request('http://a.org/far'), 1)
+        queue.push(request('http://b.org/near'), 0)
+        queue.push(request('http://c.org/near'), 0)
+        queue.push(request('http://a.org/near'), 0)
+
+        urls = [queue.pop().url for _ in range(4)]
+        self.assertEqual(urls, ['http://b.org/near', 'http://c.org/near', 'http://a.org/near', 'http://a.org/far'])
+
+    def test_lower_priority_when_unready(self):
+        ready = {'a.org': False, 'b.org': True}
+        queue = self.queue(ready=ready.get)
+        queue.push(request('http://a.org/near'), 0)
+        queue.push(request('http://b.org/far'), 1)
+
+        self.assertEqual(queue.pop().url, 'http://b.org/far')
+        self.assertIsNone(queue.pop())
+
+    def test_skip_unready(self):
+        ready = {'a.org': False, 'b.org': True}
+        queue = self.queue(ready=ready.get)
+        queue.push(request('http://a.org/1'))
+        queue.push(request('http://b.org/1'))
+
+        self.assertEqual(queue.pop().url, 'http://b.org/1')
+        self.assertIsNone(queue.pop())
+
+        ready['a.org'] = True
+        self.assertEqual(queue.pop().url, 'http://a.org/1')
+
+    def test_close(self):
+        queue = self.queue()
+        queue.push(request('http://a.org/1'), 0)
+        queue.push(request('http://a.org/2'), 1)
+        queue.push(request('http://b.org/1'), 0)
+
+        self.assertEqual(queue.close(), [['a.org', [0, 1]], ['b.org', [0]]])
+
+
+class DomainSchedulerTestCase(TestCase):
+    dqclass = 'yurika.mortar.crawler.scheduler.FifoFileQueue'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.jobdir = tmp.name
+        self.slots = {}
+
+    def scheduler(self, **settings):
+        crawler = get_crawler(settings_dict=settings)
+        crawler.engine = mock.Mock(**{'downloader.slots': self.slots})
+        spider = crawler._create_spider(name='spider')
+
+        scheduler = DomainScheduler.from_crawler(crawler)
+        scheduler.open(spider)
+        return scheduler
+
+    def test_saturated_domains_skipped(self):
+        scheduler = self.scheduler(SCHEDULER_MEMORY_QUEUE='scrapy.squeues.FifoMemoryQueue')
+        for url in ['http://slow.org/1', 'http://slow.org/2', 'http://fast.org/1', 'http://fast.org/2']:
+            scheduler.enqueue_request(Request(url))
+
+        self.slots['slow.org'] = Slot(concurrency=1, delay=0, randomize_delay=False)
+        self.slots['slow.org'].active.add(Request('http://slow.org/0'))
+
+        self.assertEqual(scheduler.next_request().url, 'http://fast.org/1')
+        self.assertEqual(scheduler.next_request().url, 'http://fast.org/2')
+        self.assertIsNone(scheduler.next_request())
+        self.assertTrue(scheduler.has_pending_requests())
+
+        self.slots['slow.org'].active.clear()
+        self.assertEqual(scheduler.next_request().url, 'http://slow.org/1')
+
+    def test_resume(self):
+        scheduler = self.scheduler(JOBDIR=self.jobdir, SCHEDULER_DISK_QUEUE=self.dqclass)
+        for url in ['http://a.org/1', 'http://a.org/2', 'http://b.org/1', 'http:///nohost']:
+            scheduler.enqueue_request(Request(url))
+        scheduler.close('shutdown')
+
+        scheduler = self.scheduler(JOBDIR=self.jobdir, SCHEDULER_DISK_QUEUE=self.dqclass)
+        self.assertEqual(len(scheduler), 4)
+
+        urls = [scheduler.next_request().url for _ in range(4)]
+        self.assertEqual(urls, ['http://a.org/1', 'http://b.org/1', 'http:///nohost', 'http://a.org/2'])
+        scheduler.close('finished')
+
+        # drained domain queues are removed
+        self.assertEqual(sorted(os.listdir(os.path.join(self.jobdir, 'requests.queue'))), ['active.json'])
+
+    def test_priority(self):
+        scheduler = self.scheduler(JOBDIR=self.jobdir, SCHEDULER_DISK_QUEUE=self.dqclass)
+        self.addCleanup(scheduler.close, 'finished')
+        scheduler.enqueue_request(Request('http://a.org/far', priority=-1000))
+        scheduler.enqueue_request(Request('http://b.org/deep', priority=-2))
+        scheduler.enqueue_request(Request('http://c.org/near', priority=-1))
+
+        urls = [scheduler.next_request().url for _ in range(3)]
+        self.assertEqual(urls, ['http://c.org/near', 'http://b.org/deep', 'http://a.org/far'])
+
+    def test_resume_default_scheduler(self):
+        # jobs started with scrapy's scheduler saved a list of priorities
+        crawler = get_crawler(settings_dict={'JOBDIR': self.jobdir})
+        crawler.engine = mock.Mock(**{'downloader.slots': self.slots})
+        spider = crawler._create_spider(name='spider')
+
+        scheduler = Scheduler.from_crawler(crawler)
+        scheduler.open(spider)
+        scheduler.enqueue_request(Request('http://a.org/1'))
+        scheduler.close('shutdown')
+
+        with open(os.path.join(self.jobdir, 'requests.queue', 'active.json')) as file:
+            self.assertEqual(json.load(file), [0])
+
+        scheduler = self.scheduler(JOBDIR=self.jobdir, SCHEDULER_DISK_QUEUE=self.dqclass)
+        self.addCleanup(scheduler.close, 'finished')
+        scheduler.enqueue_request(Request('http://b.org/1'))
+        self.assertEqual(scheduler.next_request().url, 'http://a.org/1')
+        self.assertEqual(scheduler.next_request().url, 'http://b.org/1')
@@ -0,0 +1,37 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from yurika.mortar.blobs import BlobStore
+
+
+class BlobStoreTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = BlobStore(os.path.join(tmp.name, 'blobs'))
+
+    def test_put_get(self):
+        digest = self.store.put('<p>Ünïcödé</p>')
+
+        self.assertTrue(self.store.exists(digest))
+        self.assertEqual(self.store.get(digest), '<p>Ünïcödé</p>')
+
+    def test_content_addressed(self):
+        self.assertEqual(self.store.put('a'), self.store.put('a'))
+        self.assertNotEqual(self.store.put('a'), self.store.put('b'))
+
+    def test_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            self.store.get('0' * 40)
+
+    def test_clear(self):
+        digest = self.store.put('a')
+        self.store.clear()
+
+        self.assertFalse(self.store.exists(digest))
+        self.assertFalse(os.path.exists(self.store.root))
+
+        # clearing an empty store is a no-op
+        self.store.clear()
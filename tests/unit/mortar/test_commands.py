@@ -0,0 +1,13 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class AnnotationCommandTests(TestCase):
+
+    def test_info(self):
+        # subcommand handlers must not shadow `BaseCommand` methods (e.g., `execute`)
+        stdout = StringIO()
+        call_command('annotation', 'info', stdout=stdout)
+        self.assertIn('Annotations: 0', stdout.getvalue())
@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from yurika.mortar import documents
+
+
+class HTMLDocumentTestCase(TestCase):
+
+    def test_html_mappings(self):
+        testcases = [
+            (documents.Document, {'type': 'text'}),
+            (documents.UnindexedHTMLDocument, {'type': 'text', 'index': False}),
+            (documents.CompressedHTMLDocument, {'type': 'binary'}),
+            (documents.BlobHTMLDocument, {'type': 'keyword', 'index': False}),
+        ]
+
+        for document_cls, expected in testcases:
+            with self.subTest(document=document_cls.__name__):
+                mapping = document_cls._index.to_dict()['mappings']['doc']['properties']
+                self.assertEqual(mapping['html'], expected)
+                self.assertEqual(mapping['text'], {'type': 'text'})
+
+    def test_compressed_roundtrip(self):
+        doc = documents.CompressedHTMLDocument(html='<p>Ünïcödé</p>' * 100)
+        doc.meta.index = 'index'
+
+        source = doc.to_dict()
+        self.assertNotIn('Ünïcödé', source['html'])
+        self.assertLess(len(source['html']), len('<p>Ünïcödé</p>' * 100))
+
+        doc = documents.CompressedHTMLDocument.from_es({'_id': '1', '_source': source})
+        self.assertEqual(doc.html, '<p>Ünïcödé</p>' * 100)
@@ -0,0 +1,371 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from yurika.mortar import documents, models
+
+
+def sentence(elastic_id, document_id):
+    return mock.Mock(meta=mock.Mock(id=elastic_id), document_id=document_id, text='text')
+
+
+def document(elastic_id):
+    return mock.Mock(meta=mock.Mock(id=elastic_id), url='http://example.com', timestamp=timezone.now(), text='text')
+
+
+class CrawlerTaskTests(TestCase):
+
+    def setUp(self):
+        with mock.patch.object(documents.Document, 'init'):
+            self.crawler = models.Crawler.objects.create(start_urls='http://example.com')
+        self.task = self.crawler.task
+
+    @mock.patch.object(models.CrawlerTask, 'STATS_HISTORY', 2)
+    def test_save_stats(self):
+        self.assertIsNone(self.task.latest_stats)
+
+        for pages in [10, 20, 30]:
+            self.task.save_stats(pages=pages)
+
+        # only the latest snapshots are kept
+        self.assertEqual(list(self.task.stats.values_list('pages', flat=True)), [30, 20])
+        self.assertEqual(self.task.latest_stats.pages, 30)
+
+    def test_prefetch_latest_stats(self):
+        for pages in [10, 20]:
+            self.task.save_stats(pages=pages)
+
+        crawler = models.Crawler.objects.select_related('task') \
+            .prefetch_related(models.CrawlerTask.prefetch_latest_stats('task__stats')) \
+            .get()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(crawler.task.latest_stats.pages, 20)
+
+
+class AnnotationTestCase(TransactionTestCase):
+    # a transaction test case, as slices store their chunks from other threads
+
+    def setUp(self):
+        with mock.patch.object(documents.Document, 'init'):
+            self.crawler = models.Crawler.objects.create(start_urls='http://example.com')
+
+        self.documents = {f'd{i}': document(f'd{i}') for i in range(5)}
+        self.tokenizer = mock.Mock()
+        self.tokenizer.documents.mget.side_effect = self.mget
+        self.search = self.tokenizer.sentences.search.return_value.update_from_dict.return_value
+
+        patcher = mock.patch.object(models.Crawler, 'sentencetokenizer', self.tokenizer, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mget(self, ids, missing=None):
+        return [self.documents[i] for i in ids if i in self.documents]
+
+    def scan(self, sentences):
+        self.search.params.return_value.scan.side_effect = lambda: iter(sentences)
+
+    def scan_slices(self, sentences, slices):
+        def extra(slice):
+            search = mock.Mock()
+            search.params.return_value.scan.side_effect = lambda: iter(sentences[slice['id']::slice['max']])
+            return search
+        self.search.extra.side_effect = extra
+
+    def annotation(self, **kwargs):
+        return models.Annotation.objects.create(crawler=self.crawler, query='{}', **kwargs)
+
+    def assertStored(self, annotation, sentences, documents):
+        self.assertCountEqual(annotation.sentence_set.values_list('elastic_id', flat=True), sentences)
+        self.assertCountEqual(annotation.document_set.values_list('elastic_id', flat=True), documents)
+
+
+class AnnotationSlicesTests(AnnotationTestCase):
+
+    def test_shared_documents(self):
+        sentences = [sentence(f's{i}', f'd{i % 5}') for i in range(60)]
+        self.scan_slices(sentences, 4)
+        annotation = self.annotation(slices=4)
+
+        annotation.execute(chunk_size=4)
+
+        # each slice matches every document, which are only stored once
+        self.assertStored(annotation, [f's{i}' for i in range(60)], list(self.documents))
+        for document in annotation.document_set.all():
+            self.assertEqual(document.sentence_set.count(), 12)
+
+    def test_stored_sentences(self):
+        sentences = [sentence(f's{i}', f'd{i % 5}') for i in range(20)]
+        self.scan_slices(sentences[:10], 2)
+        annotation = self.annotation(slices=2)
+        annotation.execute(chunk_size=3)
+
+        # the already stored sentences are rescanned, as when an execution is resumed
+        self.scan_slices(sentences, 2)
+        annotation.refreshed_at = None
+        annotation.execute(chunk_size=3)
+        self.assertStored(annotation, [f's{i}' for i in range(20)], list(self.documents))
+
+    def test_failed_slice(self):
+        processed = []
+        failed = threading.Event()
+
+        def progress(count):
+            processed.append(count)
+            if len(processed) == 2:
+                failed.set()
+                raise ValueError('failed')
+
+        sentences = [sentence(f's{i}', f'd{i % 5}') for i in range(400)]
+        self.scan_slices(sentences, 4)
+        annotation = self.annotation(slices=4)
+
+        with self.assertRaisesRegex(ValueError, 'failed'):
+            annotation.execute(chunk_size=2, progress=progress)
+
+        # the other slices stop after their current chunk
+        self.assertTrue(failed.is_set())
+        self.assertLess(len(processed), 40)
+        self.assertLess(annotation.sentence_set.count(), 80)
+        self.assertIsNone(annotation.refreshed_at)
+
+
+class AnnotationDocumentsTests(AnnotationTestCase):
+
+    def test_documents(self):
+        # the documents of other annotations aren't matched
+        other = self.annotation()
+        models.Document.objects.create(
+            annotation=other, elastic_id='d0', url='http://example.com', timestamp=timezone.now(), text='text',
+        )
+
+        self.scan([sentence(f's{i}', f'd{i % 5}') for i in range(10)])
+        annotation = self.annotation()
+        annotation.execute()
+
+        self.assertStored(annotation, [f's{i}' for i in range(10)], list(self.documents))
+        for s in annotation.sentence_set.select_related('document'):
+            self.assertEqual(s.document.annotation, annotation)
+            self.assertEqual(f'd{int(s.elastic_id[1:]) % 5}', s.document.elastic_id)
+
+    def test_returned_pks(self):
+        def bulk_create(objs, batch_size=None):
+            for obj in objs:
+                obj.save()
+            return objs
+
+        self.scan([sentence(f's{i}', f'd{i % 5}') for i in range(10)])
+        annotation = self.annotation()
+
+        # the pks returned by the bulk insert are used, instead of querying the documents
+        with mock.patch.object(models.Document.objects, 'bulk_create', side_effect=bulk_create), \
+                mock.patch.object(models.Annotation, '_document_ids', autospec=True,
+                                  side_effect=models.Annotation._document_ids) as document_ids:
+            annotation.execute()
+
+        self.assertEqual(document_ids.call_count, 2)
+        self.assertStored(annotation, [f's{i}' for i in range(10)], list(self.documents))
+
+    def test_fallback_pks(self):
+        self.scan([sentence(f's{i}', f'd{i % 5}') for i in range(10)])
+        annotation = self.annotation()
+
+        # sqlite doesn't return the pks of a bulk insert
+        with mock.patch.object(models.Annotation, '_document_ids', autospec=True,
+                               side_effect=models.Annotation._document_ids) as document_ids:
+            annotation.execute()
+
+        self.assertEqual(document_ids.call_count, 3)
+        self.assertStored(annotation, [f's{i}' for i in range(10)], list(self.documents))
+
+    def test_missing_document(self):
+        self.scan([sentence('s0', 'd0'), sentence('s1', 'deleted'), sentence('s2', 'd1')])
+        annotation = self.annotation()
+        annotation.execute()
+
+        self.assertStored(annotation, ['s0', 's2'], ['d0', 'd1'])
+
+
+class AnnotationChunksTests(AnnotationTestCase):
+
+    def test_chunk_transaction(self):
+        self.scan([sentence(f's{i}', f'd{i}') for i in range(4)])
+        annotation = self.annotation()
+
+        bulk_create = models.Sentence.objects.bulk_create
+
+        def fail_second(objs, **kwargs):
+            if fail_second.called:
+                raise ValueError('failed')
+            fail_second.called = True
+            return bulk_create(objs, **kwargs)
+        fail_second.called = False
+
+        with mock.patch.object(models.Sentence.objects, 'bulk_create', side_effect=fail_second):
+            with self.assertRaisesRegex(ValueError, 'failed'):
+                annotation.execute(chunk_size=2)
+
+        # the first chunk was committed, and the failed chunk was rolled back
+        self.assertStored(annotation, ['s0', 's1'], ['d0', 'd1'])
+
+    def test_resume(self):
+        sentences = [sentence(f's{i}', f'd{i % 5}') for i in range(10)]
+        self.scan(sentences)
+        annotation = self.annotation()
+
+        def progress(count):
+            raise models.Task.Abort
+
+        with self.assertRaises(models.Task.Abort):
+            annotation.execute(chunk_size=3, progress=progress)
+        self.assertStored(annotation, ['s0', 's1', 's2'], ['d0', 'd1', 'd2'])
+
+        # the stored sentences and documents are skipped
+        self.tokenizer.documents.mget.reset_mock()
+        annotation.execute(chunk_size=3)
+
+        self.assertStored(annotation, [f's{i}' for i in range(10)], list(self.documents))
+        fetched = [i for args, _ in self.tokenizer.documents.mget.call_args_list for i in args[0]]
+        self.assertCountEqual(fetched, ['d3', 'd4'])
+
+
+class AnnotationTaskTests(AnnotationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.task = self.annotation().task
+        self.task.status = models.Task.STATUS.running
+        self.task.started_at = timezone.now() - timedelta(seconds=10)
+        self.task.total = 1000
+        self.task.save()
+
+    def test_progress(self):
+        self.task.progress(100)
+        self.task.progress(100)
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.processed, 200)
+        self.assertAlmostEqual(self.task.rate, 20, delta=1)
+
+    def test_progress_revoked(self):
+        models.AnnotationTask.objects.filter(pk=self.task.pk).update(revoked=True)
+
+        # progress is saved before the task is aborted
+        with self.assertRaises(models.Task.Abort):
+            self.task.progress(100)
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.processed, 100)
+
+    def test_eta(self):
+        self.assertIsNone(self.task.eta)
+
+        self.task.processed, self.task.rate = 200, 20
+        self.assertEqual(self.task.eta, timedelta(seconds=40))
+
+        self.task.total = None
+        self.assertIsNone(self.task.eta)
+
+
+class AnnotationRefreshTests(AnnotationTestCase):
+
+    def test_search(self):
+        annotation = self.annotation()
+        self.assertIs(annotation.search(), self.search)
+
+        # only the sentences tokenized since the last execution are searched
+        annotation.refreshed_at = timezone.now()
+        self.assertIs(annotation.search(), self.search.filter.return_value)
+        self.search.filter.assert_called_once_with('range', timestamp={
+            'gte': annotation.refreshed_at - annotation.REFRESH_OVERLAP,
+        })
+
+    def test_execute(self):
+        self.scan([sentence('s0', 'd0')])
+        annotation = self.annotation()
+
+        before = timezone.now()
+        annotation.execute()
+        annotation.refresh_from_db()
+        self.assertGreaterEqual(annotation.refreshed_at, before)
+
+    def test_abort(self):
+        def progress(count):
+            raise models.Task.Abort
+
+        self.scan([sentence('s0', 'd0')])
+        annotation = self.annotation()
+
+        with self.assertRaises(models.Task.Abort):
+            annotation.execute(progress=progress)
+
+        # the next refresh resumes the execution
+        annotation.refresh_from_db()
+        self.assertIsNone(annotation.refreshed_at)
+
+    def test_refresh(self):
+        annotation = self.annotation()
+        annotation.task.log_error('first')
+        models.AnnotationTask.objects.filter(pk=annotation.task.pk).update(status=models.Task.STATUS.failed)
+
+        annotation.refresh()
+
+        task = models.AnnotationTask.objects.get(annotation=annotation)
+        self.assertEqual(task.status, models.Task.STATUS.enqueued)
+        self.assertEqual([error.message for error in task.errors.all()], ['first'])
+
+        with self.assertRaisesRegex(RuntimeError, 'already running'):
+            annotation.refresh()
+        self.assertEqual(models.AnnotationTask.objects.get().pk, task.pk)
+
+    def test_refresh_on_commit(self):
+        annotation = self.annotation()
+        models.AnnotationTask.objects.filter(pk=annotation.task.pk).update(status=models.Task.STATUS.failed)
+
+        with mock.patch.object(models.AnnotationTask, 'send') as send:
+            with transaction.atomic():
+                annotation.refresh(delay=10)
+
+                # nothing is sent before the new task is committed
+                send.assert_not_called()
+            send.assert_called_once_with(delay=10)
+
+
+class SentenceTokenizerTests(TransactionTestCase):
+
+    def setUp(self):
+        with mock.patch.object(documents.Document, 'init'):
+            self.crawler = models.Crawler.objects.create(start_urls='http://example.com')
+        self.tokenizer = models.SentenceTokenizer(crawler=self.crawler)
+
+        crawled = mock.PropertyMock()
+        patcher = mock.patch.multiple(
+            models.SentenceTokenizer,
+            documents=crawled,
+            tokenize_many=mock.DEFAULT,
+            save=mock.DEFAULT,
+        )
+        self.mocks = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.search = crawled.return_value.search.return_value
+
+    def test_refresh(self):
+        before = timezone.now()
+        self.tokenizer.refresh()
+
+        self.search.filter.assert_not_called()
+        self.mocks['tokenize_many'].assert_called_once_with(self.search.scan.return_value)
+        self.assertGreaterEqual(self.tokenizer.tokenized_at, before)
+
+        # only the documents crawled since the last refresh are tokenized
+        tokenized_at = self.tokenizer.tokenized_at
+        self.tokenizer.refresh()
+
+        self.search.filter.assert_called_once_with('range', timestamp={
+            'gte': tokenized_at - self.tokenizer.TOKENIZE_OVERLAP,
+        })
+        self.mocks['tokenize_many'].assert_called_with(self.search.filter.return_value.scan.return_value)
@@ -0,0 +1,294 @@
+import signal
+from unittest import TestCase, mock
+
+from django.test import TransactionTestCase
+from dramatiq.middleware import Shutdown
+from redis import RedisError
+
+from yurika.mortar import documents, models, tasks
+
+from .test_models import AnnotationTestCase, sentence
+
+
+def task(revoked=False, channel='revoke'):
+    return mock.Mock(revoked=revoked, revoke_channel=channel)
+
+
+class RevocationListenerTestCase(TestCase):
+
+    def listener(self, watched, client=None, **kwargs):
+        with mock.patch('yurika.mortar.models.broker_client', return_value=client):
+            listener = tasks.RevocationListener(watched, **kwargs)
+        self.addCleanup(listener.close)
+        return listener
+
+    def test_fallback_poll(self):
+        # the stub broker doesn't have a redis client
+        t = task()
+        listener = self.listener([t], fallback_interval=0)
+
+        self.assertEqual(listener.wait(0), [])
+        t.revoked = True
+        self.assertEqual(listener.wait(0), [t])
+        self.assertEqual(t.refresh_from_db.call_count, 2)
+
+    def test_push(self):
+        t = task()
+        client = mock.Mock()
+        pubsub = client.pubsub.return_value
+        pubsub.get_message.return_value = None
+        listener = self.listener([t], client)
+
+        pubsub.subscribe.assert_called_once_with('revoke')
+        self.assertEqual(listener.wait(.05), [])
+        pubsub.get_message.assert_called_once_with(timeout=.05)
+
+        pubsub.get_message.return_value = {'type': 'message', 'channel': b'revoke', 'data': b'1'}
+        self.assertEqual(listener.wait(.05), [t])
+        self.assertTrue(t.revoked)
+
+        listener.close()
+        pubsub.close.assert_called_once_with()
+
+    def test_slow_poll(self):
+        t = task()
+        client = mock.Mock(**{'pubsub.return_value.get_message.return_value': None})
+        listener = self.listener([t], client, poll_interval=60)
+
+        for _ in range(5):
+            listener.wait(0)
+        t.refresh_from_db.assert_called_once_with(fields=['revoked'])
+
+        # revocations that weren't pushed are found by the next poll
+        t.revoked = True
+        listener.polled -= 60
+        self.assertTrue(listener.wait(0))
+
+    def test_redis_error(self):
+        t = task()
+        client = mock.Mock()
+        pubsub = client.pubsub.return_value
+        pubsub.get_message.side_effect = RedisError
+        listener = self.listener([t], client, poll_interval=60, fallback_interval=0)
+
+        # the connection error isn't raised, and the DB is polled instead
+        self.assertEqual(listener.wait(.05), [])
+        pubsub.close.assert_called_once_with()
+        self.assertIsNone(listener.pubsub)
+        self.assertEqual(listener.poll_interval, 0)
+        self.assertEqual(t.refresh_from_db.call_count, 2)
+
+        t.revoked = True
+        self.assertEqual(listener.wait(0), [t])
+
+    def test_subscribe_error(self):
+        t = task()
+        client = mock.Mock(**{'pubsub.return_value.subscribe.side_effect': RedisError})
+        listener = self.listener([t], client, fallback_interval=0)
+
+        self.assertIsNone(listener.pubsub)
+        self.assertEqual(listener.wait(0), [])
+
+    def test_many(self):
+        first, second = task(channel='first'), task(channel='second')
+        client = mock.Mock()
+        pubsub = client.pubsub.return_value
+        pubsub.get_message.return_value = {'type': 'message', 'channel': b'second', 'data': b'2'}
+        listener = self.listener([first, second], client)
+
+        pubsub.subscribe.assert_called_once_with('first', 'second')
+        self.assertEqual(listener.wait(0), [second])
+        self.assertFalse(first.revoked)
+
+        # revoked tasks are returned until they're discarded
+        pubsub.get_message.return_value = None
+        self.assertEqual(listener.wait(0), [second])
+        listener.discard(second)
+        pubsub.unsubscribe.assert_called_once_with('second')
+        self.assertEqual(listener.wait(0), [])
+
+
+class StopCrawlTestCase(TestCase):
+
+    def process(self, exits):
+        proc = mock.Mock(exitcode=None, pid=1234)
+
+        def join(timeout=None):
+            if exits or timeout is None:
+                proc.exitcode = 0 if exits else -9
+        proc.join.side_effect = join
+        return proc
+
+    @mock.patch('os.kill')
+    def test_graceful(self, kill):
+        proc, stop = self.process(exits=True), mock.Mock()
+
+        self.assertFalse(tasks.stop_crawl(proc, stop, 30))
+        stop.set.assert_called_once_with()
+        proc.join.assert_called_once_with(30)
+        kill.assert_not_called()
+
+    @mock.patch('os.kill')
+    def test_killed(self, kill):
+        proc, stop = self.process(exits=False), mock.Mock()
+
+        self.assertTrue(tasks.stop_crawl(proc, stop, 30))
+        kill.assert_called_once_with(1234, signal.SIGKILL)
+        self.assertEqual(proc.exitcode, -9)
+
+
+class FakeHost(object):
+
+    def __init__(self, max_jobs=0):
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.busy = False
+        self.closed = False
+        self.proc = mock.Mock(exitcode=None)
+
+    @property
+    def reusable(self):
+        return not self.busy and not (self.max_jobs and self.jobs >= self.max_jobs)
+
+    def close(self):
+        self.closed = True
+
+
+@mock.patch('yurika.mortar.tasks.CrawlHost', FakeHost)
+class CrawlHostPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.pool = tasks.CrawlHostPool()
+
+    def test_reuse(self):
+        with self.pool.acquire(max_jobs=3) as host:
+            host.jobs += 1
+
+        with self.pool.acquire(max_jobs=3) as other:
+            self.assertIs(other, host)
+
+    def test_concurrent(self):
+        with self.pool.acquire() as host:
+            with self.pool.acquire() as other:
+                self.assertIsNot(other, host)
+
+        self.assertEqual(self.pool.idle.qsize(), 2)
+
+    def test_recycle(self):
+        with self.pool.acquire(max_jobs=1) as host:
+            host.jobs += 1
+
+        # the recycled host is replaced by a new host
+        self.assertTrue(host.closed)
+        with self.pool.acquire(max_jobs=1) as other:
+            self.assertIsNot(other, host)
+            self.assertEqual(other.jobs, 0)
+
+    def test_killed(self):
+        with self.pool.acquire() as host:
+            host.busy = True
+
+        self.assertTrue(host.closed)
+        self.assertEqual(self.pool.idle.qsize(), 0)
+
+    def test_exited(self):
+        with self.pool.acquire() as host:
+            pass
+
+        # the idle host exited, and is replaced by a new host
+        host.proc.exitcode = -9
+        with self.pool.acquire() as other:
+            self.assertIsNot(other, host)
+        self.assertTrue(host.closed)
+        self.assertEqual(self.pool.idle.qsize(), 1)
+
+    def test_close(self):
+        with self.pool.acquire() as host:
+            pass
+
+        self.pool.close()
+        self.assertTrue(host.closed)
+        self.assertEqual(self.pool.idle.qsize(), 0)
+
+
+class StubbornHost(object):
+    # a crawl host whose crawls ignore the requests to stop
+
+    def __init__(self, max_jobs=0):
+        self.active = set()
+        self.killed = False
+        self.closed = False
+
+    def start(self, task_id):
+        self.active.add(task_id)
+
+    def running(self, task_id):
+        return task_id in self.active
+
+    def request_stop(self, task_id):
+        pass
+
+    def kill(self):
+        self.killed = True
+        self.active.clear()
+
+    def error(self, task_id):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+class CrawlManyTestCase(TransactionTestCase):
+
+    def setUp(self):
+        with mock.patch.object(documents.Document, 'init'):
+            self.crawlers = [
+                models.Crawler.objects.create(start_urls='http://example.com', config={'CRAWLER_STOP_TIMEOUT': 0})
+                for _ in range(2)
+            ]
+
+    def test_killed(self):
+        revoked, other = [crawler.task for crawler in self.crawlers]
+        revoked.revoked = True
+        revoked.save()
+
+        host = StubbornHost()
+        with mock.patch('yurika.mortar.tasks.CrawlHost', return_value=host):
+            with self.assertRaises(models.Task.Abort):
+                tasks.crawl_many.fn([revoked.pk, other.pk])
+
+        # the whole host is killed, along with the crawl that was not revoked
+        self.assertTrue(host.killed)
+        self.assertTrue(host.closed)
+        self.assertEqual(revoked.errors.get().message, 'Crawler did not stop within 0 seconds, and was killed.')
+        self.assertEqual(other.errors.get().message,
+                         'Crawler was killed, as another crawl in its process did not stop.')
+
+
+class AnnotateTestCase(AnnotationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.task = self.annotation().task
+        self.task.status = models.Task.STATUS.running
+        self.task.save()
+
+    def test_annotate(self):
+        self.search.count.return_value = 10
+        self.scan([sentence(f's{i}', f'd{i % 5}') for i in range(10)])
+
+        tasks.annotate.fn(self.task.pk)
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.total, 10)
+        self.assertEqual(self.task.processed, 10)
+        self.assertEqual(self.task.annotation.sentence_set.count(), 10)
+
+    def test_shutdown(self):
+        self.search.count.return_value = 10
+        self.search.params.return_value.scan.side_effect = Shutdown
+
+        with self.assertRaises(models.Task.Abort):
+            tasks.annotate.fn(self.task.pk)
+        self.assertEqual(self.task.errors.get().message, 'Dramatiq process terminated.')
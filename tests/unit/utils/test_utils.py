@@ -21,3 +21,25 @@ class HumanizeTimedeltaTests(TestCase):
         for td, expected in testcases:
             with self.subTest(timedelta=td, expected_output=expected):
                 self.assertEqual(utils.humanize_timedelta(td), expected)
+
+
+class ChunkedTests(TestCase):
+    def test_output(self):
+        testcases = [
+            (range(5), 2, [[0, 1], [2, 3], [4]]),
+            (range(4), 2, [[0, 1], [2, 3]]),
+            (range(2), 5, [[0, 1]]),
+            (range(0), 5, []),
+        ]
+
+        for iterable, size, expected in testcases:
+            with self.subTest(iterable=iterable, size=size, expected_output=expected):
+                self.assertEqual(list(utils.chunked(iterable, size)), expected)
+
+    def test_lazy(self):
+        def iterable():
+            yield 1
+            raise AssertionError('iterated past the first chunk')
+
+        chunks = utils.chunked(iterable(), 1)
+        self.assertEqual(next(chunks), [1])